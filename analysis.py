@@ -16,6 +16,8 @@ load_dotenv()
 
 from statics import DATE_RANGES
 from utils import parseBool
+from setup_db import SetupDatabase
+from setup_features import T0_COLUMNS, T1_COLUMNS
 
 import logging
 from sys import stdout
@@ -39,23 +41,16 @@ logging.basicConfig(
 # Initialize the app
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
-# Try to load the setups
-df:pd.DataFrame = pd.DataFrame()
-try:
-    df = pd.read_json('setups.json')
-    df['time'] = pd.to_datetime(df['time']*1000000)
-except:
-    logging.warning('No setups.json file found!')
+# Setups are queried on demand, only the filter options are loaded at start
+db = SetupDatabase('setups.db')
+if db.count() == 0:
+    logging.warning('No setups in setups.db, start the chart window once to import setups.json!')
 
-STRATEGIES = df['strategy'].unique().tolist()
-TICKERS = df['ticker'].unique().tolist()
+STRATEGIES = db.distinct('strategy')
+TICKERS = db.distinct('ticker')
 TICKERS = ['ALL TICKERS'] + TICKERS
-TIMEFRAMES = df['timeframe'].unique().tolist()
+TIMEFRAMES = db.distinct('timeframe')
 
-T0_COLUMNS = ['GAP_PC','CHANGE_PC','ATR_RISING','BB_PC','KC_INSIDE_BB','BB_PC_RISING','ADX','DMIP','DMIM','ADX_RISING','DMIP_RISING','DMIM_RISING','DMI_DIFFERENCE','RSI','RSI_RISING','VOL_SMA_RISING','VOL_MULTIPLE','PSAR_BULL','EMA_RISING','SMA_RISING','OVER_EMA','OVER_SMA','EMA_OVER_SMA','INSIDE_CANDLE','OUTSIDE_CANDLE','CANDLE_TYPE']
-T1_COLUMNS = ['pCHANGE_PC','pPSAR_BULL','pCANDLE_TYPE','pBB_PC','pKC_INSIDE_BB','pADX','pDMIP','pDMIM','pDMI_DIFFERENCE','pRSI','pVOL_MULTIPLE','pOVER_EMA','pOVER_SMA','pEMA_OVER_SMA']
-
-print(df)
 
 # App layout
 app.layout = html.Div([
@@ -104,7 +99,7 @@ app.layout = html.Div([
                         dcc.Dropdown(options=TIMEFRAMES, value=TIMEFRAMES[0] if len(TIMEFRAMES) > 0 else None, id='dropdown-timeframe', placeholder='Select a timeframe...'),
                         dbc.Button(id='button-show', children=[
                             'Show Data',
-                            dbc.Badge(id='badge-show-data', children=[f'{len(df)}'], color='light', text_color='primary', className='ms-1'),
+                            dbc.Badge(id='badge-show-data', children=[f'{db.count()}'], color='light', text_color='primary', className='ms-1'),
                         ]),
                     ], gap=2)
                 ], style={'padding':10, 'margin':10})
@@ -236,13 +231,15 @@ def onButtonShowClick(direction:str, type:str, strategy:str, ticker:str, startDa
         startDate = datetime.fromisoformat(startDateStr)
         endDate = datetime.fromisoformat(endDateStr)
 
-        filteredDf = df[
-            (df['ticker'] != '' if ticker == 'ALL TICKERS' else df['ticker'] == ticker) &
-            (df['strategy'] == strategy) &
-            (df['direction'] == direction) &
-            (df['time'].between(startDate, endDate)) &
-            (df['timeframe'] == timeframe)
-        ]
+        filteredDf = db.query(
+            ticker=None if ticker == 'ALL TICKERS' else ticker,
+            strategy=strategy,
+            timeframe=timeframe,
+            direction=direction,
+            start=startDate,
+            end=endDate
+        )
+        filteredDf['time'] = pd.to_datetime(filteredDf['time']*1000000)
         nSetups = f'{len(filteredDf)}'
 
         fig_t0 = generateMultipleHistograms(filteredDf, T0_COLUMNS, height=1650)
@@ -9,6 +9,10 @@ load_dotenv()
 
 from window import Window
 from ib_client import IBClient
+from replay_client import ReplayClient, replaySource
+from metrics import METRICS
+from profiler import PROFILER
+from utils import parseBool
 
 from log_config import CustomLogFormat, FORMAT
 
@@ -36,9 +40,25 @@ async def main():
         dataQueue = asyncio.Queue()
         loop = asyncio.get_running_loop()
 
-        client = IBClient(dataQueue, loop, port=int(os.environ.get('TWS_PORT')))
+        if os.environ.get('REPLAY_SOURCE', '') != '':
+            # Work without TWS, bars come from a recorded bar store or a generator
+            client = ReplayClient(dataQueue, loop, source=replaySource(os.environ.get('REPLAY_SOURCE')), candleCacheMB=int(os.environ.get('CANDLE_CACHE_MB', 512)),
+                                  latency=float(os.environ.get('REPLAY_LATENCY', 0.0)))
+        else:
+            client = IBClient(dataQueue, loop, port=int(os.environ.get('TWS_PORT')), storePath=os.environ.get('BAR_STORE_PATH', 'barstore'), candleCacheMB=int(os.environ.get('CANDLE_CACHE_MB', 512)))
 
-        window = Window(client)
+        if parseBool(os.environ.get('METRICS', 'false')):
+            # Latency histograms, ctrl+l writes them to METRICS_FILE
+            METRICS.start(os.environ.get('METRICS_FILE', 'metrics.json'), float(os.environ.get('METRICS_INTERVAL', 60)), int(os.environ.get('METRICS_PORT', 0)))
+
+        # Sampling profiler of the loop and the IB reader thread, ctrl+p starts and stops a session
+        PROFILER.configure(directory=os.environ.get('PROFILE_DIR', 'profiles'), interval=float(os.environ.get('PROFILE_INTERVAL_MS', 10))/1000,
+                           blockThreshold=float(os.environ.get('PROFILE_BLOCK_MS', 100))/1000, callbackThreshold=float(os.environ.get('PROFILE_CALLBACK_MS', 50))/1000)
+        PROFILER.attach(loop, client)
+        if parseBool(os.environ.get('PROFILE', 'false')):
+            PROFILER.start()
+
+        window = Window(client, indicatorCacheMB=int(os.environ.get('INDICATOR_CACHE_MB', 256)), prefetchDays=int(os.environ.get('PREFETCH_DAYS', 2)))
         # Start the async processor
         task = asyncio.create_task(window.run())
 
@@ -49,6 +69,8 @@ async def main():
 
         logger.info('Disconnecting from client...')
         client.close()
+        PROFILER.stop()
+        METRICS.stop()
 
     except KeyboardInterrupt:
         logger.warning('Keyboard interrupt, shutting down...')
@@ -0,0 +1,176 @@
+import time
+from datetime import date
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from ibapi.common import BarData
+
+from bar_store import BAR_COLUMNS, EPOCH
+
+
+EPOCH_ORDINAL = EPOCH.toordinal()
+# Daily bars are placed at 15:30 like before
+DAILY_BAR_OFFSET = 15*3600 + 30*60
+
+
+def isDailyFormat(barDate:str) -> bool:
+    """IB sends "20200921" for daily bars and epoch seconds for intraday bars (formatDate=2)."""
+    return len(barDate) == 8 and barDate.startswith(('19', '20'))
+
+
+def parseBarTime(barDate:str, daily:bool) -> int:
+    """Convert an IB bar date to local wall clock seconds.
+
+    Args:
+        barDate (str): Date string of the bar.
+        daily (bool): Result of isDailyFormat for this request.
+
+    Returns:
+        int: Wall clock seconds since 1970-01-01 00:00:00.
+    """
+    if daily:
+        d = date(int(barDate[0:4]), int(barDate[4:6]), int(barDate[6:8]))
+        return (d.toordinal() - EPOCH_ORDINAL)*86400 + DAILY_BAR_OFFSET
+    ts = int(barDate)
+    return ts + time.localtime(ts).tm_gmtoff
+
+
+def columnsToFrame(columns:Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Build the chart DataFrame from bar columns without copying the price columns.
+
+    Args:
+        columns (Dict[str, np.ndarray]): Bar columns with **time** as wall clock seconds.
+
+    Returns:
+        pd.DataFrame: DataFrame with datetime **time** column.
+    """
+    data = {c: columns[c] for c in BAR_COLUMNS[1:]}
+    data['time'] = columns['time'].astype('datetime64[s]').astype('datetime64[ns]')
+    return pd.DataFrame(data, columns=BAR_COLUMNS, copy=False)
+
+
+class BarBuffer():
+    """Growable column oriented bar buffer backed by preallocated NumPy arrays."""
+
+    def __init__(self, capacity:int=1024):
+        self.size:int = 0
+        self.daily:Optional[bool] = None	# Date format, detected with the first bar
+        self.shared:bool = False	# Arrays belong to someone else, copied before the first change
+        self.time = np.empty(capacity, dtype=np.int64)
+        self.open = np.empty(capacity, dtype=np.float64)
+        self.high = np.empty(capacity, dtype=np.float64)
+        self.low = np.empty(capacity, dtype=np.float64)
+        self.close = np.empty(capacity, dtype=np.float64)
+        self.volume = np.empty(capacity, dtype=np.int64)
+
+
+    def __len__(self) -> int:
+        return self.size
+
+
+    @staticmethod
+    def fromColumns(columns:Dict[str, np.ndarray]) -> 'BarBuffer':
+        n = len(columns['time'])
+        buffer = BarBuffer(max(1024, 2*n))
+        for c in BAR_COLUMNS:
+            getattr(buffer, c)[:n] = columns[c]
+        buffer.size = n
+        return buffer
+
+
+    @staticmethod
+    def wrap(columns:Dict[str, np.ndarray]) -> 'BarBuffer':
+        """Buffer over existing bar columns without copying them.
+
+        The columns are only copied when a bar is appended or replaced, so
+        received bars can be shown without touching them.
+        """
+        buffer = BarBuffer(0)
+        for c in BAR_COLUMNS:
+            setattr(buffer, c, columns[c])
+        buffer.size = len(columns['time'])
+        buffer.shared = True
+        return buffer
+
+
+    def nbytes(self) -> int:
+        """Allocated memory including the unused capacity."""
+        return sum(getattr(self, c).nbytes for c in BAR_COLUMNS)
+
+
+    def grow(self) -> None:
+        capacity = max(1024, 2*len(self.time))
+        for c in BAR_COLUMNS:
+            old = getattr(self, c)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, c, new)
+        self.shared = False
+
+
+    def barTime(self, bar:BarData) -> int:
+        if self.daily == None:
+            self.daily = isDailyFormat(bar.date)
+        return parseBarTime(bar.date, self.daily)
+
+
+    def set(self, i:int, time:int, open:float, high:float, low:float, close:float, volume:int) -> None:
+        self.time[i] = time
+        self.open[i] = open
+        self.high[i] = high
+        self.low[i] = low
+        self.close[i] = close
+        self.volume[i] = volume
+
+
+    def appendValues(self, time:int, open:float, high:float, low:float, close:float, volume:int) -> None:
+        if self.shared or self.size == len(self.time):
+            self.grow()
+        self.set(self.size, time, open, high, low, close, volume)
+        self.size += 1
+
+
+    def replaceLastValues(self, time:int, open:float, high:float, low:float, close:float, volume:int) -> None:
+        if self.shared:
+            self.grow()
+        self.set(self.size-1, time, open, high, low, close, volume)
+
+
+    def append(self, bar:BarData, t:int=None) -> None:
+        self.appendValues(self.barTime(bar) if t == None else t, bar.open, bar.high, bar.low, bar.close, int(bar.volume))
+
+
+    def replaceLast(self, bar:BarData, t:int=None) -> None:
+        self.replaceLastValues(self.barTime(bar) if t == None else t, bar.open, bar.high, bar.low, bar.close, int(bar.volume))
+
+
+    def lastTime(self) -> Optional[int]:
+        return int(self.time[self.size-1]) if self.size > 0 else None
+
+
+    def lastBar(self) -> dict:
+        """Last bar as dict with **time** as wall clock seconds."""
+        i = self.size-1
+        return {
+            'time': int(self.time[i]),
+            'open': float(self.open[i]),
+            'high': float(self.high[i]),
+            'low': float(self.low[i]),
+            'close': float(self.close[i]),
+            'volume': int(self.volume[i])
+        }
+
+
+    def columns(self, copy:bool=False) -> Dict[str, np.ndarray]:
+        """Column views of the filled part of the buffer.
+
+        Args:
+            copy (bool, optional): Return copies which are not affected by later updates. Defaults to False.
+
+        Returns:
+            Dict[str, np.ndarray]: Column name -> array.
+        """
+        if copy:
+            return {c: getattr(self, c)[:self.size].copy() for c in BAR_COLUMNS}
+        return {c: getattr(self, c)[:self.size] for c in BAR_COLUMNS}
@@ -0,0 +1,285 @@
+import os
+import json
+import math
+import logging
+import threading
+from zoneinfo import ZoneInfo
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
+
+from budget_cache import BudgetCache
+from trading_calendar import NYSE, EXCHANGE_TZ
+
+
+BAR_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+# Approximate calendar length of the IB duration units
+DURATION_UNITS = {
+    'S': timedelta(seconds=1),
+    'D': timedelta(days=1),
+    'W': timedelta(weeks=1),
+    'M': timedelta(days=31),
+    'Y': timedelta(days=366)
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def toWallSeconds(dt:datetime) -> int:
+    """Convert a datetime to local wall clock seconds since the (naive) epoch.
+
+    Bars are handled as naive local datetimes all over the application, so the
+    store keeps the same wall clock instead of UTC.
+
+    Args:
+        dt (datetime): Naive local or timezone aware datetime.
+
+    Returns:
+        int: Wall clock seconds since 1970-01-01 00:00:00.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return int((dt - EPOCH).total_seconds())
+
+
+def fromWallSeconds(ts:int) -> datetime:
+    return EPOCH + timedelta(seconds=int(ts))
+
+
+def parseEndDate(endDate:str) -> datetime:
+    """Parse an IB endDateTime string like "20250802 23:59:59 US/Eastern".
+
+    Args:
+        endDate (str): IB end date, empty string means now.
+
+    Returns:
+        datetime: Naive local datetime.
+    """
+    if endDate == None or endDate == '':
+        return datetime.now()
+    parts = endDate.strip().split(' ')
+    dt = datetime.strptime(' '.join(parts[:2]), '%Y%m%d %H:%M:%S')
+    if len(parts) > 2:
+        dt = dt.replace(tzinfo=ZoneInfo(parts[2])).astimezone().replace(tzinfo=None)
+    return dt
+
+
+def formatEndDate(dt:datetime, tz:str='US/Eastern') -> str:
+    """Format a naive local datetime as IB endDateTime string."""
+    return dt.astimezone(ZoneInfo(tz)).strftime(f'%Y%m%d %H:%M:%S {tz}')
+
+
+def parseDuration(duration:str) -> Tuple[int, str]:
+    """Split an IB duration string like "5 Y" into (5, 'Y')."""
+    n, unit = duration.strip().split(' ')
+    unit = unit.upper()
+    if unit not in DURATION_UNITS:
+        raise ValueError(f'Unknown duration unit "{unit}"')
+    return int(n), unit
+
+
+def durationToTimedelta(duration:str) -> timedelta:
+    n, unit = parseDuration(duration)
+    return n * DURATION_UNITS[unit]
+
+
+def timedeltaToDuration(delta:timedelta) -> str:
+    """Smallest IB duration string which covers the given time span.
+
+    Days are used up to one year because IB rejects longer day durations.
+    """
+    days = max(1, math.ceil(delta.total_seconds() / 86400))
+    if days <= 365:
+        return f'{days} D'
+    return f'{math.ceil(days / 365)} Y'
+
+
+class BarStore():
+    """Persistent columnar bar store keyed by (symbol, timeframe).
+
+    Every series is saved as a NumPy ``.npz`` file with one array per bar column.
+    A JSON index records which time intervals (wall clock seconds) of every series
+    have already been fetched, so callers only need to request the gaps.
+    """
+
+    def __init__(self, path:str='barstore', maxBytes:int=256*1024*1024):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.path = path
+        self.lock = threading.RLock()
+        # Loaded series, least recently used are dropped from memory and loaded again on demand
+        self.series:BudgetCache = BudgetCache(maxBytes, lambda columns: sum(a.nbytes for a in columns.values()))	# symbol,timeframe -> columns
+        self.coverage:Dict[Tuple[str, str], List[List[int]]] = {}	# symbol,timeframe -> [[start, end], ...]
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            indexPath = self.indexPath()
+            if os.path.exists(indexPath):
+                with open(indexPath, 'r') as f:
+                    index = json.load(f)
+                for k, intervals in index.items():
+                    symbol, timeframe = k.split('|')
+                    self.coverage[(symbol, timeframe)] = intervals
+        except:
+            self.logger.exception('BarStore: Unable to load index')
+
+
+    def indexPath(self) -> str:
+        return os.path.join(self.path, 'index.json')
+
+
+    def seriesPath(self, key:Tuple[str, str]) -> str:
+        return os.path.join(self.path, f'{key[0]}_{key[1].replace(" ", "")}.npz')
+
+
+    @staticmethod
+    def emptyColumns() -> Dict[str, np.ndarray]:
+        return {c: np.empty(0, dtype=np.int64 if c in ['time', 'volume'] else np.float64) for c in BAR_COLUMNS}
+
+
+    def load(self, key:Tuple[str, str]) -> Dict[str, np.ndarray]:
+        """Columns of a series, loaded lazily from disk.
+
+        Args:
+            key (Tuple[str, str]): symbol, timeframe
+
+        Returns:
+            Dict[str, np.ndarray]: Column name -> array, sorted by time.
+        """
+        with self.lock:
+            if key not in self.series:
+                columns = self.emptyColumns()
+                p = self.seriesPath(key)
+                if os.path.exists(p):
+                    try:
+                        with np.load(p) as npz:
+                            columns = {c: npz[c] for c in BAR_COLUMNS}
+                    except:
+                        self.logger.exception(f'load: Unable to read {p}')
+                        self.coverage.pop(key, None)
+                self.series[key] = columns
+                return columns
+            return self.series.get(key)
+
+
+    def requestRange(self, endDate:str, duration:str) -> Tuple[int, int]:
+        """Time interval in wall clock seconds which an IB request would cover."""
+        end = parseEndDate(endDate)
+        n, unit = parseDuration(duration)
+        if unit == 'D':
+            # IB counts day durations in trading days, weekends and holidays are skipped
+            day = datetime.now(EXCHANGE_TZ).date() if endDate == None or endDate == '' else datetime.strptime(endDate.strip()[:8], '%Y%m%d').date()
+            first = datetime.combine(NYSE.firstSession(duration, day), datetime.min.time(), tzinfo=EXCHANGE_TZ)
+            start = first.astimezone().replace(tzinfo=None)
+        else:
+            start = end - durationToTimedelta(duration)
+        return toWallSeconds(start), toWallSeconds(end)
+
+
+    def missingRanges(self, key:Tuple[str, str], start:int, end:int) -> List[Tuple[int, int]]:
+        """Parts of [start, end] which are not covered by the store yet."""
+        with self.lock:
+            gaps = []
+            cursor = start
+            for s, e in self.coverage.get(key, []):
+                if e <= cursor:
+                    continue
+                if s >= end:
+                    break
+                if s > cursor:
+                    gaps.append((cursor, s))
+                cursor = max(cursor, e)
+                if cursor >= end:
+                    break
+            if cursor < end:
+                gaps.append((cursor, end))
+            return gaps
+
+
+    def addCoverage(self, key:Tuple[str, str], start:int, end:int) -> None:
+        with self.lock:
+            intervals = sorted(self.coverage.get(key, []) + [[start, end]])
+            merged = []
+            for s, e in intervals:
+                if len(merged) > 0 and s <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], e)
+                else:
+                    merged.append([s, e])
+            self.coverage[key] = merged
+
+
+    def merge(self, key:Tuple[str, str], bars:Dict[str, np.ndarray], start:int, end:int) -> None:
+        """Merge newly received bars into a series and mark [start, end] as covered.
+
+        Bars from the new request replace stored bars with the same timestamp.
+
+        Args:
+            key (Tuple[str, str]): symbol, timeframe
+            bars (Dict[str, np.ndarray]): Bar columns with **time** as wall clock seconds.
+            start (int): Requested start in wall clock seconds.
+            end (int): Requested end in wall clock seconds, capped at now.
+        """
+        with self.lock:
+            old = self.load(key)
+            if len(bars['time']) > 0:
+                # IB delivers complete sessions, so the first bar also counts as covered
+                start = min(start, int(bars['time'].min()))
+
+            # Keep only old bars which are not part of the new data
+            keep = ~np.isin(old['time'], bars['time'])
+            columns = {c: np.concatenate([old[c][keep], bars[c].astype(old[c].dtype)]) for c in BAR_COLUMNS}
+            order = np.argsort(columns['time'], kind='stable')
+            columns = {c: columns[c][order] for c in BAR_COLUMNS}
+            self.series[key] = columns
+
+            now = toWallSeconds(datetime.now())
+            if start < min(end, now):
+                self.addCoverage(key, start, min(end, now))
+            self.save(key, columns)
+
+
+    def save(self, key:Tuple[str, str], columns:Dict[str, np.ndarray]) -> None:
+        try:
+            with self.lock:
+                p = self.seriesPath(key)
+                # Write temporary files first, a crash must not corrupt the store
+                with open(f'{p}.tmp', 'wb') as f:
+                    np.savez(f, **columns)
+                os.replace(f'{p}.tmp', p)
+                index = {f'{k[0]}|{k[1]}': v for k, v in self.coverage.items()}
+                with open(f'{self.indexPath()}.tmp', 'w') as f:
+                    json.dump(index, f)
+                os.replace(f'{self.indexPath()}.tmp', self.indexPath())
+        except:
+            self.logger.exception(f'save: Unable to save {key}')
+
+
+    def read(self, key:Tuple[str, str], endDate:str, duration:str) -> Dict[str, np.ndarray]:
+        """Bars which IB would return for the given endDate and duration.
+
+        Day durations count trading days like IB does, so "1 D" on a weekend
+        returns the last session before it.
+
+        Args:
+            key (Tuple[str, str]): symbol, timeframe
+            endDate (str): IB end date, empty string means now.
+            duration (str): IB duration string.
+
+        Returns:
+            Dict[str, np.ndarray]: Read only column views, **time** as wall clock seconds.
+        """
+        with self.lock:
+            columns = self.load(key)
+            start, end = self.requestRange(endDate, duration)
+            stop = np.searchsorted(columns['time'], end, side='right')
+            n, unit = parseDuration(duration)
+            if unit == 'D':
+                days = columns['time'][:stop] // 86400
+                sessions = np.unique(days)
+                first = sessions[-n] if len(sessions) >= n else (sessions[0] if len(sessions) > 0 else 0)
+                begin = np.searchsorted(days, first, side='left')
+            else:
+                begin = np.searchsorted(columns['time'], start, side='left')
+            return {c: columns[c][begin:stop] for c in BAR_COLUMNS}
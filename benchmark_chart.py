@@ -0,0 +1,485 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+from lightweight_charts import abstract
+from lightweight_charts.abstract import AbstractChart
+
+import window as windowModule
+from generic_client import ObjectType, QueueObject
+from replay_client import ReplayClient, toUtcSeconds
+from resampler import RESAMPLED_TIMEFRAMES
+from trading_calendar import NYSE
+from utils import gitCommit
+from window import Window
+from statics import TF_DURATION_MAP
+
+
+SCENARIOS = ['load', 'daystep', 'live']
+PERCENTILES = [50, 95, 99]
+
+# Stages of a chart load in the order they happen
+LOAD_STAGES = [
+    'request',	# Window.getBarData until the request is handed to the client
+    'wait',	# Client, store and IB callbacks until the window handles the bars
+    'frame',	# DataFrame of the bars
+    'indicators',	# Indicator pipeline
+    'render',	# Chart script of candles and lines
+    'markers',	# Setup markers
+    'total'	# getBarData until the chart is complete
+]
+
+# Live charts, resampled timeframes are updated from live base bars
+LIVE_TIMEFRAMES = ['1 min', '5 mins', '15 mins']
+
+# Stages of a live update
+LIVE_STAGES = [
+    'update',	# Window.updateLastBar
+    'tickToRender'	# historicalDataUpdate until the chart is updated
+]
+
+# Same session for every run, results of different commits compare the same bars
+DEFAULT_DAY = date(2025, 6, 16)
+
+
+class RecordingChart(AbstractChart):
+    """Chart without webview, scripts are counted instead of evaluated.
+
+    Has the complete API of lightweight_charts.Chart which the window uses, so
+    the Python side of every chart call (serialization included) is measured.
+    """
+
+    def __init__(self):
+        self.scriptCount = 0
+        self.scriptBytes = 0
+        self.is_alive = True
+        win = abstract.Window(script_func=self.record)
+        # Scripts are sent immediately like to a loaded webview
+        win.loaded = True
+        super().__init__(win, toolbox=True)
+
+
+    def record(self, script:str) -> None:
+        self.scriptCount += 1
+        self.scriptBytes += len(script)
+
+
+class StageRecorder():
+    """Durations per case and stage in milliseconds."""
+
+    def __init__(self):
+        self.samples:Dict[str, Dict[str, List[float]]] = {}	# case -> stage -> ms
+        self.counters:Dict[str, Dict[str, int]] = {}	# case -> name -> count
+        self.case:str = None	# Case which is measured right now, None for no recording
+        self.active:bool = False	# Inside the handling of the measured bars
+        self.wrapped:list = []
+
+
+    def add(self, stage:str, seconds:float, case:str=None) -> None:
+        case = self.case if case == None else case
+        if case == None:
+            return
+        self.samples.setdefault(case, {}).setdefault(stage, []).append(seconds * 1000)
+
+
+    def count(self, name:str, n:int=1, case:str=None) -> None:
+        case = self.case if case == None else case
+        if case == None:
+            return
+        counters = self.counters.setdefault(case, {})
+        counters[name] = counters.get(name, 0) + n
+
+
+    def wrap(self, obj, name:str, stage:str) -> None:
+        """Replace obj.name with a function which records its duration while active."""
+        original = getattr(obj, name)
+        def timed(*args, **kwargs):
+            if not self.active:
+                return original(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        setattr(obj, name, timed)
+        self.wrapped.append((obj, name, original))
+
+
+    def unwrap(self) -> None:
+        for obj, name, original in reversed(self.wrapped):
+            setattr(obj, name, original)
+        self.wrapped = []
+
+
+    @staticmethod
+    def stats(values:List[float]) -> dict:
+        a = np.array(values)
+        result = {'n': len(a), 'mean': round(float(a.mean()), 3)}
+        for p in PERCENTILES:
+            result[f'p{p}'] = round(float(np.percentile(a, p)), 3)
+        result['max'] = round(float(a.max()), 3)
+        return result
+
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for case, stages in self.samples.items():
+            order = LOAD_STAGES + LIVE_STAGES
+            names = sorted(stages.keys(), key=lambda s: order.index(s) if s in order else len(order))
+            result[case] = {s: self.stats(stages[s]) for s in names}
+            if case in self.counters:
+                result[case]['counters'] = dict(self.counters[case])
+        return result
+
+
+class ChartBenchmark():
+    """Drives the chart window with a replay client and a recording chart.
+
+    Every scenario measures the same path as the user: getBarData, the client
+    with scheduler, bar store and resampling, the queue of the window and the
+    chart calls. Only TWS and the webview are replaced.
+    """
+
+    def __init__(self, day:date=DEFAULT_DAY, repeat:int=5, latency:float=0.0, prefetchDays:int=2, setups:int=200,
+                 steps:int=10, thinkTime:float=0.25, stepTimeframe:str='5 mins', bursts:int=10, burstSize:int=50,
+                 tickInterval:float=0.0, timeout:float=120.0):
+        """Create a benchmark.
+
+        Args:
+            day (date, optional): Session of the loaded charts. Defaults to DEFAULT_DAY.
+            repeat (int, optional): Loads per timeframe and case. Defaults to 5.
+            latency (float, optional): Replay latency per request in seconds, 0.0 measures only the application. Defaults to 0.0.
+            prefetchDays (int, optional): Prefetched sessions around the shown day like the window setting. Defaults to 2.
+            setups (int, optional): Stored setups per chart for the markers. Defaults to 200.
+            steps (int, optional): Day steps per direction. Defaults to 10.
+            thinkTime (float, optional): Seconds between day steps, time for the prefetches. Defaults to 0.25.
+            stepTimeframe (str, optional): Timeframe of the day steps. Defaults to '5 mins'.
+            bursts (int, optional): Live update bursts. Defaults to 10.
+            burstSize (int, optional): Live updates per burst. Defaults to 50.
+            tickInterval (float, optional): Seconds between live updates of a burst. Defaults to 0.0.
+            timeout (float, optional): Seconds to wait for a single load. Defaults to 120.0.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.day = NYSE.sessionOnOrBefore(day)
+        self.repeat = repeat
+        self.latency = latency
+        self.prefetchDays = prefetchDays
+        self.setups = setups
+        self.steps = steps
+        self.thinkTime = thinkTime
+        self.stepTimeframe = stepTimeframe
+        self.bursts = bursts
+        self.burstSize = burstSize
+        self.tickInterval = tickInterval
+        self.timeout = timeout
+        self.recorder = StageRecorder()
+        self.symbolCount = 0
+        self.loaded:asyncio.Event = None
+        self.requestEnd:float = None	# perf_counter when getBarData returned
+        self.loadedAt:float = None	# perf_counter when the bars were shown
+        self.handled:float = 0.0	# Seconds of bar handling inside getBarData (prefetched days)
+        self.sent:deque = deque()	# perf_counter of every live update which is not rendered yet
+
+
+    def newSymbol(self) -> str:
+        """Symbol without stored bars, every symbol has its own synthetic prices."""
+        self.symbolCount += 1
+        return f'BM{self.symbolCount:04d}'
+
+
+    async def setUp(self) -> None:
+        self.dataQueue = asyncio.Queue()
+        self.client = ReplayClient(self.dataQueue, asyncio.get_running_loop(), latency=self.latency, pacing=False)
+        self.chart = RecordingChart()
+        self.window = Window(self.client, prefetchDays=self.prefetchDays, chart=self.chart)
+        self.loaded = asyncio.Event()
+        self.instrument()
+        self.client.start()
+        self.consumer = asyncio.create_task(self.window.consumeQueue())
+
+
+    async def tearDown(self) -> None:
+        self.consumer.cancel()
+        self.recorder.unwrap()
+        self.client.close()
+        self.window.prefetchExecutor.shutdown(wait=False, cancel_futures=True)
+        self.window.setupJournal.close()
+        self.window.setupDb.close()
+
+
+    def instrument(self) -> None:
+        w = self.window
+        self.recorder.wrap(windowModule, 'columnsToFrame', 'frame')
+        self.recorder.wrap(w.pipeline, 'compute', 'indicators')
+        self.recorder.wrap(w, 'renderFrame', 'render')
+        self.recorder.wrap(w, 'updateMarkers', 'markers')
+
+        handleQueueObject = w.handleQueueObject
+        def handle(qo:QueueObject):
+            if qo.type != ObjectType.HistoricalData or self.recorder.case == None:
+                return handleQueueObject(qo)
+            start = time.perf_counter()
+            if self.requestEnd != None:
+                self.recorder.add('wait', start - self.requestEnd)
+            else:
+                # Prefetched day, handled inside getBarData
+                self.recorder.count('prefetchHits')
+            self.recorder.active = True
+            try:
+                return handleQueueObject(qo)
+            finally:
+                self.recorder.active = False
+                end = time.perf_counter()
+                if self.requestEnd == None:
+                    self.handled = end - start
+                self.loadedAt = end
+                self.loaded.set()
+        w.handleQueueObject = handle
+
+        updateLastBar = w.updateLastBar
+        def update(bar:dict, append:bool):
+            start = time.perf_counter()
+            try:
+                return updateLastBar(bar, append)
+            finally:
+                end = time.perf_counter()
+                self.recorder.add('update', end - start)
+                if len(self.sent) > 0:
+                    self.recorder.add('tickToRender', end - self.sent.popleft())
+        w.updateLastBar = update
+
+
+    def addSetups(self, symbol:str, timeframe:str, day:date) -> None:
+        """Stored setups spread over the view, so markers are sent with every load."""
+        if self.setups <= 0:
+            return
+        first = NYSE.firstSession(TF_DURATION_MAP[timeframe], day) or day - timedelta(days=5*365)
+        start = pd.Timestamp(first) + pd.Timedelta(hours=9, minutes=30)
+        end = pd.Timestamp(day) + pd.Timedelta(hours=16)
+        rng = np.random.default_rng(self.setups)
+        times = np.sort(rng.integers(start.value // 10**6, end.value // 10**6, self.setups))
+        self.window.setupDb.insertMany([{
+            'ticker': symbol,
+            'strategy': self.chart.topbar['menu-strategy'].value,
+            'timeframe': timeframe,
+            'signalType': 'Signal',
+            'direction': 'long' if i % 2 == 0 else 'short',
+            'time': int(t)
+        } for i, t in enumerate(times)])
+
+
+    def select(self, symbol:str, timeframe:str, day:date) -> None:
+        """Set symbol, timeframe and day like the search box and the menu do."""
+        self.window.currentTicker = symbol
+        self.window.currentTimeframe = timeframe
+        self.window.currentDate = day
+        self.chart.topbar['menu-timeframe'].set(timeframe)
+
+
+    async def load(self, case:str, action:Callable[[], None]) -> None:
+        """Measure one chart load from the user action until markers are shown."""
+        self.loaded.clear()
+        self.recorder.case = case
+        self.requestEnd = None
+        self.handled = 0.0
+        scripts, payload = self.chart.scriptCount, self.chart.scriptBytes
+        start = time.perf_counter()
+        action()
+        end = time.perf_counter()
+        if not self.loaded.is_set():
+            self.requestEnd = end
+        self.recorder.add('request', end - start - self.handled)
+        try:
+            await asyncio.wait_for(self.loaded.wait(), self.timeout)
+            self.recorder.add('total', self.loadedAt - start)
+            self.recorder.count('loads')
+            self.recorder.count('scripts', self.chart.scriptCount - scripts)
+            self.recorder.count('scriptBytes', self.chart.scriptBytes - payload)
+        except asyncio.TimeoutError:
+            self.recorder.count('timeouts')
+            self.logger.warning(f'load: {case} not loaded within {self.timeout}s')
+        finally:
+            self.recorder.case = None
+            self.requestEnd = None
+
+
+    async def scenarioLoad(self) -> None:
+        """Every timeframe: new symbols (bars from the client) and the same symbol again (store and caches)."""
+        for timeframe in TF_DURATION_MAP.keys():
+            for i in range(self.repeat):
+                symbol = self.newSymbol()
+                self.addSetups(symbol, timeframe, self.day)
+                self.select(symbol, timeframe, self.day)
+                await self.load(f'load/{timeframe}/cold', self.window.getBarData)
+                await self.load(f'load/{timeframe}/warm', self.window.getBarData)
+            self.logger.info(f'scenarioLoad: {timeframe} done')
+
+
+    async def scenarioDayStep(self) -> None:
+        """⏭️ and ⏮️ through consecutive sessions with prefetching."""
+        symbol = self.newSymbol()
+        timeframe = self.stepTimeframe
+        first = NYSE.previousSession(self.day, self.steps)
+        self.addSetups(symbol, timeframe, self.day)
+        self.select(symbol, timeframe, first)
+        await self.load(f'daystep/{timeframe}/first', self.window.getBarData)
+        for direction, action in [('next', self.window.onNextDay), ('prev', self.window.onPrevDay)]:
+            for _ in range(self.steps):
+                await asyncio.sleep(self.thinkTime)
+                await self.load(f'daystep/{timeframe}/{direction}', lambda: action(self.chart))
+        self.logger.info('scenarioDayStep: done')
+
+
+    def sendUpdates(self, reqId:int, last:Dict[str, np.ndarray], n:int, barSize:int=60) -> None:
+        """Send live updates like the EReader thread, a new bar every fourth update."""
+        rng = np.random.default_rng(n)
+        for i in range(n):
+            price = last['close'][0] * np.exp(rng.normal(0, 0.0005))
+            if i % 4 == 3:
+                last['time'][0] += barSize
+                last['open'][0] = last['high'][0] = last['low'][0] = last['close'][0]
+                last['volume'][0] = 0
+            last['close'][0] = price
+            last['high'][0] = max(last['high'][0], price)
+            last['low'][0] = min(last['low'][0], price)
+            last['volume'][0] += 10
+            bar = ReplayClient.barData(last, toUtcSeconds(last['time']), 0, False)
+            self.sent.append(time.perf_counter())
+            self.client.historicalDataUpdate(reqId, bar)
+            if self.tickInterval > 0:
+                time.sleep(self.tickInterval)
+
+
+    async def scenarioLive(self) -> None:
+        """Bursts of historicalDataUpdate for shown intraday charts."""
+        for timeframe in LIVE_TIMEFRAMES:
+            symbol = self.newSymbol()
+            self.select(symbol, timeframe, self.day)
+            await self.load(f'live/{timeframe}/load', self.window.getBarData)
+            key = (symbol, timeframe)
+            reqId = self.client.symbolTimeframeHistTickerIds.get(key)
+            fetchKey = self.client.histTickerIdSymbolTimeframe.get(reqId)
+            if reqId == None or fetchKey == None or key not in self.client.symbolCandleData:
+                self.logger.warning(f'scenarioLive: No request for the {timeframe} chart')
+                continue
+            # Like a keepUpToDate request of the running session, TWS sends bars of the fetched timeframe
+            self.client.startLive(key, reqId)
+            stored = self.client.barStore.load(fetchKey)
+            last = {c: v[-1:].copy() for c, v in stored.items()}
+            barSize = RESAMPLED_TIMEFRAMES.get(fetchKey[1], 60)
+            self.recorder.case = f'live/{timeframe}/updates'
+            for _ in range(self.bursts):
+                self.sent.clear()
+                await asyncio.to_thread(self.sendUpdates, reqId, last, self.burstSize, barSize)
+                deadline = time.monotonic() + self.timeout
+                while len(self.sent) > 0 and time.monotonic() < deadline:
+                    await asyncio.sleep(0.001)
+                self.recorder.count('updates', self.burstSize)
+                if len(self.sent) > 0:
+                    self.recorder.count('lost', len(self.sent))
+            self.recorder.case = None
+            self.client.stopLive(key, reqId)
+            self.logger.info(f'scenarioLive: {timeframe} done')
+
+
+    async def run(self, scenarios:List[str]) -> Dict[str, dict]:
+        await self.setUp()
+        try:
+            for scenario in scenarios:
+                await {'load': self.scenarioLoad, 'daystep': self.scenarioDayStep, 'live': self.scenarioLive}[scenario]()
+        finally:
+            await self.tearDown()
+        return self.recorder.summary()
+
+
+def printSummary(results:Dict[str, dict]) -> None:
+    print(f'{"case":<28} {"stage":<13} {"n":>5} {"p50":>9} {"p95":>9} {"p99":>9} {"max":>9}  [ms]')
+    for case, stages in results.items():
+        for stage, s in stages.items():
+            if stage == 'counters':
+                continue
+            print(f'{case:<28} {stage:<13} {s["n"]:>5} {s["p50"]:>9.2f} {s["p95"]:>9.2f} {s["p99"]:>9.2f} {s["max"]:>9.2f}')
+
+
+def printComparison(base:Dict[str, dict], results:Dict[str, dict]) -> None:
+    """p50 and p95 of both runs and the ratio new/base for every case and stage of both."""
+    print(f'{"case":<28} {"stage":<13} {"p50 base":>9} {"p50 new":>9} {"ratio":>6} {"p95 base":>9} {"p95 new":>9} {"ratio":>6}')
+    for case, stages in results.items():
+        for stage, s in stages.items():
+            b = base.get(case, {}).get(stage)
+            if stage == 'counters' or b == None:
+                continue
+            ratio = lambda p: s[p] / b[p] if b[p] > 0 else float('nan')
+            print(f'{case:<28} {stage:<13} {b["p50"]:>9.2f} {s["p50"]:>9.2f} {ratio("p50"):>6.2f} {b["p95"]:>9.2f} {s["p95"]:>9.2f} {ratio("p95"):>6.2f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='End-to-end chart load benchmark without TWS and webview.')
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append', help='Scenario to run, repeat for several. Defaults to all.')
+    parser.add_argument('--repeat', type=int, default=5, help='Loads per timeframe and case.')
+    parser.add_argument('--day', type=date.fromisoformat, default=DEFAULT_DAY, help='Session of the loaded charts, YYYY-MM-DD.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Replay latency per request in seconds.')
+    parser.add_argument('--prefetch-days', type=int, default=2, help='Prefetched sessions around the shown day.')
+    parser.add_argument('--setups', type=int, default=200, help='Stored setups per chart.')
+    parser.add_argument('--steps', type=int, default=10, help='Day steps per direction.')
+    parser.add_argument('--think-time', type=float, default=0.25, help='Seconds between day steps.')
+    parser.add_argument('--step-timeframe', choices=list(TF_DURATION_MAP.keys()), default='5 mins', help='Timeframe of the day steps.')
+    parser.add_argument('--bursts', type=int, default=10, help='Live update bursts.')
+    parser.add_argument('--burst-size', type=int, default=50, help='Live updates per burst.')
+    parser.add_argument('--out', help='Write the results as JSON to this file.')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare with.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(name)s: %(message)s', stream=sys.stderr)
+    logging.getLogger(__name__).setLevel('INFO')
+    scenarios = SCENARIOS if args.scenario == None else [s for s in SCENARIOS if s in args.scenario]
+    benchmark = ChartBenchmark(day=args.day, repeat=args.repeat, latency=args.latency, prefetchDays=args.prefetch_days, setups=args.setups,
+                               steps=args.steps, thinkTime=args.think_time, stepTimeframe=args.step_timeframe, bursts=args.bursts, burstSize=args.burst_size)
+
+    cwd = os.getcwd()
+    # setups.db and setups.json of the window are created in an empty directory
+    workDir = tempfile.mkdtemp(prefix='benchmark-')
+    os.chdir(workDir)
+    try:
+        results = asyncio.run(benchmark.run(scenarios))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workDir, ignore_errors=True)
+        shutil.rmtree(benchmark.client.barStore.path, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': gitCommit(),
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'args': {k: v.isoformat() if isinstance(v, date) else v for k, v in vars(args).items()}
+        },
+        'results': results
+    }
+    printSummary(results)
+    if args.compare != None:
+        with open(args.compare) as f:
+            printComparison(json.load(f)['results'], results)
+    if args.out != None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
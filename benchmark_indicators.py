@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import logging
+import hashlib
+import argparse
+import platform
+import importlib.util
+import tracemalloc
+from datetime import date, datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from indicators import (EMA, BollingerBands, RSI, ADXDMI, VWAP, AverageTrueRange, isIntraday, getCandleType,
+                        candleTypeKernel, indicatorFactory)
+from trading_calendar import NYSE
+from utils import gitCommit
+
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+# Regular session of 1 min bars
+SESSION_MINUTES = 390
+# Last session of the synthetic series, same bars for every run
+LAST_SESSION = date(2025, 6, 16)
+# getCandleType is called per bar, larger series are timed on their first bars
+SCALAR_LIMIT = 100000
+# Timings are repeated until they took this long, at most MAX_REPEAT times
+MIN_TIME = 0.5
+MAX_REPEAT = 20
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_indicators_golden.json')
+GOLDEN_SIZE = 5000
+GOLDEN_SEED = 42
+# Values per column kept in the golden file, evenly spaced
+GOLDEN_SAMPLES = 64
+# Default tolerance of the golden check, the NumPy kernels differ from the pandas/ta reference by rounding (~1e-15)
+GOLDEN_RTOL = 1e-12
+
+
+def syntheticBars(n:int, seed:int=0, price:float=100.0, volatility:float=0.0008) -> pd.DataFrame:
+    """Realistic 1 min bars of the regular NYSE sessions.
+
+    Prices are a random walk with overnight gaps, volatility and volume follow
+    the U shape of a trading day (busy open and close, quiet lunch) and volume
+    has a slowly changing daily level.
+
+    Args:
+        n (int): Number of bars, the first session can be incomplete.
+        seed (int, optional): Seed of the random numbers. Defaults to 0.
+        price (float, optional): First open. Defaults to 100.0.
+        volatility (float, optional): Standard deviation of the 1 min returns at lunch time. Defaults to 0.0008.
+
+    Returns:
+        pd.DataFrame: time (datetime64, exchange wall clock), open, high, low, close, volume
+    """
+    rng = np.random.default_rng(seed)
+    sessionCount = -(-n // SESSION_MINUTES)
+    first = NYSE.previousSession(LAST_SESSION, sessionCount - 1) if sessionCount > 1 else LAST_SESSION
+    sessions = np.array(NYSE.sessionsBetween(first, LAST_SESSION), dtype='datetime64[D]')
+    minute = np.arange(SESSION_MINUTES)
+    # 1 at lunch, 3 at open and close
+    profile = 1 + 2 * ((minute - SESSION_MINUTES / 2) / (SESSION_MINUTES / 2)) ** 2
+    times = (sessions[:, None].astype('datetime64[ns]') + np.timedelta64(9*60 + 30, 'm') + minute.astype('timedelta64[m]')).ravel()[-n:]
+    minuteOfDay = np.tile(minute, len(sessions))[-n:]
+    returns = rng.normal(0, volatility, n) * np.sqrt(profile[minuteOfDay])
+    # Overnight gaps on the first bar of every session
+    returns[minuteOfDay == 0] += rng.normal(0, 10 * volatility, np.count_nonzero(minuteOfDay == 0))
+    close = price * np.exp(np.cumsum(returns))
+    open = np.r_[price, close[:-1]]
+    wick = np.abs(rng.normal(0, volatility / 2, (2, n))) * close * np.sqrt(profile[minuteOfDay])
+    dailyLevel = np.repeat(np.exp(np.cumsum(rng.normal(0, 0.1, len(sessions)))), SESSION_MINUTES)[-n:]
+    volume = (5000 * profile[minuteOfDay] * dailyLevel * rng.lognormal(0, 0.5, n)).astype(np.int64) + 1
+    return pd.DataFrame({
+        'time': times,
+        'open': open,
+        'high': np.maximum(open, close) + wick[0],
+        'low': np.minimum(open, close) - wick[1],
+        'close': close,
+        'volume': volume
+    })
+
+
+def candleTypes(df:pd.DataFrame) -> np.ndarray:
+    """getCandleType for every bar, like a per row loop calls it."""
+    return np.array([getCandleType(o, h, l, c) for o, h, l, c in zip(df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy())])
+
+
+# case -> function of the bars, scalar cases are limited to SCALAR_LIMIT bars
+CASES:Dict[str, Callable[[pd.DataFrame], object]] = {
+    'EMA': lambda df: EMA(df, 10),
+    'BollingerBands': lambda df: BollingerBands(df, 20, [2, 3]),
+    'RSI': lambda df: RSI(df, 14),
+    'ADXDMI': lambda df: ADXDMI(df, 14),
+    'VWAP': VWAP,
+    'AverageTrueRange': lambda df: AverageTrueRange(df, 20),
+    'isIntraday': isIntraday,
+    'getCandleType': candleTypes,
+    'candleTypeKernel': lambda df: candleTypeKernel(df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy()),
+    'indicatorFactory': indicatorFactory
+}
+SCALAR_CASES = {'getCandleType'}
+
+
+def referenceCases(path:str) -> Dict[str, Callable[[pd.DataFrame], object]]:
+    """Cases of a reference implementation of indicators.py, e.g. the pandas/ta version before the NumPy kernels.
+
+    The reference only needs the public indicator functions, candleTypeKernel is
+    checked against its getCandleType called per bar.
+    """
+    spec = importlib.util.spec_from_file_location('reference_indicators', path)
+    ref = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(ref)
+    perBar = lambda df: np.array([ref.getCandleType(o, h, l, c) for o, h, l, c in zip(df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy())])
+    kernel = perBar
+    if hasattr(ref, 'candleTypeKernel'):
+        kernel = lambda df: ref.candleTypeKernel(df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy())
+    return {
+        'EMA': lambda df: ref.EMA(df, 10),
+        'BollingerBands': lambda df: ref.BollingerBands(df, 20, [2, 3]),
+        'RSI': lambda df: ref.RSI(df, 14),
+        'ADXDMI': lambda df: ref.ADXDMI(df, 14),
+        'VWAP': ref.VWAP,
+        'AverageTrueRange': lambda df: ref.AverageTrueRange(df, 20),
+        'isIntraday': ref.isIntraday,
+        'getCandleType': perBar,
+        'candleTypeKernel': kernel,
+        'indicatorFactory': ref.indicatorFactory
+    }
+
+
+def caseInput(case:str, df:pd.DataFrame) -> pd.DataFrame:
+    return df.iloc[:SCALAR_LIMIT] if case in SCALAR_CASES else df
+
+
+def measure(func:Callable[[pd.DataFrame], object], df:pd.DataFrame) -> dict:
+    """Duration of repeated calls and the peak of the allocated memory of one call."""
+    durations = []
+    start = time.perf_counter()
+    while len(durations) < MAX_REPEAT and (len(durations) == 0 or time.perf_counter() - start < MIN_TIME):
+        t = time.perf_counter()
+        func(df)
+        durations.append(time.perf_counter() - t)
+    # Separate call, tracing slows down the timed calls
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        func(df)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    n = len(df)
+    median = float(np.median(durations))
+    return {
+        'bars': n,
+        'runs': len(durations),
+        'minMs': round(min(durations) * 1000, 4),
+        'medianMs': round(median * 1000, 4),
+        'nsPerBar': round(median / n * 1e9, 2),
+        'peakBytes': int(peak),
+        'bytesPerBar': round(peak / n, 1)
+    }
+
+
+def outputColumns(result) -> Dict[str, np.ndarray]:
+    """Result of a case as named float arrays, the time column is not part of the output."""
+    if isinstance(result, pd.DataFrame):
+        return {c: result[c].to_numpy(dtype=np.float64) for c in result.columns if c != 'time'}
+    return {'value': np.atleast_1d(np.asarray(result, dtype=np.float64))}
+
+
+def fingerprint(values:np.ndarray) -> dict:
+    """Length, NaN positions, sums and sampled values of a column, floats are kept exactly."""
+    valid = ~np.isnan(values)
+    samples = np.unique(np.linspace(0, len(values) - 1, GOLDEN_SAMPLES).astype(np.int64)) if len(values) > 0 else np.empty(0, dtype=np.int64)
+    return {
+        'length': len(values),
+        'nan': int(np.count_nonzero(~valid)),
+        'firstValid': int(np.argmax(valid)) if valid.any() else None,
+        'sum': float(values[valid].sum()),
+        'absSum': float(np.abs(values[valid]).sum()),
+        'samples': [[int(i), None if np.isnan(values[i]) else float(values[i])] for i in samples]
+    }
+
+
+def goldenValues(cases:Dict[str, Callable[[pd.DataFrame], object]]=None) -> Dict[str, Dict[str, dict]]:
+    """Fingerprints of every case on the golden series, defaults to the current implementation."""
+    cases = CASES if cases == None else cases
+    df = syntheticBars(GOLDEN_SIZE, GOLDEN_SEED)
+    return {case: {c: fingerprint(v) for c, v in outputColumns(func(caseInput(case, df))).items()} for case, func in cases.items()}
+
+
+def isClose(expected:float, actual:float, rtol:float) -> bool:
+    if expected == None or actual == None:
+        return expected == actual
+    return expected == actual or abs(actual - expected) <= rtol * max(abs(expected), abs(actual))
+
+
+def compareGolden(golden:Dict[str, Dict[str, dict]], current:Dict[str, Dict[str, dict]], rtol:float=0.0) -> List[str]:
+    """Differences between the golden and the current fingerprints, empty if the outputs are identical.
+
+    Args:
+        golden (Dict[str, Dict[str, dict]]): Fingerprints of the reference implementation.
+        current (Dict[str, Dict[str, dict]]): Fingerprints of the current implementation.
+        rtol (float, optional): Relative tolerance of the values, 0.0 for identical values. Defaults to 0.0.
+
+    Returns:
+        List[str]: One line per difference.
+    """
+    errors = []
+    for case, columns in golden.items():
+        if case not in current:
+            errors.append(f'{case}: missing')
+            continue
+        for column, expected in columns.items():
+            actual = current[case].get(column)
+            if actual == None:
+                errors.append(f'{case}.{column}: missing')
+                continue
+            for key in ['length', 'nan', 'firstValid']:
+                if expected[key] != actual[key]:
+                    errors.append(f'{case}.{column}: {key} {actual[key]} != {expected[key]}')
+            for key in ['sum', 'absSum']:
+                if not isClose(expected[key], actual[key], rtol):
+                    errors.append(f'{case}.{column}: {key} {actual[key]!r} != {expected[key]!r}')
+            for (i, e), (_, a) in zip(expected['samples'], actual['samples']):
+                if not isClose(e, a, rtol):
+                    errors.append(f'{case}.{column}[{i}]: {a!r} != {e!r}')
+        for column in current[case].keys() - columns.keys():
+            errors.append(f'{case}.{column}: not in golden values')
+    return errors
+
+
+def parseSize(value:str) -> int:
+    """1000, 10k or 1M"""
+    value = value.strip().lower()
+    factor = {'k': 1000, 'm': 1000000}.get(value[-1], 1)
+    return int(float(value[:-1] if factor > 1 else value) * factor)
+
+
+def printResults(results:Dict[str, Dict[str, dict]], base:Dict[str, Dict[str, dict]]=None) -> None:
+    header = f'{"case":<18} {"bars":>9} {"median ms":>11} {"ns/bar":>9} {"peak MB":>9} {"B/bar":>8}'
+    print(header + (f' {"ns/bar base":>11} {"ratio":>6}' if base != None else ''))
+    for case, sizes in results.items():
+        for size, r in sizes.items():
+            line = f'{case:<18} {r["bars"]:>9} {r["medianMs"]:>11.3f} {r["nsPerBar"]:>9.1f} {r["peakBytes"]/2**20:>9.1f} {r["bytesPerBar"]:>8.1f}'
+            b = None if base == None else base.get(case, {}).get(size)
+            if b != None:
+                line += f' {b["nsPerBar"]:>11.1f} {r["nsPerBar"] / b["nsPerBar"] if b["nsPerBar"] > 0 else float("nan"):>6.2f}'
+            print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time and memory of the indicators on synthetic 1 min bars.')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES), help='Comma separated numbers of bars, e.g. 1k,100k,10M.')
+    parser.add_argument('--case', choices=list(CASES.keys()), action='append', help='Case to run, repeat for several. Defaults to all.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic bars.')
+    parser.add_argument('--out', help='Write the results as JSON to this file.')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare with.')
+    parser.add_argument('--golden', default=GOLDEN_PATH, help='Golden values file.')
+    parser.add_argument('--write-golden', action='store_true', help='Store the outputs of the --reference implementation as golden values.')
+    parser.add_argument('--reference', help='indicators.py of the reference implementation for --write-golden, e.g. the pandas/ta version (git show <commit>:indicators.py).')
+    parser.add_argument('--rtol', type=float, default=GOLDEN_RTOL, help='Relative tolerance of the golden check, 0 for identical output.')
+    parser.add_argument('--skip-timing', action='store_true', help='Only run the golden check.')
+    args = parser.parse_args()
+
+    if args.write_golden and args.reference == None:
+        # Golden values of the checked code itself would not find its own errors
+        parser.error('--write-golden needs --reference')
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    current = goldenValues()
+    if args.write_golden:
+        with open(args.reference, 'rb') as f:
+            source = f'{os.path.basename(args.reference)} sha256:{hashlib.sha256(f.read()).hexdigest()}'
+        values = goldenValues(referenceCases(args.reference))
+        with open(args.golden, 'w') as f:
+            json.dump({'size': GOLDEN_SIZE, 'seed': GOLDEN_SEED, 'source': source, 'values': values}, f, indent=1)
+        print(f'Golden values of {source} written to {args.golden}')
+        errors = compareGolden(values, current, args.rtol)
+        print(f'Current implementation: {len(errors)} golden value mismatches')
+    elif os.path.exists(args.golden):
+        with open(args.golden) as f:
+            errors = compareGolden(json.load(f)['values'], current, args.rtol)
+        for e in errors[:50]:
+            print(f'GOLDEN MISMATCH {e}')
+        if len(errors) > 0:
+            print(f'{len(errors)} golden value mismatches')
+            sys.exit(1)
+        print('Golden values match')
+    else:
+        print(f'No golden values at {args.golden}, use --write-golden')
+    if args.skip_timing:
+        return
+
+    cases = list(CASES.keys()) if args.case == None else args.case
+    results:Dict[str, Dict[str, dict]] = {case: {} for case in cases}
+    for size in [parseSize(s) for s in args.sizes.split(',')]:
+        df = syntheticBars(size, args.seed)
+        for case in cases:
+            results[case][str(size)] = measure(CASES[case], caseInput(case, df))
+        del df
+
+    base = None
+    if args.compare != None:
+        with open(args.compare) as f:
+            base = json.load(f)['results']
+    printResults(results, base)
+    if args.out != None:
+        with open(args.out, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': gitCommit(),
+                    'time': datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'pandas': pd.__version__,
+                    'platform': platform.platform(),
+                    'args': vars(args)
+                },
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
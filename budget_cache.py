@@ -0,0 +1,119 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class BudgetCache():
+    """Dict like LRU cache which evicts the least recently used entries above a memory budget.
+
+    The size of an entry is measured with **sizeOf** when it is stored or resized.
+    The most recently used entry is never evicted, even if it is larger than the budget.
+    """
+
+    def __init__(self, maxBytes:int, sizeOf:Callable[[Any], int], onEvict:Callable[[Hashable, Any], None]=None):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.maxBytes = maxBytes
+        self.sizeOf = sizeOf
+        self.onEvict = onEvict
+        self.lock = threading.RLock()
+        self.entries:OrderedDict = OrderedDict()	# key -> value, least recently used first
+        self.sizes:Dict[Hashable, int] = {}	# key -> bytes
+        self.bytes:int = 0
+        self.hits:int = 0
+        self.misses:int = 0
+        self.evictions:int = 0
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def __contains__(self, key:Hashable) -> bool:
+        return key in self.entries
+
+
+    def __getitem__(self, key:Hashable) -> Any:
+        # Plain access does not count as use, see get()
+        return self.entries[key]
+
+
+    def __setitem__(self, key:Hashable, value:Any) -> None:
+        self.put(key, value)
+
+
+    def keys(self) -> list:
+        with self.lock:
+            return list(self.entries.keys())
+
+
+    def get(self, key:Hashable) -> Optional[Any]:
+        """Value of key marked as most recently used, None if not cached."""
+        with self.lock:
+            value = self.entries.get(key)
+            if value == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+
+    def put(self, key:Hashable, value:Any) -> None:
+        """Add or replace an entry and mark it as most recently used."""
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.resize(key)
+
+
+    def resize(self, key:Hashable) -> None:
+        """Measure an entry again after it changed in place."""
+        evicted = []
+        with self.lock:
+            if key not in self.entries:
+                return
+            size = self.sizeOf(self.entries[key])
+            self.bytes += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+            while self.bytes > self.maxBytes and len(self.entries) > 1:
+                old, value = self.entries.popitem(last=False)
+                self.bytes -= self.sizes.pop(old)
+                self.evictions += 1
+                evicted.append((old, value))
+        # Callbacks may call back into the cache or TWS, run them outside the lock
+        for old, value in evicted:
+            self.logger.debug(f'resize: evicted {old}')
+            if self.onEvict != None:
+                try:
+                    self.onEvict(old, value)
+                except:
+                    self.logger.exception('resize: EXCEPTION')
+
+
+    def pop(self, key:Hashable, default:Any=None) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.bytes -= self.sizes.pop(key)
+            return self.entries.pop(key)
+
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'maxBytes': self.maxBytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -1,13 +1,26 @@
 import json
+import time
 import asyncio
 import logging
-from enum import Enum
+from enum import Enum, IntEnum
 from dataclasses import dataclass, field
+from typing import Dict
+
+import numpy as np
 
 
 class ObjectType(Enum):
     Message = 0
     HistoricalData = 1
+    BarAppend = 2	# New bar started, barData holds the new bar
+    BarUpdate = 3	# Last bar changed, barData holds the replacement
+    PrefetchData = 4	# Historical data of a view the user will probably look at next
+
+
+class RequestPriority(IntEnum):
+    VIEW = 0		# Chart the user is looking at
+    PREFETCH = 1	# Data the user will probably look at next
+    BACKFILL = 2	# Everything else
 
 
 @dataclass
@@ -17,6 +30,10 @@ class QueueObject:
     timeframe: str = None
     stringData: str = None
     listData: list = field(default_factory=lambda: [])
+    columnData: Dict[str, np.ndarray] = None	# Bar columns, time as wall clock seconds
+    barData: dict = None	# Single bar, time as wall clock seconds
+    endDate: str = None	# IB end date of the requested historical data
+    createdAt: float = field(default_factory=time.perf_counter)	# For the queue wait metric
 
 
 class GenericClient():
@@ -37,8 +54,11 @@ class GenericClient():
         pass
 
 
-    def requestData(self, symbol:str, timeframe:str='1 min', duration:str='2 D', endDate:str=''):
+    def requestData(self, symbol:str, timeframe:str='1 min', duration:str='2 D', endDate:str='', priority:RequestPriority=RequestPriority.VIEW):
         pass
 
+    def memoryUsage(self) -> dict:
+        return {}
+
     def close(self):
         pass
\ No newline at end of file
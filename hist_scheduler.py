@@ -0,0 +1,216 @@
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from ibapi.contract import Contract
+
+from generic_client import RequestPriority
+
+
+@dataclass
+class HistRequest:
+    reqId:int
+    contract:Contract
+    endDate:str
+    duration:str
+    barSize:str
+    priority:RequestPriority = RequestPriority.VIEW
+    keepUpToDate:bool = False	# TWS keeps sending the last bar, only with an empty endDate
+    seq:int = 0
+    submittedAt:float = None
+    issuedAt:float = None
+
+    def signature(self) -> Tuple[str, str, str, str]:
+        # IB treats requests with the same contract, end, duration and bar size as identical
+        return (self.contract.symbol, self.endDate, self.duration, self.barSize)
+
+
+class HistoricalRequestScheduler():
+    """Queue for historical data requests which respects the IB pacing rules.
+
+    https://interactivebrokers.github.io/tws-api/historical_limitations.html
+    - no more than 60 requests within 10 minutes
+    - no identical request within 15 seconds
+    - no more than 6 requests for the same contract within 2 seconds
+    - limited number of simultaneously open requests
+
+    Requests are issued by priority (chart view first), identical requests are
+    merged and requests which are no longer needed can be cancelled.
+    """
+
+    def __init__(self, issue:Callable[[HistRequest], None], cancel:Callable[[int], None],
+                 maxRequests:int=60, window:float=600.0, minRepeat:float=15.0,
+                 maxPerContract:int=5, contractWindow:float=2.0, maxConcurrent:int=10,
+                 viewReserve:int=10, pacingBackoff:float=15.0):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+
+        self.issue = issue
+        self.cancelRequest = cancel
+        self.maxRequests = maxRequests
+        self.window = window
+        self.minRepeat = minRepeat
+        self.maxPerContract = maxPerContract
+        self.contractWindow = contractWindow
+        self.maxConcurrent = maxConcurrent
+        self.viewReserve = viewReserve	# Budget only available for VIEW requests
+        self.pacingBackoff = pacingBackoff
+
+        self.cond = threading.Condition()
+        self.running = False
+        self.seq:int = 0
+        self.queue:List[HistRequest] = []
+        self.active:Dict[int, HistRequest] = {}		# reqId -> request
+        self.sent:Deque[float] = deque()		# issue timestamps inside the pacing window
+        self.contractSent:Dict[str, Deque[float]] = {}	# symbol -> issue timestamps
+        self.lastSent:Dict[Tuple[str, str, str, str], float] = {}	# signature -> issue timestamp
+        self.holdUntil:float = 0.0
+
+
+    def start(self) -> None:
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+    def stop(self) -> None:
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+
+    def submit(self, request:HistRequest) -> int:
+        """Queue a request, identical queued or running requests are merged.
+
+        A request with keepUpToDate is merged only into a queued request or into a
+        running request that keeps up to date as well.
+
+        Args:
+            request (HistRequest): New request.
+
+        Returns:
+            int: reqId which will deliver the data, the reqId of the existing request if merged.
+        """
+        with self.cond:
+            sig = request.signature()
+            for other in list(self.active.values()) + self.queue:
+                if other.signature() == sig:
+                    if request.keepUpToDate and not other.keepUpToDate and other.reqId in self.active:
+                        # Already sent to TWS without updates, the live request has to be sent on its own
+                        continue
+                    # Upgrade a prefetch to the more urgent priority
+                    other.priority = min(other.priority, request.priority)
+                    other.keepUpToDate = other.keepUpToDate or request.keepUpToDate
+                    self.logger.debug(f'submit: merged reqId={request.reqId} into reqId={other.reqId}')
+                    return other.reqId
+            self.seq += 1
+            request.seq = self.seq
+            request.submittedAt = time.monotonic()
+            self.queue.append(request)
+            self.cond.notify_all()
+            return request.reqId
+
+
+    def done(self, reqId:int) -> None:
+        """Free the slot of a finished or failed request."""
+        with self.cond:
+            if self.active.pop(reqId, None) != None:
+                self.cond.notify_all()
+
+
+    def cancel(self, reqId:int) -> None:
+        """Drop a queued request or cancel a running request at TWS."""
+        running = False
+        with self.cond:
+            self.queue = [r for r in self.queue if r.reqId != reqId]
+            running = self.active.pop(reqId, None) != None
+            self.cond.notify_all()
+        if running:
+            self.logger.debug(f'cancel: cancelHistoricalData reqId={reqId}')
+            try:
+                self.cancelRequest(reqId)
+            except:
+                self.logger.exception('cancel: EXCEPTION')
+
+
+    def pacingViolation(self, reqId:int) -> None:
+        """Put a request rejected by TWS back into the queue and pause issuing."""
+        with self.cond:
+            request = self.active.pop(reqId, None)
+            self.holdUntil = time.monotonic() + self.pacingBackoff
+            if request != None:
+                self.queue.append(request)
+            self.cond.notify_all()
+        self.logger.warning(f'pacingViolation: reqId={reqId}, pause for {self.pacingBackoff}s')
+
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.queue) + len(self.active)
+
+
+    def nextRequest(self, now:float) -> Tuple[Optional[HistRequest], Optional[float]]:
+        """Next request allowed by the pacing rules.
+
+        Returns:
+            Tuple[Optional[HistRequest], Optional[float]]: Request or None and the time to wait (None = until notified).
+        """
+        while len(self.sent) > 0 and self.sent[0] <= now - self.window:
+            self.sent.popleft()
+        if len(self.lastSent) > 256:
+            self.lastSent = {sig: t for sig, t in self.lastSent.items() if now - t < self.minRepeat}
+        if len(self.queue) == 0 or len(self.active) >= self.maxConcurrent:
+            return None, None
+        if now < self.holdUntil:
+            return None, self.holdUntil - now
+
+        wait = None
+        for request in sorted(self.queue, key=lambda r: (r.priority, r.seq)):
+            delays = []
+            # Keep some budget for the chart the user is looking at
+            limit = self.maxRequests if request.priority == RequestPriority.VIEW else self.maxRequests - self.viewReserve
+            if len(self.sent) >= limit:
+                delays.append(self.sent[len(self.sent) - limit] + self.window - now)
+            last = self.lastSent.get(request.signature())
+            if last != None and now - last < self.minRepeat:
+                delays.append(last + self.minRepeat - now)
+            contractSent = self.contractSent.get(request.contract.symbol, deque())
+            while len(contractSent) > 0 and contractSent[0] <= now - self.contractWindow:
+                contractSent.popleft()
+            if len(contractSent) >= self.maxPerContract:
+                delays.append(contractSent[0] + self.contractWindow - now)
+            if len(delays) == 0:
+                return request, None
+            delay = max(delays)
+            wait = delay if wait == None else min(wait, delay)
+        return None, wait
+
+
+    def run(self) -> None:
+        self.logger.debug('Scheduler started')
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                request, wait = self.nextRequest(now)
+                if request == None:
+                    self.cond.wait(wait)
+                    continue
+                self.queue.remove(request)
+                request.issuedAt = now
+                self.active[request.reqId] = request
+                self.sent.append(now)
+                self.contractSent.setdefault(request.contract.symbol, deque()).append(now)
+                self.lastSent[request.signature()] = now
+            try:
+                self.logger.debug(f'run: issue reqId={request.reqId} {request.signature()} priority={request.priority.name}')
+                self.issue(request)
+            except:
+                self.logger.exception('run: EXCEPTION')
+                self.done(request.reqId)
@@ -1,23 +1,38 @@
 # General Imports
 import asyncio
-from datetime import time, datetime
+from datetime import timedelta
 import logging
 import threading
-from typing import Dict, List, Tuple, Optional
+import time
+import numpy as np
+from typing import Dict, List, Set, Tuple, Optional
 # TWS API
 from ibapi.client import EClient
 from ibapi.common import BarData
 from ibapi.contract import Contract, ContractDetails
 from ibapi.wrapper import EWrapper
 
-from generic_client import GenericClient, ObjectType, QueueObject
+from bar_buffer import BarBuffer
+from bar_store import BAR_COLUMNS
+from budget_cache import BudgetCache
+from bar_store import BarStore, formatEndDate, fromWallSeconds, timedeltaToDuration
+from generic_client import GenericClient, ObjectType, QueueObject, RequestPriority
+from hist_scheduler import HistoricalRequestScheduler, HistRequest
+from metrics import METRICS
+from resampler import BASE_TIMEFRAME, RESAMPLED_TIMEFRAMES, baseTimeframe, resampleBars
+
+
+# Longest gap fetched with a single request of base bars, longer gaps are split
+BASE_REQUEST_SPAN = timedelta(days=7)
+# Longest view resampled from base bars (1 W with holidays), longer views would need many base requests
+MAX_RESAMPLE_SPAN = timedelta(days=10)
 
 
 class IBClient(GenericClient, EWrapper, EClient):
 
     dataQueue:asyncio.Queue
 
-    def __init__(self, dataQueue:asyncio.Queue, loop:asyncio.AbstractEventLoop, host:str='localhost', port:int=7497, clientId:int=4243):
+    def __init__(self, dataQueue:asyncio.Queue, loop:asyncio.AbstractEventLoop, host:str='localhost', port:int=7497, clientId:int=4243, storePath:str='barstore', candleCacheMB:int=512):
         GenericClient.__init__(self, dataQueue, loop)
         EClient.__init__(self, self)
 
@@ -36,43 +51,43 @@ class IBClient(GenericClient, EWrapper, EClient):
         self.histTickerIdSymbolTimeframe:Dict[int, Tuple[str, str]] = {}	# tickerId -> symbol,timeframe
         self.symbolLiveTickerIds:Dict[str, int] = {}	# symbol -> tickerId
         self.symbolCandleTickerIds:Dict[str, int] = {}	# symbol -> tickerId
-        self.symbolCandleData:Dict[Tuple[str, str], List] = {}		# symbol -> list
+        # symbol,timeframe -> bars, least recently viewed series are evicted above the budget
+        self.symbolCandleData:BudgetCache = BudgetCache(candleCacheMB*1024*1024//2, BarBuffer.nbytes, self.evictSeries)
+        self.liveViews:Dict[int, Set[Tuple[str, str]]] = {}	# tickerId which delivers historicalDataUpdate -> symbol,timeframe of the updated views
+        self.liveBars:Dict[int, BarBuffer] = {}	# tickerId -> latest fetched bars of resampled live views
         self.cDetails:Dict[str, ContractDetails] = {}	# symbol -> ContractDetails
+        self.readerThread:threading.Thread = None	# Runs EClient.run, all EWrapper callbacks come from it
+
+        # Local bar store, only the gaps are requested from TWS
+        self.barStore = BarStore(storePath, candleCacheMB*1024*1024//2)
+        self.histLock = threading.RLock()
+        self.histRequests:Dict[int, Tuple[int, int]] = {}	# tickerId -> requested start,end (wall clock seconds)
+        self.histRequestBars:Dict[int, BarBuffer] = {}	# tickerId -> received bars
+        self.cancelledHistTickerIds:Set[int] = set()	# tickerIds cancelled by this client, TWS confirms with error 162
+        self.histIssued:Dict[int, float] = {}	# tickerId -> issue time (monotonic), only with metrics enabled
+        self.pendingViews:Dict[Tuple[str, str], Tuple[str, str, Set[int]]] = {}	# symbol,timeframe -> endDate,duration,open tickerIds
+        self.pendingPrefetches:Dict[Tuple[Tuple[str, str], str], Tuple[str, str, Set[int]]] = {}	# (symbol,timeframe),endDate -> endDate,duration,open tickerIds
+
+        # All historical requests pass the pacing aware scheduler
+        self.scheduler = HistoricalRequestScheduler(self.issueHistRequest, self.cancelHistRequest)
 
 
     def start(self) -> None:
         try:
             self.connect(self.host, self.port, self.clientId)
             # Start IBAPI mainloop
-            threading.Thread(target=self.run, daemon=True).start()
+            self.readerThread = threading.Thread(target=self.run, daemon=True, name='ib-reader')
+            self.readerThread.start()
+            self.scheduler.start()
         except:
             self.logger.exception(f'Error while connect to TWS/Gateway')
 
 
     def close(self):
+        self.scheduler.stop()
         self.disconnect()
 
 
-    @staticmethod
-    def convertBar(bar:BarData) -> dict:
-        # Intraday -> Timestamp as string, >=EOD -> Date string ("20200921")
-        dt = None
-        try:
-            d = datetime.strptime(bar.date, '%Y%m%d').date()
-            dt = datetime.combine(d, time(15, 30))
-        except:
-            dt = datetime.fromtimestamp(int(bar.date))
-        data = {
-            'time': dt,
-            'open': bar.open,
-            'high': bar.high,
-            'low': bar.low,
-            'close': bar.close,
-            'volume': int(bar.volume)
-        }
-        return data
-
-
     @staticmethod
     def createStockContract(symbol):
         contract = Contract()
@@ -148,7 +163,33 @@ class IBClient(GenericClient, EWrapper, EClient):
         self.logger.error(msg)
 
 
+    def cancelHistRequest(self, reqId:int) -> None:
+        """Cancel a historical data request, the confirmation of TWS is not shown to the user."""
+        with self.histLock:
+            self.cancelledHistTickerIds.add(reqId)
+        self.cancelHistoricalData(reqId)
+
+
     def error(self, reqId:int, code:int, msg:str, misc:str=''):
+        if reqId in self.cancelledHistTickerIds and (code == 366 or (code == 162 and 'query cancelled' in msg.lower())):
+            # TWS confirms a cancel of this client
+            with self.histLock:
+                self.cancelledHistTickerIds.discard(reqId)
+            self.logger.info(f'Historical data request {reqId} cancelled - ({code})')
+            return
+        if code == 162 and 'pacing violation' in msg.lower() and reqId in self.histRequests:
+            # Retry later instead of bothering the user
+            with self.histLock:
+                self.histRequestBars[reqId] = BarBuffer()
+            self.scheduler.pacingViolation(reqId)
+            return
+        with self.histLock:
+            failed = self.histRequests.pop(reqId, None) != None
+            self.histRequestBars.pop(reqId, None)
+        if failed:
+            # Failed gap request, send what we have without marking the gap as covered
+            self.scheduler.done(reqId)
+            self.finishRequest(reqId)
         if code in [2104, 2106, 2158]:
             if 'is OK' in msg:
                 self.logger.info(msg)
@@ -162,29 +203,81 @@ class IBClient(GenericClient, EWrapper, EClient):
             self.logger.error(msg)
 
 
-    def requestData(self, symbol:str, timeframe:str='1 min', duration:str='2 D', endDate:str=''):
+    def requestData(self, symbol:str, timeframe:str='1 min', duration:str='2 D', endDate:str='', priority:RequestPriority=RequestPriority.VIEW):
         try:
             contract = IBClient.createStockContract(symbol)
             # Historical data
             symbol = symbol.upper()
             timeframe = timeframe.lower()
             key = (symbol, timeframe, )
-            if key not in self.symbolTimeframeHistTickerIds:
-                # Create a new ticker request
-                tid = self.getNextTickerId()
-                self.symbolTimeframeHistTickerIds[key] = tid
-                self.histTickerIdSymbolTimeframe[tid] = key
-                self.symbolCandleData[key] = []
-                self.reqHistoricalData(
-                    tid, contract, endDate, duration, timeframe, 'TRADES', True, 2, False, []
-                )
-            else:
-                # Already requested data for this symbol
-                if key in self.symbolCandleData and len(self.symbolCandleData[key]) > 0:
-                    asyncio.run_coroutine_threadsafe(
-                        self.dataQueue.put(QueueObject(ObjectType.HistoricalData, symbol=key[0], timeframe=key[1], listData=self.symbolCandleData[key])),
-                        self.loop
-                    )
+            # Short intraday views are resampled from the stored base bars
+            fetchKey = self.fetchKey(key, endDate, duration)
+            start, end = self.barStore.requestRange(endDate, duration)
+            gaps = self.barStore.missingRanges(fetchKey, start, end)
+            if fetchKey[1] == BASE_TIMEFRAME:
+                gaps = self.splitGaps(gaps)
+            tids = set()
+            for gapStart, gapEnd in gaps:
+                # Only request the missing parts
+                if (gapStart, gapEnd) == (start, end):
+                    gapEndDate, gapDuration = endDate, duration
+                else:
+                    gapEndDate = formatEndDate(fromWallSeconds(gapEnd))
+                    gapDuration = timedeltaToDuration(timedelta(seconds=gapEnd-gapStart))
+                # The newest gap of a view until now streams the running bar afterwards
+                live = endDate == '' and gapEnd == end and priority == RequestPriority.VIEW and timeframe != '1 day'
+                if live:
+                    gapEndDate = ''
+                with self.histLock:
+                    tid = self.getNextTickerId()
+                    self.histTickerIdSymbolTimeframe[tid] = fetchKey
+                    self.histRequests[tid] = (gapStart, gapEnd)
+                    self.histRequestBars[tid] = BarBuffer()
+                    usedTid = self.scheduler.submit(HistRequest(tid, contract, gapEndDate, gapDuration, fetchKey[1], priority, keepUpToDate=live))
+                    if usedTid != tid:
+                        # Identical request already queued or running
+                        self.histRequests.pop(tid)
+                        self.histRequestBars.pop(tid)
+                    if live:
+                        self.startLive(key, usedTid)
+                    if priority == RequestPriority.VIEW:
+                        # Background requests must not replace the tickerId of the live view
+                        self.symbolTimeframeHistTickerIds[key] = usedTid
+                    tids.add(usedTid)
+                self.logger.debug(f'requestData: {fetchKey} gap request tid={usedTid}, end={gapEndDate}, duration={gapDuration}')
+
+            if priority == RequestPriority.VIEW:
+                with self.histLock:
+                    # The user moved on, cancel everything requested for the previous view
+                    stale = set()
+                    for view in self.pendingViews.values():
+                        stale.update(view[2])
+                    self.pendingViews.clear()
+                    # Prefetches for other charts are not needed anymore either
+                    for prefetchKey in [k for k in self.pendingPrefetches if k[0] != key]:
+                        stale.update(self.pendingPrefetches.pop(prefetchKey)[2])
+                    keep = set(tids)
+                    for prefetch in self.pendingPrefetches.values():
+                        keep.update(prefetch[2])
+                    for tid in stale - keep:
+                        self.histRequests.pop(tid, None)
+                        self.histRequestBars.pop(tid, None)
+                        self.histIssued.pop(tid, None)
+                        self.liveViews.pop(tid, None)
+                        self.liveBars.pop(tid, None)
+                        self.scheduler.cancel(tid)
+                    if len(tids) > 0:
+                        self.pendingViews[key] = (endDate, duration, tids)
+                if len(tids) == 0:
+                    # Everything is available in the local store
+                    self.sendBars(key, endDate, duration)
+            elif priority == RequestPriority.PREFETCH:
+                with self.histLock:
+                    if len(tids) > 0:
+                        self.pendingPrefetches[(key, endDate)] = (endDate, duration, tids)
+                if len(tids) == 0:
+                    self.sendBars(key, endDate, duration, ObjectType.PrefetchData)
+
             # Check if we already have contract details for this stock
             if symbol not in self.cDetails:
                 self.reqContractDetails(self.getNextRequestId(), contract)
@@ -192,15 +285,181 @@ class IBClient(GenericClient, EWrapper, EClient):
             self.logger.exception('requestData: EXCEPTION')
 
 
+    def startLive(self, key:Tuple[str, str], tid:int) -> None:
+        """Update a view with the live bars of tid, an older subscription of the same view is stopped."""
+        with self.histLock:
+            for old in [t for t, views in self.liveViews.items() if key in views and t != tid]:
+                self.stopLive(key, old)
+            self.liveViews.setdefault(tid, set()).add(key)
+
+
+    def stopLive(self, key:Tuple[str, str], tid:int) -> None:
+        """Stop the live updates of a view, the subscription is cancelled once no view uses it."""
+        with self.histLock:
+            views = self.liveViews.get(tid)
+            if views == None:
+                return
+            views.discard(key)
+            if len(views) > 0:
+                return
+            self.liveViews.pop(tid)
+            self.liveBars.pop(tid, None)
+            if tid not in self.histRequests:
+                self.histTickerIdSymbolTimeframe.pop(tid, None)
+        self.logger.debug(f'stopLive: cancelHistoricalData tid={tid} for {key}')
+        self.cancelHistRequest(tid)
+
+
+    def fetchKey(self, key:Tuple[str, str], endDate:str, duration:str) -> Tuple[str, str]:
+        """Series which is requested from TWS and read from the store for a view.
+
+        Intraday views up to MAX_RESAMPLE_SPAN are resampled from base bars.
+        Longer views would need one base request per BASE_REQUEST_SPAN and use up
+        the pacing budget, they are fetched with their own bar size like before,
+        unless the store already has all base bars. This trades one IB request
+        for a second stored series of the same bars.
+
+        Args:
+            key (Tuple[str, str]): symbol, timeframe of the view
+            endDate (str): IB end date of the view.
+            duration (str): IB duration of the view.
+
+        Returns:
+            Tuple[str, str]: symbol, timeframe of the fetched series.
+        """
+        base = (key[0], baseTimeframe(key[1]), )
+        if base == key:
+            return key
+        start, end = self.barStore.requestRange(endDate, duration)
+        if end - start <= MAX_RESAMPLE_SPAN.total_seconds() or len(self.barStore.missingRanges(base, start, end)) == 0:
+            return base
+        return key
+
+
+    @staticmethod
+    def splitGaps(gaps:List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Split gaps into parts TWS delivers with a single request of base bars, newest first."""
+        span = int(BASE_REQUEST_SPAN.total_seconds())
+        result = []
+        for gapStart, gapEnd in reversed(gaps):
+            while gapEnd - gapStart > span:
+                result.append((gapEnd - span, gapEnd))
+                gapEnd -= span
+            result.append((gapStart, gapEnd))
+        return result
+
+
+    def readBars(self, key:Tuple[str, str], endDate:str, duration:str) -> Dict[str, np.ndarray]:
+        """Bars of a view from the store, short derived timeframes are resampled from the base bars.
+
+        Args:
+            key (Tuple[str, str]): symbol, timeframe
+            endDate (str): IB end date of the view.
+            duration (str): IB duration of the view.
+
+        Returns:
+            Dict[str, np.ndarray]: Bar columns, **time** as wall clock seconds.
+        """
+        fetchKey = self.fetchKey(key, endDate, duration)
+        bars = self.barStore.read(fetchKey, endDate, duration)
+        if fetchKey != key:
+            bars = resampleBars(bars, key[1])
+        return bars
+
+
+    def evictSeries(self, key:Tuple[str, str], bars:BarBuffer) -> None:
+        """Forget a series which was pushed out of the memory budget and stop its live updates."""
+        with self.histLock:
+            if key in self.pendingViews or key in [k[0] for k in self.pendingPrefetches]:
+                # Still loading, keep the request bookkeeping
+                return
+            self.symbolTimeframeHistTickerIds.pop(key, None)
+            live = [t for t, views in self.liveViews.items() if key in views]
+            # Finished requests of the view, base bars or bars of its own timeframe
+            fetchKeys = [key, (key[0], baseTimeframe(key[1]), )]
+            for t in [t for t, k in self.histTickerIdSymbolTimeframe.items() if k in fetchKeys and t not in self.histRequests and t not in self.liveViews]:
+                self.histTickerIdSymbolTimeframe.pop(t)
+        for tid in live:
+            self.stopLive(key, tid)
+
+
+    def memoryUsage(self) -> dict:
+        """Approximate memory used by cached bars, to size CANDLE_CACHE_MB."""
+        return {
+            'candleData': self.symbolCandleData.stats(),
+            'barStore': self.barStore.series.stats(),
+            'liveSubscriptions': len(self.liveViews)
+        }
+
+
+    def issueHistRequest(self, request:HistRequest) -> None:
+        if METRICS.enabled:
+            self.histIssued[request.reqId] = request.issuedAt
+            if request.submittedAt != None and request.issuedAt != None:
+                METRICS.record('ib.scheduled', request.issuedAt - request.submittedAt)
+        self.reqHistoricalData(
+            request.reqId, request.contract, request.endDate, request.duration, request.barSize, 'TRADES', True, 2, request.keepUpToDate, []
+        )
+
+
+    def sendBars(self, key:Tuple[str, str], endDate:str, duration:str, objectType:ObjectType=ObjectType.HistoricalData) -> None:
+        """Read the requested bars from the store and send them to the window.
+
+        Args:
+            key (Tuple[str, str]): symbol, timeframe
+            endDate (str): IB end date of the view.
+            duration (str): IB duration of the view.
+            objectType (ObjectType, optional): HistoricalData for the shown chart, PrefetchData for a prefetched view. Defaults to ObjectType.HistoricalData.
+        """
+        try:
+            with METRICS.span('client.readBars'):
+                bars = self.readBars(key, endDate, duration)
+            if objectType == ObjectType.HistoricalData:
+                self.symbolCandleData[key] = BarBuffer.fromColumns(bars)
+                self.logger.debug(f'sendBars: memory usage {self.memoryUsage()}')
+            if len(bars['time']) > 0:
+                asyncio.run_coroutine_threadsafe(
+                    self.dataQueue.put(QueueObject(objectType, symbol=key[0], timeframe=key[1], columnData=bars, endDate=endDate)),
+                    self.loop
+                )
+        except:
+            self.logger.exception('sendBars: EXCEPTION')
+
+
+    def finishRequest(self, reqId:int) -> None:
+        """Mark a gap request as done and send the views and prefetches once all their gaps are loaded.
+
+        A request of base bars can belong to views of several timeframes.
+        """
+        ready = []
+        with self.histLock:
+            for key, view in list(self.pendingViews.items()):
+                if reqId in view[2]:
+                    view[2].discard(reqId)
+                    if len(view[2]) == 0:
+                        self.pendingViews.pop(key)
+                        ready.append((key, view, ObjectType.HistoricalData))
+            for prefetchKey, prefetch in list(self.pendingPrefetches.items()):
+                if reqId in prefetch[2]:
+                    prefetch[2].discard(reqId)
+                    if len(prefetch[2]) == 0:
+                        self.pendingPrefetches.pop(prefetchKey)
+                        ready.append((prefetchKey[0], prefetch, ObjectType.PrefetchData))
+        for key, (endDate, duration, _), objectType in ready:
+            self.sendBars(key, endDate, duration, objectType)
+
+
     def historicalData(self, reqId:int, bar:BarData):
         try:
             # Too much output at debug level
             #self.logger.debug(f'historicalData reqId={reqId}, bar={bar}')
-            # creation bar dictionary for each bar received
-            data = self.convertBar(bar)
-            if reqId in self.histTickerIdSymbolTimeframe:
-                key = self.histTickerIdSymbolTimeframe[reqId]	# key: (symbol,timeframe)
-                self.symbolCandleData[key].append(data)
+            if reqId in self.histRequestBars:
+                if METRICS.enabled and len(self.histRequestBars[reqId]) == 0 and reqId in self.histIssued:
+                    METRICS.record('ib.firstBar', time.monotonic() - self.histIssued[reqId])
+                self.histRequestBars[reqId].append(bar)
+            elif reqId in self.histTickerIdSymbolTimeframe:
+                # Late bars of a cancelled request
+                pass
             else:
                 self.logger.warning(f'historicalData: Unknown tickerId={reqId}, bar={bar}')
         except:
@@ -210,25 +469,85 @@ class IBClient(GenericClient, EWrapper, EClient):
     def historicalDataUpdate(self, reqId:int, bar:BarData):
         try:
             self.logger.debug(f'historicalDataUpdate reqId={reqId}, bar={bar}')
-            data = self.convertBar(bar)
-            if reqId not in self.histTickerIdSymbolTimeframe:
-                self.logger.warning(f'historicalData: Unknown tickerId={reqId}, bar={bar}')
+            with self.histLock:
+                fetchKey = self.histTickerIdSymbolTimeframe.get(reqId)	# key: (symbol,timeframe)
+                views = list(self.liveViews.get(reqId, []))
+            if fetchKey == None or len(views) == 0:
+                self.logger.warning(f'historicalDataUpdate: Unknown tickerId={reqId}, bar={bar}')
                 return
-            key = self.histTickerIdSymbolTimeframe[reqId]	# key: (symbol,timeframe)
-            last = self.symbolCandleData[key][-1]
-            if last['time'] == data['time']:
-                self.symbolCandleData[key][-1] = data
-            else:
-                self.symbolCandleData[key].append(data)
-                # Send to window
-                asyncio.run_coroutine_threadsafe(
-                    self.dataQueue.put(QueueObject(ObjectType.HistoricalData, symbol=key[0], timeframe=key[1], listData=self.symbolCandleData[key])),
-                    self.loop
-                )
+            fetched = None
+            for key in views:
+                if key == fetchKey:
+                    self.updateLiveView(key, bar=bar)
+                else:
+                    if fetched == None:
+                        fetched = self.updateLiveBars(reqId, fetchKey, bar)
+                    # Bar of the view which contains the changed base bar
+                    self.updateLiveView(key, values=self.openBucket(fetched, key[1]))
         except:
             self.logger.exception('historicalDataUpdate: EXCEPTION')
 
 
+    def updateLiveBars(self, reqId:int, fetchKey:Tuple[str, str], bar:BarData) -> BarBuffer:
+        """Apply a live bar to the fetched bars of the resampled views of reqId.
+
+        Only the bars of the newest buckets are kept, they start with the stored bars.
+        """
+        bars = self.liveBars.get(reqId)
+        if bars == None:
+            stored = self.barStore.load(fetchKey)
+            size = max(RESAMPLED_TIMEFRAMES.values())
+            first = np.searchsorted(stored['time'], stored['time'][-1] - size, side='right') if len(stored['time']) > 0 else 0
+            bars = self.liveBars[reqId] = BarBuffer.fromColumns({c: stored[c][first:] for c in BAR_COLUMNS})
+        t = bars.barTime(bar)
+        if bars.lastTime() == t:
+            bars.replaceLast(bar, t)
+        elif bars.lastTime() == None or t > bars.lastTime():
+            bars.append(bar, t)
+        return bars
+
+
+    @staticmethod
+    def openBucket(bars:BarBuffer, timeframe:str) -> dict:
+        """Resampled bar of the bucket which contains the newest base bar, **time** as wall clock seconds."""
+        columns = bars.columns()
+        # Every base bar of the newest bucket is less than one bucket older than the newest base bar
+        first = np.searchsorted(columns['time'], columns['time'][-1] - RESAMPLED_TIMEFRAMES[timeframe], side='right')
+        bucket = resampleBars({c: columns[c][first:] for c in BAR_COLUMNS}, timeframe)
+        return {c: bucket[c][-1].item() for c in BAR_COLUMNS}
+
+
+    def updateLiveView(self, key:Tuple[str, str], bar:BarData=None, values:dict=None) -> None:
+        """Replace or append the last bar of a view and send only the changed bar to the window.
+
+        Args:
+            key (Tuple[str, str]): symbol, timeframe of the view
+            bar (BarData, optional): Live bar of the timeframe of the view.
+            values (dict, optional): Resampled bar, **time** as wall clock seconds, instead of bar.
+        """
+        bars = self.symbolCandleData.get(key)
+        if bars == None:
+            self.logger.warning(f'historicalDataUpdate: No bars for {key}')
+            return
+        if values == None:
+            t = bars.barTime(bar)
+            values = {'time': t, 'open': bar.open, 'high': bar.high, 'low': bar.low, 'close': bar.close, 'volume': int(bar.volume)}
+        if bars.lastTime() == values['time']:
+            bars.replaceLastValues(**values)
+            objectType = ObjectType.BarUpdate
+        elif bars.lastTime() == None or values['time'] > bars.lastTime():
+            bars.appendValues(**values)
+            objectType = ObjectType.BarAppend
+            self.symbolCandleData.resize(key)
+        else:
+            # Bucket before the last bar, already part of the view
+            return
+        asyncio.run_coroutine_threadsafe(
+            self.dataQueue.put(QueueObject(objectType, symbol=key[0], timeframe=key[1], barData=bars.lastBar())),
+            self.loop
+        )
+
+
     # callback when all historical data has been received
     def historicalDataEnd(self, reqId:int, start:str, end:str):
         try:
@@ -237,9 +556,20 @@ class IBClient(GenericClient, EWrapper, EClient):
                 self.logger.warning(f'historicalDataEnd: Unknown tickerId={reqId}, start={start}, end={end}')
                 return
             key = self.histTickerIdSymbolTimeframe[reqId]	# key: (symbol,timeframe)
-            asyncio.run_coroutine_threadsafe(
-                self.dataQueue.put(QueueObject(ObjectType.HistoricalData, symbol=key[0], timeframe=key[1], listData=self.symbolCandleData[key])),
-                self.loop
-            )
+            with self.histLock:
+                requested = self.histRequests.pop(reqId, None)
+                bars = self.histRequestBars.pop(reqId, BarBuffer())
+            if requested == None:
+                self.logger.warning(f'historicalDataEnd: Request already finished tickerId={reqId}')
+                return
+            start, end = requested
+            self.scheduler.done(reqId)
+            issued = self.histIssued.pop(reqId, None)
+            if issued != None:
+                METRICS.record('ib.request', time.monotonic() - issued)
+            # Save to disk and send the view if this was the last missing gap
+            with METRICS.span('store.merge'):
+                self.barStore.merge(key, bars.columns(), start, end)
+            self.finishRequest(reqId)
         except:
             self.logger.exception('historicalDataEnd: EXCEPTION')
@@ -0,0 +1,55 @@
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, Set
+
+import numpy as np
+import pandas as pd
+
+from bar_store import BAR_COLUMNS
+from budget_cache import BudgetCache
+
+
+def dataFingerprint(df:pd.DataFrame) -> str:
+    """Hash over the bar columns, identical bars give the same fingerprint.
+
+    Args:
+        df (pd.DataFrame): Bars with time, open, high, low, close and volume.
+
+    Returns:
+        str: Hex digest.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(len(df)).encode())
+    for c in BAR_COLUMNS:
+        values = df[c].to_numpy()
+        if values.dtype.kind in 'iufM':
+            h.update(np.ascontiguousarray(values).view(np.uint8))
+        else:
+            h.update(pd.util.hash_pandas_object(df[c], index=False).to_numpy().view(np.uint8))
+    return h.hexdigest()
+
+
+@dataclass
+class PipelineState:
+    """Computed indicator nodes of one data version."""
+    values:Dict[str, np.ndarray] = field(default_factory=dict)	# column -> values
+    computed:Set[str] = field(default_factory=set)	# finished node names
+    intraday:bool = False
+
+    def nbytes(self) -> int:
+        return sum(v.nbytes for v in self.values.values())
+
+
+class IndicatorCache(BudgetCache):
+    """LRU cache of computed indicator states with a memory budget.
+
+    Keys are data versions like (symbol, timeframe, endDate, fingerprint), so
+    showing a chart again only assembles the frame instead of recomputing it.
+    """
+
+    def __init__(self, maxBytes:int=256*1024*1024):
+        super().__init__(maxBytes, PipelineState.nbytes)
+
+
+    def invalidate(self, version:Hashable) -> None:
+        self.pop(version)
@@ -1,8 +1,11 @@
 import logging
-from typing import List, Tuple, Optional
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Set, Tuple, Optional
 import numpy as np
 import pandas as pd
-from ta.trend import PSARIndicator, SMAIndicator
+
+from indicator_cache import IndicatorCache, PipelineState
+from metrics import METRICS
 
 
 def isIntraday(df:pd.DataFrame) -> True:
@@ -21,69 +24,365 @@ def isIntraday(df:pd.DataFrame) -> True:
         raise ValueError("DataFrame must contain a 'time' column")
     if len(df) < 2:
         raise ValueError("DataFrame must have at least two rows to detect frequency")
+    return isIntradayKernel(df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64))
+
+
+def isIntradayKernel(t:np.ndarray) -> bool:
+    """isIntraday on int64 nanosecond timestamps, the two earliest bars are compared without sorting."""
+    first, second = np.partition(t, 1)[:2]
+    return second - first < 86400 * 10**9
+
 
-    # Ensure sorted by time
-    df_sorted = df.sort_values('time').reset_index(drop=True)
-    
-    delta = df_sorted.loc[1, 'time'] - df_sorted.loc[0, 'time']
-
-    if delta >= pd.Timedelta(days=1):
-        return False
-    return True
-
+# Array kernels, all inputs and outputs are float64 NumPy arrays.
+# Recursive filters use the compiled pandas window functions on zero copy Series.
+
+def emaKernel(x:np.ndarray, alpha:float=None, span:float=None) -> np.ndarray:
+    """Exponential moving average, same as Series.ewm(alpha=alpha or span=span, adjust=False).mean()."""
+    return pd.Series(x, copy=False).ewm(alpha=alpha, span=span, adjust=False).mean().to_numpy()
+
+
+def rmaKernel(x:np.ndarray, n:int) -> np.ndarray:
+    """Wilder moving average seeded with the mean of x[1:n+1], NaN before index n."""
+    y = np.full_like(x, np.nan)
+    if len(x) <= n:
+        return y
+    y[n] = x[1:n+1].mean()
+    y[n+1:] = x[n+1:]
+    return emaKernel(y, 1.0/n)
+
+
+def rollingMean(x:np.ndarray, n:int, minPeriods:int=None) -> np.ndarray:
+    return pd.Series(x, copy=False).rolling(n, min_periods=minPeriods).mean().to_numpy()
+
+
+def rollingStd(x:np.ndarray, n:int) -> np.ndarray:
+    """Rolling population standard deviation (ddof=0)."""
+    return pd.Series(x, copy=False).rolling(n).std(ddof=0).to_numpy()
+
+
+def shift(x:np.ndarray) -> np.ndarray:
+    y = np.empty_like(x)
+    y[0] = np.nan
+    y[1:] = x[:-1]
+    return y
+
+
+def rangeComponents(high:np.ndarray, low:np.ndarray, close:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """high-low, high-previous close and low-previous close, shared by ADX and ATR."""
+    pClose = shift(close)
+    return high - low, high - pClose, low - pClose
+
+
+def rowMax(*arrays:np.ndarray) -> np.ndarray:
+    # Like DataFrame.max(axis=1), NaN only wins if all values are NaN
+    with np.errstate(invalid='ignore'):
+        return np.fmax.reduce(arrays)
+
+
+def bollingerKernel(x:np.ndarray, period:int, std:list) -> dict:
+    out = {}
+    N = int(period)
+    sd = np.nan_to_num(rollingStd(x, N), nan=0.0)
+    sma = rollingMean(x, N)
+    sma = np.where(np.isnan(sma), x, sma)
+    out[f'SMA {period}'] = sma
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['bb_pc'] = np.nan_to_num((x - sma) / sd, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    for idx, stdev in enumerate(std):
+        out[f'bb_upper{idx+1}'] = sma + stdev * sd
+        out[f'bb_lower{idx+1}'] = sma - stdev * sd
+    return out
+
+
+def rsiKernel(x:np.ndarray, period:int) -> np.ndarray:
+    N = int(period)
+    if len(x) <= N:
+        return np.full_like(x, 50.0)
+    change = x - shift(x)
+    gain = np.where(change < 0, 0.0, change)
+    loss = np.where(change > 0, 0.0, -change)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = rmaKernel(gain, N) / rmaKernel(loss, N)
+        rsi = 100 - (100 / (1 + rs))
+    return np.nan_to_num(rsi, nan=50.0, posinf=np.inf, neginf=-np.inf)
+
+
+def adxKernel(high:np.ndarray, low:np.ndarray, hl:np.ndarray, hpc:np.ndarray, lpc:np.ndarray, period:int) -> dict:
+    alpha = float(1/period)
+    tr = rowMax(hl, np.abs(hpc), np.abs(lpc))
+    atr = emaKernel(tr, alpha)
+    hph = high - shift(high)
+    pll = shift(low) - low
+    with np.errstate(invalid='ignore'):
+        dxp = np.where((hph > pll) & (hph > 0), hph, 0.0)
+        dxm = np.where((hph < pll) & (pll > 0), pll, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dmip = (emaKernel(dxp, alpha)/atr)*100
+        dmim = (emaKernel(dxm, alpha)/atr)*100
+        dx = (np.abs(dmip - dmim)/(dmip + dmim))*100
+    adx = emaKernel(dx, alpha)
+    return {
+        'ADX': np.nan_to_num(adx, nan=100.0, posinf=np.inf, neginf=-np.inf),
+        'DMIP': np.nan_to_num(dmip, nan=100.0, posinf=np.inf, neginf=-np.inf),
+        'DMIM': np.nan_to_num(dmim, nan=100.0, posinf=np.inf, neginf=-np.inf)
+    }
+
+
+def atrKernel(hl:np.ndarray, hpc:np.ndarray, lpc:np.ndarray, period:int) -> np.ndarray:
+    # Signed ranges like the original AverageTrueRange
+    return rollingMean(rowMax(hl, hpc, lpc), period)
+
+
+def vwapKernel(t:np.ndarray, high:np.ndarray, low:np.ndarray, close:np.ndarray, volume:np.ndarray) -> np.ndarray:
+    """Intraday VWAP reset every day, t as int64 nanoseconds."""
+    day = t // (86400 * 10**9)
+    typicalPrice = (high + low + close) / 3
+    cumVol = pd.Series(volume, copy=False).groupby(day).cumsum().to_numpy()
+    cumVolTp = pd.Series(typicalPrice * volume, copy=False).groupby(day).cumsum().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cumVolTp / cumVol
+
+
+def psarKernel(high:np.ndarray, low:np.ndarray, close:np.ndarray, step:float=0.02, maxStep:float=0.2) -> np.ndarray:
+    """Parabolic SAR with the same rules as ta.trend.PSARIndicator(fillna=True).
+
+    The recursion runs over plain Python floats, which is much faster than the
+    per element pandas access of the ta implementation.
+    """
+    psar = close.tolist()
+    if len(psar) > 0:
+        highs = high.tolist()
+        lows = low.tolist()
+        upTrend = True
+        af = step
+        upHigh = highs[0]
+        downLow = lows[0]
+        for i in range(2, len(psar)):
+            reversal = False
+            if upTrend:
+                value = psar[i-1] + af * (upHigh - psar[i-1])
+                if lows[i] < value:
+                    reversal = True
+                    value = upHigh
+                    downLow = lows[i]
+                    af = step
+                else:
+                    if highs[i] > upHigh:
+                        upHigh = highs[i]
+                        af = min(af + step, maxStep)
+                    if lows[i-2] < value:
+                        value = lows[i-2]
+                    elif lows[i-1] < value:
+                        value = lows[i-1]
+            else:
+                value = psar[i-1] - af * (psar[i-1] - downLow)
+                if highs[i] > value:
+                    reversal = True
+                    value = downLow
+                    upHigh = highs[i]
+                    af = step
+                else:
+                    if lows[i] < downLow:
+                        downLow = lows[i]
+                        af = min(af + step, maxStep)
+                    if highs[i-2] > value:
+                        value = highs[i-2]
+                    elif highs[i-1] > value:
+                        value = highs[i-1]
+            psar[i] = value
+            upTrend = upTrend != reversal
+    psar = np.array(psar, dtype=np.float64)
+    if not np.isfinite(psar).all():
+        psar = pd.Series(np.where(np.isinf(psar), np.nan, psar)).ffill().bfill().to_numpy()
+    return psar
+
+
+@dataclass(frozen=True)
+class IndicatorSpec:
+    """Declaration of one indicator node.
+
+    Inputs are bar columns (time, open, high, low, close, volume) or outputs of
+    other nodes. Outputs starting with "_" are intermediates which are shared
+    between nodes but not added to the chart frame.
+    """
+    name:str
+    inputs:Tuple[str, ...]
+    outputs:Tuple[str, ...]
+    func:Callable[..., Dict[str, np.ndarray]]
+    params:Tuple[Tuple[str, object], ...] = ()
+    intradayOnly:bool = False
+
+    def compute(self, values:Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        return self.func(*[values[i] for i in self.inputs], **dict(self.params))
+
+
+# output column -> node which computes it
+INDICATOR_REGISTRY:Dict[str, IndicatorSpec] = {}
+
+BASE_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+# Columns of indicatorFactory, in this order
+DEFAULT_OUTPUTS = [
+    'VWAP', 'EMA', 'SMA', 'BB_PC', 'BB_UPPER1', 'BB_UPPER2', 'BB_LOWER1', 'BB_LOWER2',
+    'ADX', 'DMIP', 'DMIM', 'RSI', 'ATR', 'VOL_SMA', 'KC_UPPER', 'KC_LOWER', 'PSAR'
+]
+
+
+def registerIndicator(spec:IndicatorSpec) -> IndicatorSpec:
+    """Add an indicator node to the registry, e.g. a parameter variant with its own output names."""
+    for output in spec.outputs:
+        INDICATOR_REGISTRY[output] = spec
+    return spec
+
+
+def _bollinger(close, period, std):
+    bb = bollingerKernel(close, period, list(std))
+    return {
+        'SMA': bb[f'SMA {period}'],
+        'BB_PC': bb['bb_pc'],
+        'BB_UPPER1': bb['bb_upper1'],
+        'BB_UPPER2': bb['bb_upper2'],
+        'BB_LOWER1': bb['bb_lower1'],
+        'BB_LOWER2': bb['bb_lower2']
+    }
+
+
+def _ranges(high, low, close):
+    hl, hpc, lpc = rangeComponents(high, low, close)
+    return {'_HL': hl, '_HPC': hpc, '_LPC': lpc}
+
+
+registerIndicator(IndicatorSpec('ranges', ('high', 'low', 'close'), ('_HL', '_HPC', '_LPC'), _ranges))
+registerIndicator(IndicatorSpec('vwap', ('time', 'high', 'low', 'close', 'volume'), ('VWAP',),
+    lambda time, high, low, close, volume: {'VWAP': vwapKernel(time, high, low, close, volume)}, intradayOnly=True))
+registerIndicator(IndicatorSpec('ema', ('close',), ('EMA',),
+    lambda close, span: {'EMA': emaKernel(close, span=span)}, (('span', 5),)))
+registerIndicator(IndicatorSpec('bb', ('close',), ('SMA', 'BB_PC', 'BB_UPPER1', 'BB_UPPER2', 'BB_LOWER1', 'BB_LOWER2'),
+    _bollinger, (('period', 10), ('std', (2, 3)))))
+registerIndicator(IndicatorSpec('adx', ('high', 'low', '_HL', '_HPC', '_LPC'), ('ADX', 'DMIP', 'DMIM'),
+    adxKernel, (('period', 14),)))
+registerIndicator(IndicatorSpec('rsi', ('close',), ('RSI',),
+    lambda close, period: {'RSI': rsiKernel(close, period)}, (('period', 14),)))
+registerIndicator(IndicatorSpec('atr', ('_HL', '_HPC', '_LPC'), ('ATR',),
+    lambda hl, hpc, lpc, period: {'ATR': atrKernel(hl, hpc, lpc, period)}, (('period', 20),)))
+# Partial windows at the start like ta.SMAIndicator(fillna=True)
+registerIndicator(IndicatorSpec('vol_sma', ('volume',), ('VOL_SMA',),
+    lambda volume, period: {'VOL_SMA': rollingMean(volume.astype(np.float64), period, minPeriods=0)}, (('period', 10),)))
+registerIndicator(IndicatorSpec('kc', ('SMA', 'ATR'), ('KC_UPPER', 'KC_LOWER'),
+    lambda sma, atr, factor: {'KC_UPPER': sma + factor * atr, 'KC_LOWER': sma - factor * atr}, (('factor', 2.0),)))
+registerIndicator(IndicatorSpec('psar', ('high', 'low', 'close'), ('PSAR',),
+    lambda high, low, close, step, maxStep: {'PSAR': psarKernel(high, low, close, step, maxStep)}, (('step', 0.02), ('maxStep', 0.2))))
+
+
+class IndicatorPipeline():
+    """Computes only the requested indicator outputs and their dependencies.
+
+    Node results are kept per data version, so requesting additional outputs
+    for the same data (e.g. showing a hidden pane) only computes the missing nodes.
+    With a cache, the results of previously shown versions are kept as well.
+    """
 
-def indicatorFactory(df:pd.DataFrame) -> pd.DataFrame:
+    def __init__(self, registry:Dict[str, IndicatorSpec]=None, cache:IndicatorCache=None):
+        self.registry = INDICATOR_REGISTRY if registry == None else registry
+        self.cache = cache
+        self.version = None
+        self.state = PipelineState()
+
+
+    def resolve(self, outputs:List[str]) -> List[IndicatorSpec]:
+        """Dependency ordered list of the nodes needed for outputs, every node once."""
+        order:List[IndicatorSpec] = []
+        done:Set[str] = set()
+
+        def visit(column:str, path:Tuple[str, ...]):
+            if column in BASE_COLUMNS:
+                return
+            if column not in self.registry:
+                raise ValueError(f'Unknown indicator output "{column}"')
+            spec = self.registry[column]
+            if spec.name in done:
+                return
+            if spec.name in path:
+                raise ValueError(f'Indicator dependency cycle: {" -> ".join(path + (spec.name,))}')
+            for i in spec.inputs:
+                visit(i, path + (spec.name,))
+            done.add(spec.name)
+            order.append(spec)
+
+        for output in outputs:
+            visit(output, ())
+        return order
+
+
+    def compute(self, df:pd.DataFrame, outputs:List[str]=None, version:object=None) -> pd.DataFrame:
+        """Chart frame with the bar columns and the requested outputs, incomplete rows dropped.
+
+        Args:
+            df (pd.DataFrame): Bars with time, open, high, low, close and volume.
+            outputs (List[str], optional): Output columns. Defaults to DEFAULT_OUTPUTS.
+            version (object, optional): Data version, cached nodes of the same version are reused. Defaults to None (no caching).
+
+        Returns:
+            pd.DataFrame: Chart frame.
+        """
+        outputs = DEFAULT_OUTPUTS if outputs == None else outputs
+        state = self.state
+        if version == None or version != self.version or len(state.values) == 0 or len(state.values['time']) != len(df):
+            state = self.cache.get(version) if self.cache != None and version != None else None
+            if state != None and len(state.values['time']) != len(df):
+                state = None
+        if state == None:
+            state = PipelineState()
+            state.values = {
+                'time': df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+                'open': df['open'].to_numpy(dtype=np.float64),
+                'high': df['high'].to_numpy(dtype=np.float64),
+                'low': df['low'].to_numpy(dtype=np.float64),
+                'close': df['close'].to_numpy(dtype=np.float64),
+                'volume': df['volume'].to_numpy()
+            }
+            # Only calculate VWAP on intraday charts
+            state.intraday = isIntraday(df)
+        self.version = version
+        self.state = state
+
+        missing = [spec for spec in self.resolve(outputs) if spec.name not in state.computed]
+        for spec in missing:
+            if not spec.intradayOnly or state.intraday:
+                logging.debug(f'IndicatorPipeline: compute {spec.name}')
+                with METRICS.span('indicator.' + spec.name):
+                    state.values.update(spec.compute(state.values))
+            state.computed.add(spec.name)
+        if self.cache != None and version != None and (len(missing) > 0 or version not in self.cache.sizes):
+            self.cache.put(version, state)
+
+        columns = {c: df[c].to_numpy() for c in df.columns}
+        for output in outputs:
+            if output in state.values and not output.startswith('_'):
+                columns[output] = state.values[output]
+
+        # Drop incomplete rows and build the frame once
+        valid = np.ones(len(df), dtype=bool)
+        for c, values in columns.items():
+            if values.dtype.kind == 'f':
+                valid &= ~np.isnan(values)
+            elif values.dtype.kind == 'O':
+                valid &= ~pd.isna(values)
+        if valid.all():
+            return pd.DataFrame(columns)
+        return pd.DataFrame({c: values[valid] for c, values in columns.items()})
+
+
+def indicatorFactory(df:pd.DataFrame, outputs:List[str]=None) -> pd.DataFrame:
     # Chart 1
-    df1 = df.copy()
-    df1.reset_index(inplace=True, drop=True)
-
-    # Only calculate VWAP on intraday charts
-    if isIntraday(df1):
-        df1Vwap = VWAP(df1)
-        df1['VWAP'] = df1Vwap['VWAP']
-
-    df1Ema = EMA(df1, period=5)
-    df1Bb = BollingerBands(df1, period=10)
-    df1Adx = ADXDMI(df1)
-    df1Rsi = RSI(df1)
-    df1Atr = AverageTrueRange(df1)
-    
-    df1['EMA'] = df1Ema['EMA 5']
-    df1['SMA'] = df1Bb['SMA 10']
-    df1['BB_PC'] = df1Bb['bb_pc']
-    df1['BB_UPPER1'] = df1Bb['bb_upper1']
-    df1['BB_UPPER2'] = df1Bb['bb_upper2']
-    df1['BB_LOWER1'] = df1Bb['bb_lower1']
-    df1['BB_LOWER2'] = df1Bb['bb_lower2']
-    df1['ADX'] = df1Adx['ADX']
-    df1['DMIP'] = df1Adx['DMIP']
-    df1['DMIM'] = df1Adx['DMIM']
-    df1['RSI'] = df1Rsi['RSI 14']
-    df1['ATR'] = df1Atr['ATR']
-
-    # Volume SMA
-    volSmaInd = SMAIndicator(df1['volume'], 10, True)
-    df1['VOL_SMA'] = volSmaInd.sma_indicator()
-
-    # Keltner Channel
-    df1['KC_UPPER'] = df1['SMA'] + 2.0 * df1['ATR']
-    df1['KC_LOWER'] = df1['SMA'] - 2.0 * df1['ATR']
-
-    # Parabolic Stop and Reverse
-    psarInd = PSARIndicator(df1['high'], df1['low'], df1['close'], fillna=True)
-    df1['PSAR'] = psarInd.psar()
-
-    df1.dropna(inplace=True)
-    df1.reset_index(inplace=True, drop=True)
-
-    return df1
+    return IndicatorPipeline().compute(df, outputs)
 
 
 def SMA(df:pd.DataFrame, period:int=20) -> pd.DataFrame:
     logging.debug(f'Calculate SMA({period})')
     return pd.DataFrame({
         'time': df['time'],
-        f'SMA {period}': df['close'].rolling(window=period).mean()
+        f'SMA {period}': rollingMean(df['close'].to_numpy(dtype=np.float64), period)
     }).dropna()
 
 
@@ -91,162 +390,89 @@ def EMA(df:pd.DataFrame, period:int=10) -> pd.DataFrame:
     logging.debug(f'Calculate EMA({period})')
     return pd.DataFrame({
         'time': df['time'],
-        f'EMA {period}': df['close'].ewm(span=period, adjust=False).mean()
+        f'EMA {period}': emaKernel(df['close'].to_numpy(dtype=np.float64), span=period)
     }).dropna()
 
 
 def BollingerBands(dfIn:pd.DataFrame, period:int=20, std:list=[2,3], source:str='close') -> pd.DataFrame:
     try:
         logging.debug(f'Calculate BollingerBands({period}, {std})')
-        df = dfIn.copy()
         N = int(period)
-        if len(df) > N:
-            # Calc standard deviation
-            df['std'] = df[source].rolling(N).std(ddof=0).fillna(0)
-            df[f'SMA {period}'] = df[source].rolling(N).mean().fillna(df[source])
-
-            # Calc upper/lower bands for all
-            for idx, stdev in enumerate(std):
-                df[f'bb_upper{idx+1}'] = df[f'SMA {period}'] + stdev * df['std']
-                df[f'bb_lower{idx+1}'] = df[f'SMA {period}'] - stdev * df['std']
-
-            # Calculate symmetric %B
-            df['bb_pc'] = (df[source].astype(float) - df[f'SMA {period}']) / df['std']
-            df['bb_pc'] = df['bb_pc'].fillna(0)
-
+        if len(dfIn) > N:
+            bb = bollingerKernel(dfIn[source].to_numpy(dtype=np.float64), N, std)
             # Build return object
             retDf = pd.DataFrame({
-                'time': df['time'],
-                f'SMA {period}': df[f'SMA {period}'],
-                'bb_pc': df['bb_pc'],
+                'time': dfIn['time'],
+                f'SMA {period}': bb[f'SMA {N}'],
+                'bb_pc': bb['bb_pc'],
             })
             for idx, stdev in enumerate(std):
-                retDf[f'bb_upper{idx+1}'] = df[f'bb_upper{idx+1}']
-                retDf[f'bb_lower{idx+1}'] = df[f'bb_lower{idx+1}']
+                retDf[f'bb_upper{idx+1}'] = bb[f'bb_upper{idx+1}']
+                retDf[f'bb_lower{idx+1}'] = bb[f'bb_lower{idx+1}']
             return retDf
-        else:
-            pd.DataFrame({'time': df['time']})
     except:
         logging.exception('Error while calculating indicator "BollingerBands"')
-    return pd.DataFrame({'time': df['time']})
+    return pd.DataFrame({'time': dfIn['time']})
 
 
 def RSI(dfIn:pd.DataFrame, period:int=14, source:str='close') -> pd.DataFrame:
     try:
-        df = dfIn.copy()
-        N = int(period)
-        if len(df) > N:
-            df['change'] = df[source].diff()
-            df['gain'] = df.change.mask(df.change < 0, 0.0)
-            df['loss'] = -df.change.mask(df.change > 0, -0.0)
-
-            def rma(x, n):
-                a = np.full_like(x, np.nan)
-                a[n] = x[1:n+1].mean()
-                for i in range(n+1, len(x)):
-                    a[i] = (a[i-1] * (n - 1) + x[i]) / n
-                return a
-
-            df['avg_gain'] = rma(df.gain.to_numpy(), N)
-            df['avg_loss'] = rma(df.loss.to_numpy(), N)
-
-            df['rs'] = df.avg_gain / df.avg_loss
-            df[f'RSI {period}'] = 100 - (100 / (1 + df.rs))
-            #df[f'RSI {period}'] = df[f'RSI {period}'].shift(period-1)
-        else:
-            df[f'RSI {period}'] = 50
         return pd.DataFrame({
-            'time': df['time'],
-            f'RSI {period}': df[f'RSI {period}'],
-        }).fillna(50)
-
+            'time': dfIn['time'],
+            f'RSI {period}': rsiKernel(dfIn[source].to_numpy(dtype=np.float64), period),
+        })
     except:
         logging.exception('Error while calculating indicator "RSI"')
-    return pd.DataFrame({'time': df['time']})
+    return pd.DataFrame({'time': dfIn['time']})
 
 
 def ADXDMI(dfIn:pd.DataFrame, period:int=14) -> pd.DataFrame:
     try:
-        df = dfIn.copy()
-        alpha = float(1/period)
-        # True Range
-        df['H-L'] = df['high'] - df['low']
-        df['H-C'] = np.abs(df['high'] - df['close'].shift(1))
-        df['L-C'] = np.abs(df['low'] - df['close'].shift(1))
-        df['TR'] = df[['H-L', 'H-C', 'L-C']].max(axis=1)
-        del df['H-L'], df['H-C'], df['L-C']
-        # Average True Range
-        df['ATR'] = df['TR'].ewm(alpha=alpha, adjust=False).mean()
-        # +-DX
-        df['H-pH'] = df['high'] - df['high'].shift(1)
-        df['pL-L'] = df['low'].shift(1) - df['low']
-        df['+DX'] = np.where(
-            (df['H-pH'] > df['pL-L']) & (df['H-pH']>0),
-            df['H-pH'],
-            0.0
-        )
-        df['-DX'] = np.where(
-            (df['H-pH'] < df['pL-L']) & (df['pL-L']>0),
-            df['pL-L'],
-            0.0
-        )
-        # +- DMI
-        df['S+DM'] = df['+DX'].ewm(alpha=alpha, adjust=False).mean()
-        df['S-DM'] = df['-DX'].ewm(alpha=alpha, adjust=False).mean()
-        df['DMIP'] = (df['S+DM']/df['ATR'])*100
-        df['DMIM'] = (df['S-DM']/df['ATR'])*100
-        # ADX
-        df['DX'] = (np.abs(df['DMIP'] - df['DMIM'])/(df['DMIP'] + df['DMIM']))*100
-        df['ADX'] = df['DX'].ewm(alpha=alpha, adjust=False).mean()
-
+        high = dfIn['high'].to_numpy(dtype=np.float64)
+        low = dfIn['low'].to_numpy(dtype=np.float64)
+        hl, hpc, lpc = rangeComponents(high, low, dfIn['close'].to_numpy(dtype=np.float64))
+        adx = adxKernel(high, low, hl, hpc, lpc, period)
         return pd.DataFrame({
-            'time': df['time'],
-            'ADX': df['ADX'],
-            'DMIP': df['DMIP'],
-            'DMIM': df['DMIM']
-        }).fillna(100)
+            'time': dfIn['time'],
+            'ADX': adx['ADX'],
+            'DMIP': adx['DMIP'],
+            'DMIM': adx['DMIM']
+        })
     except:
         logging.exception('Error while calculating indicator "ADXDMI"')
-    return pd.DataFrame({'time': df['time']})
+    return pd.DataFrame({'time': dfIn['time']})
 
 
 def VWAP(df: pd.DataFrame) -> pd.DataFrame:
     """
     Add intraday VWAP (resets daily) as a new column 'VWAP'.
     """
-    df = df.copy()
-    df.set_index('time', inplace=True, drop=False)
-
-    typical_price = (df['high'] + df['low'] + df['close']) / 3
-    date = df.index.date
-    cum_vol = df.groupby(date)['volume'].cumsum()
-    cum_vol_tp = (typical_price * df['volume']).groupby(date).cumsum()
-    df['VWAP'] = cum_vol_tp / cum_vol
-    df.reset_index(drop=True, inplace=True)
     return pd.DataFrame({
         'time': df['time'],
-        'VWAP': df['VWAP']
+        'VWAP': vwapKernel(
+            df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+            df['high'].to_numpy(dtype=np.float64),
+            df['low'].to_numpy(dtype=np.float64),
+            df['close'].to_numpy(dtype=np.float64),
+            df['volume'].to_numpy()
+        )
     })
 
 
 def AverageTrueRange(dfIn:pd.DataFrame, period:int=20) -> float:
     try:
-        df = dfIn.copy()
-        # Calculate ranges
-        df['r1'] = df['high']-df['low']
-        df['r2'] = df['high']-df['close'].shift(1)
-        df['r3'] = df['low']-df['close'].shift(1)
-        # Assing maximum of different ranges
-        df['MAXTR'] = df[['r1', 'r2', 'r3']].max(axis=1)
-        # Average over N
-        df['ATR'] = df['MAXTR'].rolling(window=period).mean()
+        hl, hpc, lpc = rangeComponents(
+            dfIn['high'].to_numpy(dtype=np.float64),
+            dfIn['low'].to_numpy(dtype=np.float64),
+            dfIn['close'].to_numpy(dtype=np.float64)
+        )
         return pd.DataFrame({
-                'time': df['time'],
-                f'ATR': df['ATR']
+                'time': dfIn['time'],
+                f'ATR': atrKernel(hl, hpc, lpc, period)
             })
     except:
         logging.exception('Error while calculating indicator "AverageTrueRange"')
-    return pd.DataFrame({'time': df['time']})
+    return pd.DataFrame({'time': dfIn['time']})
 
 
 def getCandleType(open:float, high:float, low:float, close:float) -> int:
@@ -279,3 +505,28 @@ def getCandleType(open:float, high:float, low:float, close:float) -> int:
     except:
         logging.exception('Error while calculating "CandleType"')
     return 0
+
+
+def candleTypeKernel(open:np.ndarray, high:np.ndarray, low:np.ndarray, close:np.ndarray) -> np.ndarray:
+    """Vectorized getCandleType, same boundaries, 0 for missing values.
+
+    Returns:
+        np.ndarray: Candle types, tens = open fifth, ones = close fifth.
+    """
+    step = (high-low)/5
+    with np.errstate(invalid='ignore'):
+        ctype = np.select([
+            open <= low + step,
+            (open <= low + 2*step) & (open > low + step),
+            (open <= low + 3*step) & (open > low + 2*step),
+            (open <= low + 4*step) & (open > low + 3*step),
+            (open <= high) & (open > low + 4*step)
+        ], [10, 20, 30, 40, 50], 0)
+        ctype += np.select([
+            close <= low + step,
+            (close < low + 2*step) & (close > low + step),
+            (close < low + 3*step) & (close >= low + 2*step),
+            (close < low + 4*step) & (close >= low + 3*step),
+            (close <= low + 5*step) & (close >= low + 4*step)
+        ], [1, 2, 3, 4, 5], 0)
+    return ctype
@@ -0,0 +1,228 @@
+import os
+import json
+import math
+import logging
+import threading
+import contextlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import Dict, Optional
+
+
+# Log scale buckets, BUCKETS_PER_DOUBLING per doubling starting at 1 µs, the last bucket takes everything above ~18 min
+BUCKETS_PER_DOUBLING = 4
+BUCKETS = 30 * BUCKETS_PER_DOUBLING
+PERCENTILES = [50, 95, 99]
+
+
+class Histogram():
+    """Durations of one stage, exact count, sum, min and max, percentiles within ~10%."""
+
+    __slots__ = ('buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+
+    def add(self, seconds:float) -> None:
+        us = seconds * 1e6
+        i = int(math.log2(us) * BUCKETS_PER_DOUBLING) if us > 1.0 else 0
+        self.buckets[min(i, BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+
+    def quantile(self, q:float) -> float:
+        """Seconds, the geometric center of the bucket which contains the quantile."""
+        rank = q * self.count
+        n = 0
+        for i, c in enumerate(self.buckets):
+            n += c
+            if n >= rank and c > 0:
+                center = 2 ** ((i + 0.5) / BUCKETS_PER_DOUBLING) / 1e6
+                return min(max(center, self.min), self.max)
+        return self.max
+
+
+    def summary(self) -> dict:
+        """Milliseconds of the stage."""
+        if self.count == 0:
+            return {'count': 0}
+        result = {'count': self.count, 'mean': round(self.total / self.count * 1000, 4)}
+        for p in PERCENTILES:
+            result[f'p{p}'] = round(self.quantile(p / 100) * 1000, 4)
+        result['min'] = round(self.min * 1000, 4)
+        result['max'] = round(self.max * 1000, 4)
+        result['total'] = round(self.total * 1000, 1)
+        return result
+
+
+class Span():
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics:'Metrics', name:str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, perf_counter() - self.start)
+        return False
+
+
+# Returned by span() while disabled, nothing is measured
+NULL_SPAN = contextlib.nullcontext()
+
+
+class Metrics():
+    """In memory latency histograms of the chart pipeline.
+
+    Stages are timed with span() or recorded with record(). While disabled both
+    return immediately, so the instrumentation can stay in the hot paths.
+    Enabled metrics can be dumped on demand, written to a JSON file
+    periodically and served by a local HTTP endpoint.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms:Dict[str, Histogram] = {}	# stage -> durations
+        self.since:datetime = datetime.now()
+        self.path:str = None
+        self.stopEvent = threading.Event()
+        self.server:ThreadingHTTPServer = None
+
+
+    def span(self, name:str):
+        """Context manager which records the duration of the block as stage name."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+
+    def record(self, name:str, seconds:float) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram == None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+
+    def snapshot(self) -> dict:
+        """All stages in milliseconds, sorted by name."""
+        with self.lock:
+            stages = {name: self.histograms[name].summary() for name in sorted(self.histograms.keys())}
+        return {
+            'since': self.since.isoformat(timespec='seconds'),
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'stages': stages
+        }
+
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms = {}
+            self.since = datetime.now()
+
+
+    def dump(self, path:str=None) -> Optional[str]:
+        """Write the snapshot as JSON, the file is replaced at once.
+
+        Args:
+            path (str, optional): File to write. Defaults to the path given to start().
+
+        Returns:
+            Optional[str]: Written file, None without a path.
+        """
+        path = self.path if path == None else path
+        if path == None:
+            return None
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+
+    def start(self, path:str=None, interval:float=None, port:int=None) -> None:
+        """Enable the metrics.
+
+        Args:
+            path (str, optional): JSON file for dump(). Defaults to None.
+            interval (float, optional): Seconds between periodic dumps to path, None or 0 for no periodic dumps. Defaults to None.
+            port (int, optional): Port of the HTTP endpoint on localhost, None or 0 for no endpoint. Defaults to None.
+        """
+        self.enabled = True
+        self.path = path
+        self.stopEvent.clear()
+        if path != None and interval != None and interval > 0:
+            threading.Thread(target=self.writer, args=(interval,), daemon=True, name='metrics-writer').start()
+        if port != None and port > 0:
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+            self.server.metrics = self
+            threading.Thread(target=self.server.serve_forever, daemon=True, name='metrics-http').start()
+            self.logger.info(f'start: Metrics on http://127.0.0.1:{port}/metrics')
+
+
+    def stop(self) -> None:
+        """Write the last dump and disable the metrics."""
+        if not self.enabled:
+            return
+        self.stopEvent.set()
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        try:
+            self.dump()
+        except:
+            self.logger.exception('stop: EXCEPTION')
+        self.enabled = False
+
+
+    def writer(self, interval:float) -> None:
+        while not self.stopEvent.wait(interval):
+            try:
+                self.dump()
+            except:
+                self.logger.exception('writer: EXCEPTION')
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics returns the snapshot, GET /metrics/reset clears the histograms afterwards."""
+
+    def do_GET(self):
+        if self.path.rstrip('/') not in ['', '/metrics', '/metrics/reset']:
+            self.send_error(404)
+            return
+        metrics:Metrics = self.server.metrics
+        body = json.dumps(metrics.snapshot(), indent=2).encode()
+        if self.path.rstrip('/') == '/metrics/reset':
+            metrics.reset()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Shared metrics of the application
+METRICS = Metrics()
@@ -0,0 +1,263 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from asyncio.events import Handle
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from metrics import METRICS
+
+
+# EWrapper callbacks which are timed while profiling
+IB_CALLBACKS = ['historicalData', 'historicalDataEnd', 'historicalDataUpdate', 'error', 'contractDetails', 'contractDetailsEnd']
+# Frames of the blocking code shown in the log
+LOG_FRAMES = 6
+
+
+class Profiler():
+    """Opt-in sampling profiler of the asyncio loop and the IB reader thread.
+
+    While running, a background thread samples the stacks of both threads and
+    counts them. Stopping writes one file per session in the folded stack
+    format of flamegraph.pl (also read by speedscope), one line per stack with
+    the thread as root frame.
+
+    Loop callbacks and IB callbacks which take longer than their threshold are
+    logged together with the code the samples found them in, and recorded as
+    metrics (loop.blocked, ib.callback.<name>).
+    """
+
+    def __init__(self, directory:str='profiles', interval:float=0.01, blockThreshold:float=0.1, callbackThreshold:float=0.05):
+        """Create a profiler.
+
+        Args:
+            directory (str, optional): Directory of the profile files. Defaults to 'profiles'.
+            interval (float, optional): Seconds between samples. Defaults to 0.01.
+            blockThreshold (float, optional): Seconds a loop callback may run before it is reported. Defaults to 0.1.
+            callbackThreshold (float, optional): Seconds an IB callback may run before it is reported. Defaults to 0.05.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.directory = directory
+        self.interval = interval
+        self.blockThreshold = blockThreshold
+        self.callbackThreshold = callbackThreshold
+        self.loop:asyncio.AbstractEventLoop = None
+        self.loopThread:int = None	# Thread ident of the loop
+        self.client = None
+        self.running = False
+        self.stopEvent = threading.Event()
+        self.sampler:threading.Thread = None
+        self.counts:Counter = Counter()	# (thread, frames...) -> samples
+        self.recent:Dict[int, deque] = {}	# thread ident -> perf_counter, stack of the latest samples
+        self.labels:Dict[object, str] = {}	# code -> frame label
+        self.started:datetime = None
+        self.originalRun = None
+        self.slow:int = 0
+
+
+    def configure(self, directory:str=None, interval:float=None, blockThreshold:float=None, callbackThreshold:float=None) -> None:
+        """Change the settings, None keeps the current value."""
+        self.directory = self.directory if directory == None else directory
+        self.interval = self.interval if interval == None else interval
+        self.blockThreshold = self.blockThreshold if blockThreshold == None else blockThreshold
+        self.callbackThreshold = self.callbackThreshold if callbackThreshold == None else callbackThreshold
+
+
+    def attach(self, loop:asyncio.AbstractEventLoop, client) -> None:
+        """Profile this loop and the reader thread of the client, must be called on the loop thread."""
+        self.loop = loop
+        self.loopThread = threading.get_ident()
+        self.client = client
+
+
+    def threads(self) -> List[Tuple[str, int]]:
+        """Name and ident of the sampled threads, the reader thread exists once the client is started."""
+        result = [('asyncio-loop', self.loopThread)]
+        reader = getattr(self.client, 'readerThread', None)
+        if reader != None and reader.ident != None:
+            result.append((reader.name, reader.ident))
+        return result
+
+
+    def start(self) -> bool:
+        """Start a profiling session, False if not attached or already running."""
+        if self.running or self.loop == None:
+            return False
+        self.running = True
+        self.started = datetime.now()
+        self.counts = Counter()
+        self.recent = {}
+        self.slow = 0
+        self.stopEvent.clear()
+        self.watchLoop()
+        self.watchCallbacks()
+        self.sampler = threading.Thread(target=self.run, daemon=True, name='profiler')
+        self.sampler.start()
+        self.logger.info(f'start: Profiling every {self.interval*1000:.0f}ms, report loop callbacks > {self.blockThreshold*1000:.0f}ms and IB callbacks > {self.callbackThreshold*1000:.0f}ms')
+        return True
+
+
+    def stop(self) -> Optional[str]:
+        """End the session and write its profile.
+
+        Returns:
+            Optional[str]: Path of the folded stacks file, None if not running.
+        """
+        if not self.running:
+            return None
+        self.running = False
+        self.stopEvent.set()
+        self.sampler.join()
+        self.unwatchLoop()
+        self.unwatchCallbacks()
+        path = self.write()
+        self.logger.info(f'stop: {sum(self.counts.values())} samples, {self.slow} slow callbacks, profile {path}')
+        return path
+
+
+    def toggle(self) -> Optional[str]:
+        """Start a session or stop the running one.
+
+        Returns:
+            Optional[str]: Path of the profile if a session was stopped.
+        """
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+
+    def run(self) -> None:
+        while not self.stopEvent.wait(self.interval):
+            try:
+                self.sample()
+            except:
+                self.logger.exception('run: EXCEPTION')
+
+
+    def sample(self) -> None:
+        frames = sys._current_frames()
+        now = time.perf_counter()
+        for name, ident in self.threads():
+            frame = frames.get(ident)
+            if frame == None:
+                continue
+            stack = self.stack(frame)
+            self.counts[(name,) + stack] += 1
+            self.recent.setdefault(ident, deque(maxlen=1000)).append((now, stack))
+
+
+    def stack(self, frame) -> Tuple[str, ...]:
+        """Frame labels from the thread entry to the sampled frame."""
+        labels = []
+        while frame != None:
+            code = frame.f_code
+            label = self.labels.get(code)
+            if label == None:
+                # Semicolons separate the frames of the folded format
+                label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+                self.labels[code] = label
+            labels.append(label)
+            frame = frame.f_back
+        return tuple(reversed(labels))
+
+
+    def sampledDuring(self, ident:int, start:float, end:float) -> Optional[Tuple[str, ...]]:
+        """Most frequent stack of a thread sampled between start and end."""
+        stacks = Counter(stack for t, stack in list(self.recent.get(ident, [])) if start <= t <= end)
+        if len(stacks) == 0:
+            return None
+        return stacks.most_common(1)[0][0]
+
+
+    def reportSlow(self, kind:str, name:str, start:float, end:float) -> None:
+        """Log a slow callback, called by the thread which ran it."""
+        self.slow += 1
+        stack = self.sampledDuring(threading.get_ident(), start, end)
+        where = '' if stack == None else ' in ' + ' <- '.join(reversed(stack[-LOG_FRAMES:]))
+        self.logger.warning(f'Slow {kind} callback {name} took {(end-start)*1000:.0f}ms{where}')
+
+
+    def watchLoop(self) -> None:
+        """Time every callback of the loop, the Handle class is patched while profiling."""
+        profiler = self
+        originalRun = self.originalRun = Handle._run
+        def run(handle:Handle):
+            if handle._loop is not profiler.loop:
+                return originalRun(handle)
+            start = time.perf_counter()
+            try:
+                return originalRun(handle)
+            finally:
+                end = time.perf_counter()
+                if end - start > profiler.blockThreshold:
+                    METRICS.record('loop.blocked', end - start)
+                    profiler.reportSlow('loop', profiler.describe(handle), start, end)
+        Handle._run = run
+
+
+    def unwatchLoop(self) -> None:
+        if self.originalRun != None:
+            Handle._run = self.originalRun
+            self.originalRun = None
+
+
+    @staticmethod
+    def describe(handle:Handle) -> str:
+        """Coroutine of a task step, otherwise the callback."""
+        callback = getattr(handle, '_callback', None)
+        task = getattr(callback, '__self__', None)
+        if isinstance(task, asyncio.Task):
+            return f'{task.get_name()} {task.get_coro().__qualname__}'
+        return getattr(callback, '__qualname__', repr(callback))
+
+
+    def watchCallbacks(self) -> None:
+        """Replace the EWrapper callbacks of the client with timed ones."""
+        if self.client == None:
+            return
+        for name in IB_CALLBACKS:
+            original = getattr(self.client, name, None)
+            if original == None:
+                continue
+            setattr(self.client, name, self.timedCallback(name, original))
+
+
+    def timedCallback(self, name:str, original):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                METRICS.record(f'ib.callback.{name}', end - start)
+                if end - start > self.callbackThreshold:
+                    self.reportSlow('IB', name, start, end)
+        return timed
+
+
+    def unwatchCallbacks(self) -> None:
+        if self.client == None:
+            return
+        for name in IB_CALLBACKS:
+            # Instance attributes hide the methods of the class
+            self.client.__dict__.pop(name, None)
+
+
+    def write(self) -> str:
+        """Folded stacks of the session, e.g. profiles/profile-20250616-093000.folded"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.started.strftime('profile-%Y%m%d-%H%M%S.folded'))
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f'{";".join(stack)} {count}\n')
+        return path
+
+
+# Shared profiler of the application
+PROFILER = Profiler()
@@ -0,0 +1,278 @@
+import os
+import time
+import zlib
+import queue
+import asyncio
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Tuple
+
+import numpy as np
+from ibapi.common import BarData
+from ibapi.contract import Contract
+
+from bar_store import BAR_COLUMNS, EPOCH, BarStore
+from ib_client import IBClient
+from resampler import BASE_TIMEFRAME, RESAMPLED_TIMEFRAMES, resampleBars, exchangeOffset
+from trading_calendar import NYSE, EXCHANGE_TZ
+
+
+PACING_VIOLATION = 'Historical Market Data Service error message:API historical data query cancelled: pacing violation'
+QUERY_CANCELLED = 'Historical Market Data Service error message:API historical data query cancelled: {}'
+
+
+def toUtcSeconds(wall:np.ndarray) -> np.ndarray:
+    """Local wall clock seconds to epoch seconds like IB sends them with formatDate=2."""
+    days, inverse = np.unique(wall // 86400, return_inverse=True)
+    local = np.array([int((EPOCH + timedelta(days=int(d), hours=12)).astimezone().utcoffset().total_seconds()) for d in days], dtype=np.int64)
+    return wall - local[inverse]
+
+
+class SyntheticSource():
+    """Deterministic random walk bars during the regular NYSE sessions.
+
+    Every session is generated from its own seed (symbol and day), so any
+    request returns the same bars for the same time, no matter which range
+    was requested before.
+    """
+
+    def __init__(self, seed:int=0, price:float=100.0, volatility:float=0.001):
+        self.seed = seed
+        self.price = price
+        self.volatility = volatility
+
+
+    def sessionBars(self, symbol:str, day:date) -> Dict[str, np.ndarray]:
+        """1 min bars of a session, **time** as local wall clock seconds."""
+        symbolSeed = zlib.crc32(symbol.encode())
+        rng = np.random.default_rng([self.seed, symbolSeed, day.toordinal()])
+        minutes = int((NYSE.sessionClose(day) - datetime.combine(day, datetime.min.time(), tzinfo=EXCHANGE_TZ)).total_seconds() // 60) - 9*60 - 30
+        # Slow deterministic trend, so consecutive sessions connect roughly
+        level = self.price * np.exp(0.3*np.sin(day.toordinal()/90 + symbolSeed % 100) + 0.1*np.sin(day.toordinal()/11))
+        close = level * np.exp(np.cumsum(rng.normal(0, self.volatility, minutes)))
+        open = np.r_[level, close[:-1]]
+        spread = np.abs(rng.normal(0, self.volatility/2, minutes)) * close
+        dayStart = (day.toordinal() - EPOCH.toordinal()) * 86400
+        exchange = dayStart + 9*3600 + 30*60 + 60*np.arange(minutes, dtype=np.int64)
+        return {
+            'time': exchange - exchangeOffset(day.toordinal() - EPOCH.toordinal()),
+            'open': open,
+            'high': np.maximum(open, close) + spread,
+            'low': np.minimum(open, close) - spread,
+            'close': close,
+            'volume': rng.integers(100, 10000, minutes).astype(np.int64)
+        }
+
+
+    def bars(self, symbol:str, barSize:str, start:int, end:int) -> Dict[str, np.ndarray]:
+        """Bars with a start time in [start, end], **time** as local wall clock seconds."""
+        first = (EPOCH + timedelta(seconds=int(start))).date()
+        last = (EPOCH + timedelta(seconds=int(end))).date()
+        sessions = [self.sessionBars(symbol, d) for d in NYSE.sessionsBetween(first, last)]
+        if len(sessions) == 0:
+            return {c: np.empty(0, dtype=np.int64 if c in ['time', 'volume'] else np.float64) for c in BAR_COLUMNS}
+        if barSize == '1 day':
+            return {
+                # Daily bars are sent as date, parseBarTime places them at 15:30
+                'time': np.array([s['time'][0] - s['time'][0] % 86400 for s in sessions], dtype=np.int64),
+                'open': np.array([s['open'][0] for s in sessions]),
+                'high': np.array([s['high'].max() for s in sessions]),
+                'low': np.array([s['low'].min() for s in sessions]),
+                'close': np.array([s['close'][-1] for s in sessions]),
+                'volume': np.array([s['volume'].sum() for s in sessions], dtype=np.int64)
+            }
+        columns = {c: np.concatenate([s[c] for s in sessions]) for c in BAR_COLUMNS}
+        if barSize in RESAMPLED_TIMEFRAMES:
+            columns = resampleBars(columns, barSize)
+        keep = (columns['time'] >= start) & (columns['time'] <= end)
+        return {c: columns[c][keep] for c in BAR_COLUMNS}
+
+
+class StoreSource():
+    """Bars recorded by the application in a bar store directory."""
+
+    def __init__(self, path:str):
+        self.store = BarStore(path)
+
+
+    def bars(self, symbol:str, barSize:str, start:int, end:int) -> Dict[str, np.ndarray]:
+        columns = self.store.load((symbol, barSize))
+        if barSize == '1 day':
+            # Stored at 15:30, requests compare with the whole day
+            start -= start % 86400
+        begin = np.searchsorted(columns['time'], start, side='left')
+        stop = np.searchsorted(columns['time'], end, side='right')
+        return {c: columns[c][begin:stop] for c in BAR_COLUMNS}
+
+
+class ReplayClient(IBClient):
+    """IBClient which replays bars from a local source instead of TWS.
+
+    Only the connection to TWS is replaced. Requests pass the same scheduler,
+    bar store and resampling, the bars arrive through historicalData and
+    historicalDataEnd from a background thread like the EReader thread of the
+    IB API delivers them. Latency, streaming speed, live updates and pacing
+    violations can be configured, random decisions use a fixed seed.
+    """
+
+    def __init__(self, dataQueue:asyncio.Queue, loop:asyncio.AbstractEventLoop, source=None, storePath:str=None, candleCacheMB:int=512,
+                 latency:float=0.0, jitter:float=0.0, barsPerSecond:float=None, updateInterval:float=None, updatesPerBar:int=4,
+                 pacingErrorRate:float=0.0, pacing:bool=True, seed:int=0):
+        """Create a replay client.
+
+        Args:
+            dataQueue (asyncio.Queue): Queue of the window.
+            loop (asyncio.AbstractEventLoop): Event loop of the window.
+            source (optional): Object with bars(symbol, barSize, start, end), e.g. SyntheticSource or StoreSource. Defaults to SyntheticSource().
+            storePath (str, optional): Bar store of the client. Defaults to a new temporary directory, every run starts empty.
+            candleCacheMB (int, optional): Memory budget like IBClient. Defaults to 512.
+            latency (float, optional): Seconds until the first bar of a request. Defaults to 0.0.
+            jitter (float, optional): Random additional latency in seconds. Defaults to 0.0.
+            barsPerSecond (float, optional): Streaming speed of historicalData, None for as fast as possible. Defaults to None.
+            updateInterval (float, optional): Seconds between historicalDataUpdate ticks of live requests (empty endDate), None for no updates. Defaults to None.
+            updatesPerBar (int, optional): Ticks which change the last bar before a new bar starts. Defaults to 4.
+            pacingErrorRate (float, optional): Probability that a request is rejected with a pacing violation. Defaults to 0.0.
+            pacing (bool, optional): False disables the IB pacing limits of the scheduler for load tests. Defaults to True.
+            seed (int, optional): Seed of the random decisions. Defaults to 0.
+        """
+        super().__init__(dataQueue, loop, storePath=tempfile.mkdtemp(prefix='replay-') if storePath == None else storePath, candleCacheMB=candleCacheMB)
+        self.source = SyntheticSource(seed) if source == None else source
+        self.latency = latency
+        self.jitter = jitter
+        self.barsPerSecond = barsPerSecond
+        self.updateInterval = updateInterval
+        self.updatesPerBar = updatesPerBar
+        self.pacingErrorRate = pacingErrorRate
+        # Own generator per thread, the decisions of one thread do not depend on the timing of the other
+        feedSeed, tickSeed = np.random.SeedSequence(seed).spawn(2)
+        self.feedRng = np.random.default_rng(feedSeed)
+        self.tickRng = np.random.default_rng(tickSeed)
+        if not pacing:
+            self.scheduler.maxRequests = 1000000
+            self.scheduler.minRepeat = 0.0
+            self.scheduler.maxPerContract = 1000000
+            self.scheduler.viewReserve = 0
+
+        self.jobs:queue.Queue = queue.Queue()	# (callback, args) in the order of TWS
+        self.cancelled:set = set()	# reqIds cancelled by the client
+        self.live:Dict[int, Tuple[str, Dict[str, np.ndarray]]] = {}	# reqId -> barSize, last bar
+        self.running = False
+        self.connected = False
+
+
+    def start(self) -> None:
+        self.running = True
+        self.connected = True
+        # Delivers the callbacks like the EReader thread
+        self.readerThread = threading.Thread(target=self.feed, daemon=True, name='replay-feed')
+        self.readerThread.start()
+        if self.updateInterval != None:
+            threading.Thread(target=self.tick, daemon=True, name='replay-tick').start()
+        self.scheduler.start()
+
+
+    def close(self):
+        self.running = False
+        self.connected = False
+        self.jobs.put(None)
+        self.scheduler.stop()
+
+
+    def isConnected(self):
+        return self.connected
+
+
+    def reqContractDetails(self, reqId:int, contract:Contract):
+        pass
+
+
+    def reqHistoricalData(self, reqId:int, contract:Contract, endDateTime:str, durationStr:str, barSizeSetting:str,
+                          whatToShow:str, useRTH:int, formatDate:int, keepUpToDate:bool, chartOptions:list):
+        self.jobs.put((self.answer, (reqId, contract.symbol, endDateTime, durationStr, barSizeSetting, keepUpToDate)))
+
+
+    def cancelHistoricalData(self, reqId:int):
+        self.cancelled.add(reqId)
+        self.live.pop(reqId, None)
+        # TWS confirms the cancel with error 162 on the reader thread
+        self.jobs.put((self.error, (reqId, 162, QUERY_CANCELLED.format(reqId))))
+
+
+    @staticmethod
+    def barData(columns:Dict[str, np.ndarray], utc:np.ndarray, i:int, daily:bool) -> BarData:
+        bar = BarData()
+        bar.date = (EPOCH + timedelta(seconds=int(columns['time'][i]))).strftime('%Y%m%d') if daily else str(int(utc[i]))
+        bar.open = float(columns['open'][i])
+        bar.high = float(columns['high'][i])
+        bar.low = float(columns['low'][i])
+        bar.close = float(columns['close'][i])
+        bar.volume = int(columns['volume'][i])
+        return bar
+
+
+    def feed(self) -> None:
+        """Answer the requests one after another like the TWS connection."""
+        while self.running:
+            job = self.jobs.get()
+            if job == None:
+                return
+            func, args = job
+            try:
+                func(*args)
+            except:
+                self.logger.exception('feed: EXCEPTION')
+
+
+    def answer(self, reqId:int, symbol:str, endDate:str, duration:str, barSize:str, keepUpToDate:bool) -> None:
+        time.sleep(self.latency + (self.feedRng.uniform(0, self.jitter) if self.jitter > 0 else 0.0))
+        if reqId in self.cancelled:
+            return
+        if self.feedRng.random() < self.pacingErrorRate:
+            self.error(reqId, 162, PACING_VIOLATION)
+            return
+        start, end = self.barStore.requestRange(endDate, duration)
+        columns = self.source.bars(symbol, barSize, start, end)
+        daily = barSize == '1 day'
+        utc = toUtcSeconds(columns['time'])
+        for i in range(len(columns['time'])):
+            if reqId in self.cancelled or not self.running:
+                return
+            self.historicalData(reqId, self.barData(columns, utc, i, daily))
+            if self.barsPerSecond != None:
+                time.sleep(1.0 / self.barsPerSecond)
+        self.historicalDataEnd(reqId, '', '')
+        if (keepUpToDate or endDate == '') and len(columns['time']) > 0 and barSize != '1 day':
+            self.live[reqId] = (barSize, {c: columns[c][-1:].copy() for c in BAR_COLUMNS})
+
+
+    def tick(self) -> None:
+        """Send historicalDataUpdate for all live requests, every updatesPerBar ticks a new bar starts."""
+        n = 0
+        while self.running:
+            time.sleep(self.updateInterval)
+            n += 1
+            for reqId, (barSize, last) in list(self.live.items()):
+                try:
+                    price = last['close'][0] * np.exp(self.tickRng.normal(0, 0.0005))
+                    if n % self.updatesPerBar == 0:
+                        size = 60 if barSize == BASE_TIMEFRAME else RESAMPLED_TIMEFRAMES.get(barSize, 60)
+                        last['time'][0] += size
+                        last['open'][0] = last['high'][0] = last['low'][0] = last['close'][0]
+                        last['volume'][0] = 0
+                    last['close'][0] = price
+                    last['high'][0] = max(last['high'][0], price)
+                    last['low'][0] = min(last['low'][0], price)
+                    last['volume'][0] += int(self.tickRng.integers(1, 100))
+                    self.historicalDataUpdate(reqId, self.barData(last, toUtcSeconds(last['time']), 0, False))
+                except:
+                    self.logger.exception('tick: EXCEPTION')
+
+
+def replaySource(value:str):
+    """Source for the REPLAY_SOURCE setting, 'synthetic' or the path of a bar store."""
+    if value.lower() == 'synthetic':
+        return SyntheticSource()
+    if not os.path.isdir(value):
+        raise ValueError(f'REPLAY_SOURCE "{value}" is neither "synthetic" nor a bar store directory')
+    return StoreSource(value)
@@ -0,0 +1,79 @@
+from datetime import timedelta
+from typing import Dict
+
+import numpy as np
+
+from bar_store import BAR_COLUMNS, EPOCH
+from trading_calendar import EXCHANGE_TZ
+
+
+# Only this timeframe is fetched from TWS, all other intraday timeframes are derived from it
+BASE_TIMEFRAME = '1 min'
+
+# Bar size in seconds of the derived timeframes
+RESAMPLED_TIMEFRAMES = {
+    '2 mins': 120,
+    '3 mins': 180,
+    '5 mins': 300,
+    '10 mins': 600,
+    '15 mins': 900,
+    '20 mins': 1200,
+    '30 mins': 1800,
+    '1 hour': 3600,
+    '2 hours': 7200,
+    '3 hours': 10800,
+    '4 hours': 14400
+}
+
+# Regular session open in exchange time, seconds after midnight
+SESSION_OPEN = 9*3600 + 30*60
+
+
+def baseTimeframe(timeframe:str) -> str:
+    """Timeframe which has to be fetched to show the given timeframe."""
+    return BASE_TIMEFRAME if timeframe in RESAMPLED_TIMEFRAMES else timeframe
+
+
+def exchangeOffset(day:int) -> int:
+    """Seconds to add to local wall clock seconds of a day to get exchange wall clock seconds."""
+    local = (EPOCH + timedelta(days=day, hours=12)).astimezone()
+    return int(local.astimezone(EXCHANGE_TZ).utcoffset().total_seconds() - local.utcoffset().total_seconds())
+
+
+def resampleBars(columns:Dict[str, np.ndarray], timeframe:str) -> Dict[str, np.ndarray]:
+    """Aggregate base bars to a larger timeframe like IB does.
+
+    Buckets follow the clock of the exchange (e.g. 10:00, 11:00 for hours), the
+    first bucket of a session starts with the open, so 1 hour bars start at 9:30,
+    10:00, 11:00 and 20 mins bars at 9:30, 9:40, 10:00. Bucket times are the time
+    of the bucket start.
+
+    Args:
+        columns (Dict[str, np.ndarray]): Base bars sorted by time, **time** as local wall clock seconds.
+        timeframe (str): Target timeframe, one of RESAMPLED_TIMEFRAMES.
+
+    Returns:
+        Dict[str, np.ndarray]: New bar columns.
+    """
+    size = RESAMPLED_TIMEFRAMES[timeframe]
+    times = columns['time']
+    if len(times) == 0:
+        return {c: columns[c].copy() for c in BAR_COLUMNS}
+    # The offset only changes with daylight saving time, calculate it once per day
+    days, inverse = np.unique(times // 86400, return_inverse=True)
+    offsets = np.array([exchangeOffset(int(d)) for d in days], dtype=np.int64)[inverse]
+    exchange = times + offsets
+    grid = exchange - exchange % size
+    sessionOpen = exchange - exchange % 86400 + SESSION_OPEN
+    # Bars outside of regular trading hours keep the plain clock grid
+    buckets = np.where((exchange >= sessionOpen) & (grid < sessionOpen), sessionOpen, grid)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    return {
+        'time': buckets[starts] - offsets[starts],
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+        'volume': np.add.reduceat(columns['volume'], starts)
+    }
@@ -0,0 +1,194 @@
+import uuid
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+
+# Fields every setup has, the indicator features are added as columns on demand
+BASE_FIELDS = {
+    'id': 'TEXT PRIMARY KEY',
+    'ticker': 'TEXT NOT NULL',
+    'strategy': 'TEXT',
+    'timeframe': 'TEXT',
+    'signalType': 'TEXT',
+    'direction': 'TEXT',
+    'time': 'INTEGER'	# epoch milliseconds like setups.json
+}
+
+INDEXES = {
+    # Window.updateMarkers
+    'idx_setups_view': ['ticker', 'strategy', 'timeframe', 'signalType', 'time'],
+    # analysis.py, optionally for all tickers
+    'idx_setups_analysis': ['strategy', 'timeframe', 'direction', 'ticker', 'time']
+}
+
+
+def toMillis(value) -> Optional[int]:
+    if value == None:
+        return None
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return int(pd.Timestamp(value).value // 1000000)
+    return int(value)
+
+
+def setupId(record:dict) -> str:
+    """Id of a setup saved without one, the same setup always gets the same id, so imports can be repeated."""
+    key = '|'.join(str(record.get(k)) for k in ['ticker', 'strategy', 'timeframe', 'signalType', 'direction'])
+    return uuid.uuid5(uuid.NAMESPACE_OID, f'{key}|{toMillis(record.get("time"))}').hex
+
+
+class SetupDatabase():
+    """SQLite database of all tagged setups.
+
+    Base fields are fixed columns, feature columns are added the first time a
+    setup contains them. Composite indexes cover the filters of the chart
+    window and the analysis app, so both only read the matching setups.
+    """
+
+    def __init__(self, path:str='setups.db'):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.path = path
+        self.lock = threading.RLock()
+        # The chart window and the compaction thread share the connection
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            fields = ', '.join(f'"{name}" {decl}' for name, decl in BASE_FIELDS.items())
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS setups ({fields})')
+            for name, columns in INDEXES.items():
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON setups ({", ".join(columns)})')
+        self.columns:List[str] = self.tableColumns()
+
+
+    def tableColumns(self) -> List[str]:
+        return [row[1] for row in self.conn.execute('PRAGMA table_info(setups)')]
+
+
+    @staticmethod
+    def columnType(value) -> str:
+        if isinstance(value, bool):
+            return 'INTEGER'
+        if isinstance(value, int):
+            return 'INTEGER'
+        if isinstance(value, float):
+            return 'REAL'
+        return 'TEXT'
+
+
+    def addColumns(self, records:List[dict]) -> None:
+        """Add feature columns which are not part of the table yet, typed by the first value which is not None."""
+        missing:Dict[str, Optional[str]] = {}	# column -> type, None if all values are None
+        for record in records:
+            for k, v in record.items():
+                if k not in self.columns and missing.get(k) == None:
+                    missing[k] = None if v == None else self.columnType(v)
+        for k, decl in missing.items():
+            # REAL keeps numbers as numbers and text as text if later values are not None
+            self.conn.execute(f'ALTER TABLE setups ADD COLUMN "{k}" {"REAL" if decl == None else decl}')
+            self.columns.append(k)
+
+
+    def insert(self, record:dict) -> None:
+        self.insertMany([record])
+
+
+    def insertMany(self, records:List[dict]) -> int:
+        """Insert setups in a single transaction, setups with a known id are skipped.
+
+        Setups without id get an id derived from their base fields, so importing
+        the same setups again does not duplicate them.
+
+        Args:
+            records (List[dict]): Setups with JSON compatible values, **time** as epoch milliseconds.
+
+        Returns:
+            int: Number of inserted setups.
+        """
+        if len(records) == 0:
+            return 0
+        with self.lock, self.conn:
+            self.addColumns(records)
+            inserted = 0
+            # Group by key set, all setups of one version of addSetup share the same columns
+            groups:Dict[tuple, List[dict]] = {}
+            for record in records:
+                if record.get('id') == None:
+                    record = {**record, 'id': setupId(record)}
+                groups.setdefault(tuple(record.keys()), []).append(record)
+            for keys, group in groups.items():
+                names = ', '.join(f'"{k}"' for k in keys)
+                values = ', '.join('?' for _ in keys)
+                cursor = self.conn.executemany(
+                    f'INSERT OR IGNORE INTO setups ({names}) VALUES ({values})',
+                    [tuple(r[k] for k in keys) for r in group]
+                )
+                inserted += cursor.rowcount
+            return inserted
+
+
+    def insertFrame(self, df:pd.DataFrame) -> int:
+        """Import setups from a DataFrame like setups.json."""
+        df = df.astype(object).where(df.notna(), None)
+        return self.insertMany(df.to_dict('records'))
+
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM setups').fetchone()[0]
+
+
+    def query(self, ticker:str=None, strategy:str=None, timeframe:str=None, signalType:str=None, direction:str=None,
+              start=None, end=None, columns:List[str]=None) -> pd.DataFrame:
+        """Setups matching all given filters, sorted by time.
+
+        Args:
+            ticker (str, optional): Ticker, None for all.
+            strategy (str, optional): Strategy, None for all.
+            timeframe (str, optional): Timeframe, None for all.
+            signalType (str, optional): Signal type, None for all.
+            direction (str, optional): 'long' or 'short', None for all.
+            start (datetime|int, optional): First setup time, datetime or epoch milliseconds.
+            end (datetime|int, optional): Last setup time, datetime or epoch milliseconds.
+            columns (List[str], optional): Columns to read. Defaults to all.
+
+        Returns:
+            pd.DataFrame: Setups with **time** as epoch milliseconds.
+        """
+        where = []
+        params = []
+        for name, value in [('ticker', ticker), ('strategy', strategy), ('timeframe', timeframe), ('signalType', signalType), ('direction', direction)]:
+            if value != None:
+                where.append(f'{name} = ?')
+                params.append(value)
+        if start != None:
+            where.append('time >= ?')
+            params.append(toMillis(start))
+        if end != None:
+            where.append('time <= ?')
+            params.append(toMillis(end))
+        names = '*' if columns == None else ', '.join(f'"{c}"' for c in columns)
+        sql = f'SELECT {names} FROM setups'
+        if len(where) > 0:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY time'
+        with self.lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+
+    def distinct(self, column:str) -> List:
+        """Distinct values of a base field, e.g. all strategies."""
+        if column not in BASE_FIELDS:
+            raise ValueError(f'Unknown setup field "{column}"')
+        with self.lock:
+            return [row[0] for row in self.conn.execute(f'SELECT DISTINCT "{column}" FROM setups WHERE "{column}" IS NOT NULL ORDER BY "{column}"')]
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
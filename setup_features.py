@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from indicators import candleTypeKernel, DEFAULT_OUTPUTS
+
+
+# Everything needed to calculate the setup features
+SETUP_OUTPUTS = DEFAULT_OUTPUTS
+
+
+# Features of the setup bar (t0) and the bar before (t-1) used by the analysis
+T0_COLUMNS = ['GAP_PC','CHANGE_PC','ATR_RISING','BB_PC','KC_INSIDE_BB','BB_PC_RISING','ADX','DMIP','DMIM','ADX_RISING','DMIP_RISING','DMIM_RISING','DMI_DIFFERENCE','RSI','RSI_RISING','VOL_SMA_RISING','VOL_MULTIPLE','PSAR_BULL','EMA_RISING','SMA_RISING','OVER_EMA','OVER_SMA','EMA_OVER_SMA','INSIDE_CANDLE','OUTSIDE_CANDLE','CANDLE_TYPE']
+T1_COLUMNS = ['pCHANGE_PC','pPSAR_BULL','pCANDLE_TYPE','pBB_PC','pKC_INSIDE_BB','pADX','pDMIP','pDMIM','pDMI_DIFFERENCE','pRSI','pVOL_MULTIPLE','pOVER_EMA','pOVER_SMA','pEMA_OVER_SMA']
+
+
+def setupFeatures(df:pd.DataFrame) -> pd.DataFrame:
+    """Setup features of every bar of an indicator frame.
+
+    Row i holds the values of bar i, the values of bar i-1 with prefix **p** and
+    the derived features, so tagging a setup is a row lookup.
+
+    Args:
+        df (pd.DataFrame): Frame from the indicator pipeline with all SETUP_OUTPUTS.
+
+    Returns:
+        pd.DataFrame: Feature matrix with the same index as df.
+    """
+    prev = df.shift(1).add_prefix('p')
+    c = {k: df[k].to_numpy() for k in df.columns}
+    p = {k: prev[k].to_numpy() for k in prev.columns}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features = {
+            # percent change
+            'GAP_PC': (c['open']/p['pclose']-1.0)*100.0,
+            'CHANGE_PC': (c['close']/c['open']-1.0)*100.0,
+            'pCHANGE_PC': (p['pclose']/p['popen']-1.0)*100.0,
+            # Volume SMA rising
+            'VOL_SMA_RISING': c['VOL_SMA'] > p['pVOL_SMA'],
+            # Volume Multiple vol/volSma
+            'VOL_MULTIPLE': c['volume'] / c['VOL_SMA'],
+            'pVOL_MULTIPLE': p['pvolume'] / p['pVOL_SMA'],
+            # SMA, EMA
+            'EMA_RISING': c['EMA'] > p['pEMA'],
+            'SMA_RISING': c['SMA'] > p['pSMA'],
+            'OVER_EMA': c['close'] > c['EMA'],
+            'OVER_SMA': c['close'] > c['SMA'],
+            'pOVER_EMA': p['pclose'] > p['pEMA'],
+            'pOVER_SMA': p['pclose'] > p['pSMA'],
+            'EMA_OVER_SMA': c['EMA'] > c['SMA'],
+            'pEMA_OVER_SMA': p['pEMA'] > p['pSMA'],
+            # BB, KC
+            'BB_PC_RISING': c['BB_PC'] > p['pBB_PC'],
+            'KC_INSIDE_BB': c['BB_UPPER1'] > c['KC_UPPER'],
+            'pKC_INSIDE_BB': p['pBB_UPPER1'] > p['pKC_UPPER'],
+            # ATR rising
+            'ATR_RISING': c['ATR'] > p['pATR'],
+            # ADX, DMIs rising
+            'ADX_RISING': c['ADX'] > p['pADX'],
+            'DMIP_RISING': c['DMIP'] > p['pDMIP'],
+            'DMIM_RISING': c['DMIM'] > p['pDMIM'],
+            'DMI_DIFFERENCE': c['DMIP'] - c['DMIM'],
+            'pDMI_DIFFERENCE': p['pDMIP'] - p['pDMIM'],
+            # RSI Rising
+            'RSI_RISING': c['RSI'] > p['pRSI'],
+            # PSAR Bull
+            'PSAR_BULL': c['PSAR'] < c['low'],
+            'pPSAR_BULL': p['pPSAR'] < p['plow'],
+            # Candle Type
+            'CANDLE_TYPE': candleTypeKernel(c['open'], c['high'], c['low'], c['close']),
+            'pCANDLE_TYPE': candleTypeKernel(p['popen'], p['phigh'], p['plow'], p['pclose']),
+            # insideCandle
+            'INSIDE_CANDLE': (c['high'] < p['phigh']) & (c['low'] < p['plow']),
+            'OUTSIDE_CANDLE': (c['high'] > p['phigh']) & (c['low'] > p['plow'])
+        }
+    return pd.concat([df, prev, pd.DataFrame(features, index=df.index)], axis=1)
+
+
+def closestRows(times:np.ndarray, targets:np.ndarray) -> np.ndarray:
+    """Index of the bar closest to every target time, the earlier bar wins ties.
+
+    Args:
+        times (np.ndarray): Sorted bar times (datetime64).
+        targets (np.ndarray): Setup times (datetime64).
+
+    Returns:
+        np.ndarray: Row positions.
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    targets = np.asarray(targets, dtype='datetime64[ns]')
+    n = len(times)
+    pos = np.searchsorted(times, targets)
+    before = np.clip(pos-1, 0, n-1)
+    after = np.clip(pos, 0, n-1)
+    useBefore = (pos == n) | (np.abs(times[before] - targets) <= np.abs(times[after] - targets))
+    return np.where(pos == 0, 0, np.where(useBefore, before, after))
@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from bar_buffer import columnsToFrame
+from bar_store import durationToTimedelta, timedeltaToDuration
+from generic_client import RequestPriority
+from indicators import IndicatorPipeline
+from setup_db import SetupDatabase, setupId
+from setup_features import setupFeatures, closestRows, SETUP_OUTPUTS
+from setup_journal import SetupJournal
+from statics import TF_DURATION_MAP
+from trading_calendar import NYSE
+
+
+IMPORT_COLUMNS = ['ticker', 'time', 'direction', 'strategy', 'timeframe']
+
+# Setups within this many days share one historical data request
+CHUNK_DAYS = {
+    '1 D': 7,
+    '1 W': 30,
+    '1 M': 90,
+    '3 M': 180
+}
+
+
+class SetupImporter():
+    """Headless bulk import of setups, e.g. trades from a broker statement.
+
+    Entries are grouped by symbol and timeframe, the bars are fetched through the
+    client (pacing is handled by its scheduler, stored bars are not requested
+    again), features are calculated in one vectorized pass per group and all
+    setups are inserted in a single transaction.
+    """
+
+    def __init__(self, client, db:SetupDatabase, journal:SetupJournal=None, timeout:float=4*3600):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.client = client
+        self.db = db
+        self.journal = journal
+        self.timeout = timeout
+        self.pipeline = IndicatorPipeline()
+
+
+    @staticmethod
+    def readEntries(path:str) -> pd.DataFrame:
+        """Read a CSV or JSON list of setups.
+
+        Required columns are ticker, time, direction, strategy and timeframe,
+        signalType defaults to 'Signal'. Dates without time are placed at 15:30
+        like the IMPORT search command does.
+
+        Args:
+            path (str): .csv or .json file.
+
+        Returns:
+            pd.DataFrame: Entries sorted by ticker, timeframe and time.
+        """
+        df = pd.read_json(path) if path.lower().endswith('.json') else pd.read_csv(path)
+        missing = [c for c in IMPORT_COLUMNS if c not in df.columns]
+        if len(missing) > 0:
+            raise ValueError(f'Missing columns: {", ".join(missing)}')
+        if 'signalType' not in df.columns:
+            df['signalType'] = 'Signal'
+        df['ticker'] = df['ticker'].str.strip().str.upper()
+        df['timeframe'] = df['timeframe'].str.strip().str.lower()
+        df['direction'] = df['direction'].str.strip().str.lower()
+        df['time'] = pd.to_datetime(df['time'], format='mixed')
+        dateOnly = df['time'] == df['time'].dt.normalize()
+        df.loc[dateOnly, 'time'] = df.loc[dateOnly, 'time'] + pd.Timedelta(hours=15, minutes=30)
+        unknown = set(df['timeframe']) - set(TF_DURATION_MAP.keys())
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown timeframes: {", ".join(unknown)}')
+        return df.sort_values(['ticker', 'timeframe', 'time'], ignore_index=True)
+
+
+    @staticmethod
+    def chunks(entries:pd.DataFrame) -> List[Tuple[str, str, str, str, pd.DataFrame]]:
+        """Split entries into historical data requests.
+
+        Returns:
+            List[Tuple[str, str, str, str, pd.DataFrame]]: symbol, timeframe, endDate, duration and the entries of each request.
+        """
+        result = []
+        for (symbol, timeframe), group in entries.groupby(['ticker', 'timeframe'], sort=False):
+            view = TF_DURATION_MAP[timeframe]
+            # Daily charts cover years, a single request is enough
+            maxDays = CHUNK_DAYS.get(view, None)
+            days = group['time'].dt.normalize()
+            chunkStart = days.iloc[0]
+            starts = []
+            for d in days:
+                if maxDays != None and (d - chunkStart).days >= maxDays:
+                    chunkStart = d
+                starts.append(chunkStart)
+            for _, chunk in group.groupby(np.array(starts), sort=False):
+                first, last = chunk['time'].iloc[0].normalize(), chunk['time'].iloc[-1].normalize()
+                endDate = last.strftime('%Y%m%d 23:59:59 US/Eastern')
+                start = NYSE.firstSession(view, first.date())
+                sessions = 0 if start == None else len(NYSE.sessionsBetween(start, last.date()))
+                if 0 < sessions <= 365:
+                    # Trading days from the view of the first setup to the last setup
+                    duration = f'{sessions} D'
+                else:
+                    duration = timedeltaToDuration(last - first + durationToTimedelta(view) + timedelta(days=1))
+                result.append((symbol, timeframe, endDate, duration, chunk))
+        return result
+
+
+    async def fetch(self, chunks:list) -> None:
+        """Request the bars of all chunks and wait until the client has no open requests."""
+        for symbol, timeframe, endDate, duration, _ in chunks:
+            self.client.requestData(symbol, timeframe, duration, endDate, priority=RequestPriority.BACKFILL)
+        start = time.monotonic()
+        last = None
+        while self.client.scheduler.pending() > 0:
+            pending = self.client.scheduler.pending()
+            if pending != last:
+                self.logger.info(f'fetch: {pending} historical data requests pending')
+                last = pending
+            if time.monotonic() - start > self.timeout:
+                raise TimeoutError(f'{pending} historical data requests still pending')
+            await asyncio.sleep(1.0)
+
+
+    def records(self, chunks:list) -> List[dict]:
+        """Setup records with features of all chunks."""
+        records = []
+        for symbol, timeframe, endDate, duration, chunk in chunks:
+            bars = self.client.readBars((symbol, timeframe), endDate, duration)
+            if len(bars['time']) == 0:
+                self.logger.warning(f'records: No bars for {symbol} {timeframe} until {endDate}, {len(chunk)} setups skipped')
+                continue
+            data = self.pipeline.compute(columnsToFrame(bars), SETUP_OUTPUTS)
+            features = setupFeatures(data)
+            rows = closestRows(features['time'].to_numpy(), chunk['time'].to_numpy())
+            meta = chunk[['ticker', 'strategy', 'timeframe', 'signalType', 'direction']].to_dict('records')
+            for m, row in zip(meta, features.iloc[rows].to_dict('records')):
+                records.append({**m, **row})
+        return records
+
+
+    async def run(self, path:str) -> int:
+        """Import all setups of a file.
+
+        Args:
+            path (str): .csv or .json file.
+
+        Returns:
+            int: Number of inserted setups.
+        """
+        entries = self.readEntries(path)
+        chunks = self.chunks(entries)
+        self.logger.info(f'run: {len(entries)} setups, {entries.groupby(["ticker", "timeframe"]).ngroups} symbol/timeframe groups, {len(chunks)} requests')
+        await self.fetch(chunks)
+        records = self.records(chunks)
+        for record in records:
+            # Same id on every import, so setups imported before are recognized
+            record['id'] = setupId(record)
+        if self.journal != None:
+            setups = self.journal.setups()
+            known = set(setups['id'].dropna()) if 'id' in setups.columns else set()
+            journaled = []
+            for record in records:
+                if record['id'] in known:
+                    continue
+                known.add(record['id'])
+                journaled.append(self.journal.append(record))
+            records = journaled
+        inserted = self.db.insertMany(records)
+        self.logger.info(f'run: {inserted} setups imported')
+        return inserted
+
+
+async def main(path:str):
+    from ib_client import IBClient
+    logger = logging.getLogger('main')
+    client = None
+    journal = SetupJournal('setups.json', 'setups.csv')
+    try:
+        journal.load()
+        client = IBClient(asyncio.Queue(), asyncio.get_running_loop(), port=int(os.environ.get('TWS_PORT')), clientId=4244, storePath=os.environ.get('BAR_STORE_PATH', 'barstore'))
+        client.start()
+        importer = SetupImporter(client, SetupDatabase('setups.db'), journal)
+        await importer.run(path)
+    except:
+        logger.exception('Import EXCEPTION')
+    finally:
+        journal.close()
+        if client != None:
+            client.close()
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    from log_config import CustomLogFormat, FORMAT
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(CustomLogFormat())
+    logging.basicConfig(level=logging.INFO, format=FORMAT, handlers=[handler])
+
+    if len(sys.argv) != 2:
+        print('Usage: python setup_import.py <setups.csv|setups.json>')
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1]))
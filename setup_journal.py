@@ -0,0 +1,220 @@
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import threading
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+def jsonValue(value):
+    """Convert a setup value like pandas.to_json does, timestamps become epoch milliseconds."""
+    if value is pd.NaT:
+        # ptime of the first bar
+        return None
+    if isinstance(value, pd.Timestamp):
+        return int(value.value // 1000000)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class SetupJournal():
+    """Append-only journal for tagged setups.
+
+    Every setup is appended as one JSON line to ``<snapshot>.journal``. A background
+    thread syncs the journal to disk in batches, so a click never waits for the disk.
+    Compaction merges the journal into the consolidated JSON and CSV files which
+    analysis.py reads; records carry an **id**, so a replay after an interrupted
+    compaction does not duplicate setups.
+    """
+
+    def __init__(self, snapshotPath:str='setups.json', csvPath:str='setups.csv', syncInterval:float=1.0, compactEvery:int=500):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel('INFO')
+        self.snapshotPath = snapshotPath
+        self.csvPath = csvPath
+        self.journalPath = f'{snapshotPath}.journal'
+        self.compactingPath = f'{snapshotPath}.journal.compacting'
+        self.syncInterval = syncInterval
+        self.compactEvery = compactEvery
+
+        self.lock = threading.RLock()
+        self.cond = threading.Condition(self.lock)
+        self.compactLock = threading.Lock()
+        self.file = None
+        self.unsynced:int = 0	# Lines written but not synced yet
+        self.journalRecords:int = 0	# Records in the journal since the last compaction
+        self.frame:pd.DataFrame = pd.DataFrame()	# All setups up to the last call of setups()
+        self.pending:List[dict] = []	# Records added after the last call of setups()
+        self.running = False
+        self.syncThread:threading.Thread = None
+
+
+    def load(self) -> pd.DataFrame:
+        """Replay snapshot and journal and open the journal for appending.
+
+        Returns:
+            pd.DataFrame: All setups.
+        """
+        with self.lock:
+            frames = []
+            if os.path.exists(self.snapshotPath):
+                try:
+                    frames.append(pd.read_json(self.snapshotPath))
+                except:
+                    self.logger.exception(f'load: Unable to read {self.snapshotPath}')
+            # A compaction was interrupted, its records may or may not be in the snapshot
+            records = self.readJournal(self.compactingPath)
+            journal = self.readJournal(self.journalPath)
+            self.journalRecords = len(records) + len(journal)
+            records.extend(journal)
+            if len(records) > 0:
+                frames.append(pd.DataFrame.from_records(records))
+            self.frame = self.concat(frames)
+
+            self.file = open(self.journalPath, 'a', encoding='utf-8')
+            self.running = True
+            self.syncThread = threading.Thread(target=self.run, daemon=True)
+            self.syncThread.start()
+            self.logger.info(f'load: {len(self.frame)} setups, {self.journalRecords} from journal')
+            if self.journalRecords > 0:
+                self.journalRecords = 0
+                self.compact()
+            return self.frame
+
+
+    def readJournal(self, path:str) -> List[dict]:
+        records = []
+        if not os.path.exists(path):
+            return records
+        with open(path, 'r', encoding='utf-8') as f:
+            for n, line in enumerate(f):
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Last line can be incomplete after a crash
+                    self.logger.warning(f'readJournal: Skip broken line {n+1} in {path}')
+        return records
+
+
+    @staticmethod
+    def concat(frames:List[pd.DataFrame]) -> pd.DataFrame:
+        frames = [f for f in frames if len(f) > 0]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if 'id' in df.columns:
+            # Setups saved before the journal have no id
+            df = df[df['id'].isna() | ~df['id'].duplicated(keep='first')].reset_index(drop=True)
+        return df
+
+
+    def append(self, setup:dict) -> dict:
+        """Append a setup, it is synced to disk within syncInterval.
+
+        Args:
+            setup (dict): Setup values.
+
+        Returns:
+            dict: Stored record with **id**, a given id is kept.
+        """
+        record = {k: jsonValue(v) for k, v in setup.items()}
+        if record.get('id') == None:
+            record['id'] = uuid.uuid4().hex
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.unsynced += 1
+            self.journalRecords += 1
+            self.pending.append(record)
+            self.cond.notify_all()
+            if self.journalRecords >= self.compactEvery:
+                self.journalRecords = 0
+                self.compact()
+        return record
+
+
+    def setups(self) -> pd.DataFrame:
+        """All setups, new records are added with a single concat."""
+        with self.lock:
+            if len(self.pending) > 0:
+                self.frame = self.concat([self.frame, pd.DataFrame.from_records(self.pending)])
+                self.pending = []
+            return self.frame
+
+
+    def sync(self) -> None:
+        with self.lock:
+            if self.file == None or self.unsynced == 0:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.unsynced > 0 or not self.running)
+                if not self.running:
+                    return
+            # Collect more setups before the next sync
+            time.sleep(self.syncInterval)
+            try:
+                self.sync()
+            except:
+                self.logger.exception('run: EXCEPTION')
+
+
+    def compact(self, wait:bool=False) -> None:
+        """Rotate the journal and merge it into the snapshot files in the background."""
+        thread = threading.Thread(target=self.compactJournal, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+
+    def compactJournal(self) -> None:
+        with self.compactLock:
+            try:
+                with self.lock:
+                    if self.file == None:
+                        return
+                    if not os.path.exists(self.compactingPath):
+                        self.sync()
+                        self.file.close()
+                        os.replace(self.journalPath, self.compactingPath)
+                        self.file = open(self.journalPath, 'a', encoding='utf-8')
+                    df = self.setups()
+
+                # Write temporary files first, a crash must not corrupt the snapshot
+                df.to_json(f'{self.snapshotPath}.tmp')
+                os.replace(f'{self.snapshotPath}.tmp', self.snapshotPath)
+                df.to_csv(f'{self.csvPath}.tmp')
+                os.replace(f'{self.csvPath}.tmp', self.csvPath)
+                os.remove(self.compactingPath)
+                self.logger.debug(f'compactJournal: {len(df)} setups written')
+            except:
+                self.logger.exception('compactJournal: EXCEPTION')
+
+
+    def close(self) -> None:
+        """Sync the journal and write the snapshot files."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.file == None:
+            return
+        self.sync()
+        if os.path.getsize(self.journalPath) > 0 or os.path.exists(self.compactingPath):
+            self.compact(wait=True)
+        with self.lock:
+            self.file.close()
+            self.file = None
@@ -8,4 +8,21 @@ DATE_RANGES = {
 	'2022':['2022-01-01', '2022-12-31'],
 	'2021':['2021-01-01', '2021-12-31'],
 	'2020':['2020-01-01', '2020-12-31']
-}
\ No newline at end of file
+}
+
+# Duration of the view of every timeframe
+TF_DURATION_MAP = {
+	'1 day':'5 Y',
+	'1 min':'1 D',
+	'2 mins':'1 D',
+	'3 mins':'1 D',
+	'5 mins':'1 D',
+	'10 mins':'1 W',
+	'15 mins':'1 W',
+	'20 mins':'1 M',
+	'30 mins':'1 M',
+	'1 hour':'3 M',
+	'2 hours':'3 M',
+	'3 hours':'6 M',
+	'4 hours':'6 M'
+}
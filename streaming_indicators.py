@@ -0,0 +1,394 @@
+import math
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+NAN = float('nan')
+
+
+def divide(a:float, b:float) -> float:
+    """Float division with NumPy semantics (x/0 = +-inf, 0/0 = nan) instead of ZeroDivisionError."""
+    try:
+        return a / b
+    except ZeroDivisionError:
+        if a != a or a == 0:
+            return NAN
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+def ewmStep(state:Tuple[float, float], x:float, alpha:float) -> Tuple[float, float]:
+    """One step of pandas ewm(alpha, adjust=False).mean() including its NaN handling.
+
+    Args:
+        state (Tuple[float, float]): (weighted average, weight of the old value)
+        x (float): New value, may be nan.
+        alpha (float): Smoothing factor.
+
+    Returns:
+        Tuple[float, float]: New state, the first element is the output.
+    """
+    weighted, oldWt = state
+    if weighted == weighted:
+        oldWt *= 1.0 - alpha
+        if x == x:
+            if weighted != x:
+                weighted = (oldWt * weighted + alpha * x) / (oldWt + alpha)
+            oldWt = 1.0
+    elif x == x:
+        weighted = x
+    return (weighted, oldWt)
+
+
+def windowMean(values:Tuple[float, ...]) -> float:
+    # Constant windows give exactly the value like pandas rolling
+    if min(values) == max(values):
+        return values[-1]
+    return sum(values) / len(values)
+
+
+class StreamingIndicator():
+    """Base class for indicators which consume one bar at a time.
+
+    Subclasses implement step() as a pure function of the committed state, so the
+    last bar can be revised any number of times before the next bar is appended.
+    """
+
+    def __init__(self):
+        self.state = self.initialState()
+        self.pending = None	# State including the last bar
+        self.values:Dict[str, float] = {}
+
+
+    def initialState(self):
+        return None
+
+
+    def step(self, state, bar:dict):
+        raise NotImplementedError
+
+
+    def append(self, bar:dict) -> Dict[str, float]:
+        if self.pending != None:
+            self.state = self.pending
+        self.pending, self.values = self.step(self.state, bar)
+        return self.values
+
+
+    def revise(self, bar:dict) -> Dict[str, float]:
+        self.pending, self.values = self.step(self.state, bar)
+        return self.values
+
+
+class StreamingEMA(StreamingIndicator):
+
+    def __init__(self, period:int=5, source:str='close'):
+        self.alpha = 2.0 / (period + 1.0)
+        self.source = source
+        super().__init__()
+
+    def initialState(self):
+        return (NAN, 1.0)
+
+    def step(self, state, bar:dict):
+        state = ewmStep(state, float(bar[self.source]), self.alpha)
+        return state, {'EMA': state[0]}
+
+
+class StreamingSMA(StreamingIndicator):
+    """Rolling mean, minPeriods=0 mirrors ta.SMAIndicator(fillna=True)."""
+
+    def __init__(self, period:int=10, source:str='close', minPeriods:int=None, name:str='SMA'):
+        self.period = period
+        self.source = source
+        self.minPeriods = period if minPeriods == None else max(1, minPeriods)
+        self.name = name
+        super().__init__()
+
+    def initialState(self):
+        return ()
+
+    def step(self, state, bar:dict):
+        window = (state + (float(bar[self.source]),))[-self.period:]
+        value = windowMean(window) if len(window) >= self.minPeriods else NAN
+        return window, {self.name: value}
+
+
+class StreamingBollingerBands(StreamingIndicator):
+    """Mirrors indicators.BollingerBands (population std, SMA filled with the source)."""
+
+    def __init__(self, period:int=10, std:list=[2,3], source:str='close'):
+        self.period = period
+        self.std = std
+        self.source = source
+        super().__init__()
+
+    def initialState(self):
+        return ()
+
+    def step(self, state, bar:dict):
+        x = float(bar[self.source])
+        window = (state + (x,))[-self.period:]
+        if len(window) < self.period:
+            sma, std = x, 0.0
+        elif min(window) == max(window):
+            sma, std = window[-1], 0.0
+        else:
+            sma = sum(window) / self.period
+            std = math.sqrt(sum((v - sma)**2 for v in window) / self.period)
+        values = {'SMA': sma}
+        for idx, stdev in enumerate(self.std):
+            values[f'BB_UPPER{idx+1}'] = sma + stdev * std
+            values[f'BB_LOWER{idx+1}'] = sma - stdev * std
+        pc = divide(x - sma, std)
+        values['BB_PC'] = 0.0 if pc != pc else pc
+        return window, values
+
+
+class StreamingRSI(StreamingIndicator):
+    """Mirrors indicators.RSI, seeded with the mean of the first N changes and Wilder smoothing."""
+
+    def __init__(self, period:int=14, source:str='close'):
+        self.period = period
+        self.source = source
+        super().__init__()
+
+    def initialState(self):
+        # bars, previous source value, seed gains, seed losses, avg gain, avg loss
+        return (0, NAN, (), (), NAN, NAN)
+
+    def step(self, state, bar:dict):
+        n, prev, gains, losses, avgGain, avgLoss = state
+        x = float(bar[self.source])
+        N = self.period
+        if n > 0:
+            change = x - prev
+            gain = 0.0 if change < 0 else change
+            loss = 0.0 if change > 0 else -change
+            if n <= N:
+                gains = gains + (gain,)
+                losses = losses + (loss,)
+                if n == N:
+                    avgGain = float(np.mean(np.array(gains)))
+                    avgLoss = float(np.mean(np.array(losses)))
+            else:
+                avgGain = (avgGain * (N - 1) + gain) / N
+                avgLoss = (avgLoss * (N - 1) + loss) / N
+        rsi = 100 - divide(100, 1 + divide(avgGain, avgLoss))
+        if rsi != rsi:
+            rsi = 50.0
+        return (n + 1, x, gains, losses, avgGain, avgLoss), {'RSI': rsi}
+
+
+class StreamingADXDMI(StreamingIndicator):
+    """Mirrors indicators.ADXDMI (Wilder smoothing through ewm(alpha=1/period))."""
+
+    def __init__(self, period:int=14):
+        self.alpha = 1.0 / period
+        super().__init__()
+
+    def initialState(self):
+        # previous bar, ATR, S+DM, S-DM, ADX
+        return (None, (NAN, 1.0), (NAN, 1.0), (NAN, 1.0), (NAN, 1.0))
+
+    def step(self, state, bar:dict):
+        prev, atr, sdmp, sdmm, adx = state
+        high, low, close = float(bar['high']), float(bar['low']), float(bar['close'])
+        if prev == None:
+            tr = high - low
+            dxp, dxm = 0.0, 0.0
+        else:
+            pHigh, pLow, pClose = prev
+            tr = max(high - low, abs(high - pClose), abs(low - pClose))
+            hph = high - pHigh
+            pll = pLow - low
+            dxp = hph if hph > pll and hph > 0 else 0.0
+            dxm = pll if hph < pll and pll > 0 else 0.0
+        atr = ewmStep(atr, tr, self.alpha)
+        sdmp = ewmStep(sdmp, dxp, self.alpha)
+        sdmm = ewmStep(sdmm, dxm, self.alpha)
+        dmip = divide(sdmp[0], atr[0])*100
+        dmim = divide(sdmm[0], atr[0])*100
+        dx = divide(abs(dmip - dmim), dmip + dmim)*100
+        adx = ewmStep(adx, dx, self.alpha)
+        values = {'ADX': adx[0], 'DMIP': dmip, 'DMIM': dmim}
+        values = {k: 100.0 if v != v else v for k, v in values.items()}
+        return ((high, low, close), atr, sdmp, sdmm, adx), values
+
+
+class StreamingATR(StreamingIndicator):
+    """Mirrors indicators.AverageTrueRange (rolling mean of the signed ranges)."""
+
+    def __init__(self, period:int=20):
+        self.period = period
+        super().__init__()
+
+    def initialState(self):
+        return (NAN, ())
+
+    def step(self, state, bar:dict):
+        pClose, window = state
+        high, low, close = float(bar['high']), float(bar['low']), float(bar['close'])
+        ranges = [high - low]
+        if pClose == pClose:
+            ranges += [high - pClose, low - pClose]
+        window = (window + (max(ranges),))[-self.period:]
+        value = windowMean(window) if len(window) == self.period else NAN
+        return (close, window), {'ATR': value}
+
+
+class StreamingVWAP(StreamingIndicator):
+    """Intraday VWAP with cumulative sums reset every session (date)."""
+
+    def initialState(self):
+        # date, cumulative volume, cumulative typical price * volume
+        return (None, 0, 0.0)
+
+    def step(self, state, bar:dict):
+        date, cumVol, cumVolTp = state
+        barDate = int(bar['time']) // 86400
+        if barDate != date:
+            date, cumVol, cumVolTp = barDate, 0, 0.0
+        tp = (float(bar['high']) + float(bar['low']) + float(bar['close'])) / 3
+        cumVol += bar['volume']
+        cumVolTp += tp * bar['volume']
+        return (date, cumVol, cumVolTp), {'VWAP': divide(cumVolTp, float(cumVol))}
+
+
+class StreamingPSAR(StreamingIndicator):
+    """Mirrors ta.trend.PSARIndicator (SAR, extreme points and acceleration factor state)."""
+
+    def __init__(self, step:float=0.02, maxStep:float=0.2):
+        self.afStep = step
+        self.maxStep = maxStep
+        super().__init__()
+
+    def initialState(self):
+        # bars, psar, up trend, acceleration factor, up trend high, down trend low, previous highs, previous lows
+        return (0, NAN, True, self.afStep, NAN, NAN, (), ())
+
+    def step(self, state, bar:dict):
+        n, psar, upTrend, af, upHigh, downLow, highs, lows = state
+        high, low, close = float(bar['high']), float(bar['low']), float(bar['close'])
+        if n == 0:
+            upHigh, downLow = high, low
+        if n < 2:
+            psar = close
+        else:
+            reversal = False
+            if upTrend:
+                psar = psar + af * (upHigh - psar)
+                if low < psar:
+                    reversal = True
+                    psar = upHigh
+                    downLow = low
+                    af = self.afStep
+                else:
+                    if high > upHigh:
+                        upHigh = high
+                        af = min(af + self.afStep, self.maxStep)
+                    if lows[0] < psar:
+                        psar = lows[0]
+                    elif lows[1] < psar:
+                        psar = lows[1]
+            else:
+                psar = psar - af * (psar - downLow)
+                if high > psar:
+                    reversal = True
+                    psar = downLow
+                    upHigh = high
+                    af = self.afStep
+                else:
+                    if low < downLow:
+                        downLow = low
+                        af = min(af + self.afStep, self.maxStep)
+                    if highs[0] > psar:
+                        psar = highs[0]
+                    elif highs[1] > psar:
+                        psar = highs[1]
+            upTrend = upTrend != reversal
+        highs = (highs + (high,))[-2:]
+        lows = (lows + (low,))[-2:]
+        return (n + 1, psar, upTrend, af, upHigh, downLow, highs, lows), {'PSAR': psar}
+
+
+class StreamingIndicatorFactory():
+    """Incremental counterpart of indicators.indicatorFactory.
+
+    Every bar costs O(1) and produces the same columns as indicatorFactory. Rows
+    which indicatorFactory would drop (any NaN) are reported as incomplete.
+    Bars are dicts with **time** as wall clock seconds.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.indicators:List[StreamingIndicator] = [
+            StreamingVWAP(),
+            StreamingEMA(5),
+            StreamingBollingerBands(10),
+            StreamingADXDMI(14),
+            StreamingRSI(14),
+            StreamingATR(20),
+            StreamingSMA(10, source='volume', minPeriods=0, name='VOL_SMA'),
+            StreamingPSAR()
+        ]
+        self.firstTimes:List[int] = []
+        self.intraday:Optional[bool] = None
+
+
+    def row(self, bar:dict, values:List[Dict[str, float]]) -> dict:
+        row = dict(bar)
+        for v in values:
+            row.update(v)
+        if self.intraday == False:
+            del row['VWAP']
+        # Keltner Channel
+        row['KC_UPPER'] = row['SMA'] + 2.0 * row['ATR']
+        row['KC_LOWER'] = row['SMA'] - 2.0 * row['ATR']
+        return row
+
+
+    def append(self, bar:dict) -> dict:
+        """Add a new bar.
+
+        Args:
+            bar (dict): Bar with time, open, high, low, close and volume.
+
+        Returns:
+            dict: Bar with all indicator values.
+        """
+        if self.intraday == None:
+            self.firstTimes.append(int(bar['time']))
+            if len(self.firstTimes) == 2:
+                self.intraday = abs(self.firstTimes[1] - self.firstTimes[0]) < 86400
+        return self.row(bar, [i.append(bar) for i in self.indicators])
+
+
+    def revise(self, bar:dict) -> dict:
+        """Replace the last bar, e.g. for intra-bar updates.
+
+        Args:
+            bar (dict): Bar with time, open, high, low, close and volume.
+
+        Returns:
+            dict: Bar with all indicator values.
+        """
+        if self.intraday == None and len(self.firstTimes) > 0:
+            self.firstTimes[-1] = int(bar['time'])
+        return self.row(bar, [i.revise(bar) for i in self.indicators])
+
+
+    def warmup(self, columns:Dict[str, np.ndarray]) -> Optional[dict]:
+        """Feed a history of bars, returns the row of the last bar."""
+        row = None
+        names = list(columns.keys())
+        for values in zip(*[columns[c].tolist() for c in names]):
+            row = self.append(dict(zip(names, values)))
+        return row
+
+
+    @staticmethod
+    def isComplete(row:dict) -> bool:
+        """False if indicatorFactory would drop this row (dropna)."""
+        return not any(isinstance(v, float) and v != v for v in row.values())
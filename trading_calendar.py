@@ -0,0 +1,234 @@
+import math
+import threading
+from zoneinfo import ZoneInfo
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional, Set
+
+import numpy as np
+
+
+EXCHANGE_TZ = ZoneInfo('US/Eastern')
+REGULAR_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+
+# Closures which do not follow the holiday rules
+SPECIAL_CLOSURES = {
+    date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14),	# 9/11
+    date(2004, 6, 11),	# Ronald Reagan
+    date(2007, 1, 2),	# Gerald Ford
+    date(2012, 10, 29), date(2012, 10, 30),	# Hurricane Sandy
+    date(2018, 12, 5),	# George H.W. Bush
+    date(2025, 1, 9)	# Jimmy Carter
+}
+
+# Sessions per IB duration unit, IB counts day durations in trading days
+SESSIONS_PER_UNIT = {
+    'D': 1,
+    'W': 5,
+    'M': 21
+}
+
+
+def easterSunday(year:int) -> date:
+    # Anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19*a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2*e + 2*i - h - k) % 7
+    m = (a + 11*h + 22*l) // 451
+    month, day = divmod(h + l - 7*m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def nthWeekday(year:int, month:int, weekday:int, n:int) -> date:
+    """n-th weekday (0 = Monday) of a month, n=-1 for the last one."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7*(n-1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(d:date) -> date:
+    """Saturday holidays are observed on Friday, Sunday holidays on Monday."""
+    if d.weekday() == 5:
+        return d - timedelta(days=1)
+    if d.weekday() == 6:
+        return d + timedelta(days=1)
+    return d
+
+
+def nyseHolidays(year:int) -> Set[date]:
+    """Full day NYSE holidays of a year."""
+    holidays = {
+        nthWeekday(year, 2, 0, 3),	# Washington's Birthday
+        easterSunday(year) - timedelta(days=2),	# Good Friday
+        nthWeekday(year, 5, 0, -1),	# Memorial Day
+        observed(date(year, 7, 4)),	# Independence Day
+        nthWeekday(year, 9, 0, 1),	# Labor Day
+        nthWeekday(year, 11, 3, 4),	# Thanksgiving
+        observed(date(year, 12, 25))	# Christmas
+    }
+    # New Year's Day on a Saturday is not observed on the Friday before
+    newYear = date(year, 1, 1)
+    if newYear.weekday() != 5:
+        holidays.add(observed(newYear))
+    if year >= 1998:
+        holidays.add(nthWeekday(year, 1, 0, 3))	# Martin Luther King Jr. Day
+    if year >= 2022:
+        holidays.add(observed(date(year, 6, 19)))	# Juneteenth
+    holidays.update(d for d in SPECIAL_CLOSURES if d.year == year)
+    return holidays
+
+
+def nyseEarlyCloses(year:int) -> Set[date]:
+    """Sessions which close at 13:00."""
+    closes = {nthWeekday(year, 11, 3, 4) + timedelta(days=1)}	# Day after Thanksgiving
+    # Only if the holiday is on a weekday after it
+    for d in [date(year, 7, 3), date(year, 12, 24)]:
+        if d.weekday() <= 3:
+            closes.add(d)
+    return closes
+
+
+class TradingCalendar():
+    """Offline table of the NYSE sessions including half days.
+
+    Sessions are generated from the holiday rules for a range of years once and
+    kept as a sorted array, stepping to the previous or next session is a binary
+    search. The range grows on demand for dates outside of it.
+    """
+
+    def __init__(self, firstYear:int=1990, lastYear:int=None):
+        self.lock = threading.Lock()
+        self.firstYear = firstYear
+        self.lastYear = date.today().year + 2 if lastYear == None else lastYear
+        self.sessions:np.ndarray = None	# datetime64[D], sorted
+        self.earlyCloses:Set[date] = set()
+        self.build()
+
+
+    def build(self) -> None:
+        days = np.arange(np.datetime64(f'{self.firstYear}-01-01'), np.datetime64(f'{self.lastYear+1}-01-01'), dtype='datetime64[D]')
+        # 1970-01-01 was a Thursday
+        weekdays = (days.astype(np.int64) + 3) % 7
+        holidays = set()
+        earlyCloses = set()
+        for year in range(self.firstYear, self.lastYear+1):
+            holidays.update(nyseHolidays(year))
+            earlyCloses.update(nyseEarlyCloses(year))
+        closed = np.isin(days, np.array(sorted(holidays), dtype='datetime64[D]'))
+        self.sessions = days[(weekdays < 5) & ~closed]
+        self.earlyCloses = earlyCloses - holidays
+
+
+    def ensure(self, d:date) -> None:
+        """Extend the table if d is outside of it."""
+        if self.firstYear < d.year < self.lastYear:
+            return
+        with self.lock:
+            if d.year <= self.firstYear or d.year >= self.lastYear:
+                self.firstYear = min(self.firstYear, d.year - 1)
+                self.lastYear = max(self.lastYear, d.year + 1)
+                self.build()
+
+
+    def isSession(self, d:date) -> bool:
+        self.ensure(d)
+        i = np.searchsorted(self.sessions, np.datetime64(d, 'D'))
+        return i < len(self.sessions) and self.sessions[i] == np.datetime64(d, 'D')
+
+
+    def isEarlyClose(self, d:date) -> bool:
+        return d in self.earlyCloses and self.isSession(d)
+
+
+    def sessionClose(self, d:date) -> datetime:
+        """Regular close of a session in exchange time."""
+        return datetime.combine(d, EARLY_CLOSE if self.isEarlyClose(d) else REGULAR_CLOSE, tzinfo=EXCHANGE_TZ)
+
+
+    def isClosed(self, d:date, now:datetime=None) -> bool:
+        """True if the session of d is over, its regular trading hours bars are final."""
+        now = datetime.now(EXCHANGE_TZ) if now == None else now
+        if not self.isSession(d):
+            return d < now.astimezone(EXCHANGE_TZ).date()
+        return now >= self.sessionClose(d)
+
+
+    def previousSession(self, d:date, n:int=1) -> date:
+        """n-th session before d."""
+        self.ensure(d)
+        i = np.searchsorted(self.sessions, np.datetime64(d, 'D'), side='left') - n
+        if i < 0:
+            self.ensure(date(d.year - math.ceil(n / 250) - 1, 1, 1))
+            return self.previousSession(d, n)
+        return self.sessions[i].astype(date)
+
+
+    def nextSession(self, d:date, n:int=1) -> date:
+        """n-th session after d."""
+        self.ensure(d)
+        i = np.searchsorted(self.sessions, np.datetime64(d, 'D'), side='right') + n - 1
+        if i >= len(self.sessions):
+            self.ensure(date(d.year + math.ceil(n / 250) + 1, 1, 1))
+            return self.nextSession(d, n)
+        return self.sessions[i].astype(date)
+
+
+    def sessionOnOrBefore(self, d:date) -> date:
+        """d if it is a session, otherwise the session before."""
+        return d if self.isSession(d) else self.previousSession(d)
+
+
+    def sessionsBetween(self, start:date, end:date) -> List[date]:
+        """All sessions from start to end, both included."""
+        self.ensure(start)
+        self.ensure(end)
+        i = np.searchsorted(self.sessions, np.datetime64(start, 'D'), side='left')
+        j = np.searchsorted(self.sessions, np.datetime64(end, 'D'), side='right')
+        return [d.astype(date) for d in self.sessions[i:j]]
+
+
+    @staticmethod
+    def sessionCount(duration:str) -> Optional[int]:
+        """Number of sessions of an IB duration, None for year durations."""
+        n, unit = duration.strip().split(' ')
+        sessions = SESSIONS_PER_UNIT.get(unit.upper())
+        return None if sessions == None else int(n) * sessions
+
+
+    def viewDuration(self, duration:str) -> str:
+        """IB duration with the same number of sessions for every view.
+
+        Week and month durations are converted to trading days (1 W = '5 D'), so
+        holidays do not shorten a view and weekends are not requested. Year
+        durations are returned unchanged.
+
+        Args:
+            duration (str): View duration, e.g. '1 W'.
+
+        Returns:
+            str: Duration in trading days, e.g. '5 D'.
+        """
+        sessions = self.sessionCount(duration)
+        if sessions == None:
+            return duration
+        return f'{sessions} D'
+
+
+    def firstSession(self, duration:str, d:date) -> Optional[date]:
+        """First session of a view ending with d, None for year durations."""
+        sessions = self.sessionCount(duration)
+        if sessions == None:
+            return None
+        last = self.sessionOnOrBefore(d)
+        return self.previousSession(last, sessions - 1) if sessions > 1 else last
+
+
+# Shared calendar of the exchange
+NYSE = TradingCalendar()
@@ -1,7 +1,22 @@
+import os
+import subprocess
+
+
 def parseBool(value) -> bool:
 	if isinstance(value, bool):
 		return value
 	elif isinstance(value, str):
 		if len(value) > 0 and value.lower() in ['1', 'true', 't', 'yes', 'y']:
 			return True
-	return False
\ No newline at end of file
+	return False
+
+
+def gitCommit(path:str=None) -> str:
+	"""Short hash of the checked out commit, "-dirty" appended for uncommitted changes, None outside of git."""
+	path = os.path.dirname(os.path.abspath(__file__)) if path == None else path
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+		dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+		return commit + ('-dirty' if dirty != '' else '')
+	except:
+		return None
\ No newline at end of file
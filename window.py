@@ -1,54 +1,107 @@
 import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 import sys
+import json
+import math
 import logging
+from time import perf_counter
+import numpy as np
 import pandas as pd
+from typing import Dict, List, Tuple
 from zoneinfo import ZoneInfo
 from datetime import date, time, datetime, timedelta
 
 # Charting
 from lightweight_charts import Chart
+from lightweight_charts.abstract import Line
 from lightweight_charts.drawings import HorizontalLine
 from lightweight_charts.topbar import ButtonWidget, MenuWidget, SwitcherWidget
 
 from colors import *
-from indicators import indicatorFactory, getCandleType
-from generic_client import GenericClient, ObjectType, QueueObject
-
-
-TF_DURATION_MAP = {
-    '1 day':'5 Y',
-    '1 min':'1 D',
-    '2 mins':'1 D',
-    '3 mins':'1 D',
-    '5 mins':'1 D',
-    '10 mins':'1 W',
-    '15 mins':'1 W',
-    '20 mins':'1 M',
-    '30 mins':'1 M',
-    '1 hour':'3 M',
-    '2 hours':'3 M',
-    '3 hours':'6 M',
-    '4 hours':'6 M'
+from bar_buffer import BarBuffer, columnsToFrame
+from bar_store import BAR_COLUMNS
+from indicators import IndicatorPipeline
+from setup_features import setupFeatures, closestRows, SETUP_OUTPUTS
+from indicator_cache import IndicatorCache, dataFingerprint
+from budget_cache import BudgetCache
+from streaming_indicators import StreamingIndicatorFactory
+from generic_client import GenericClient, ObjectType, QueueObject, RequestPriority
+from setup_journal import SetupJournal
+from setup_db import SetupDatabase
+from trading_calendar import NYSE
+from statics import TF_DURATION_MAP
+from metrics import METRICS
+from profiler import PROFILER
+
+
+# Chart lines, pane 0 is the price chart
+CHART_LINES = [
+    {'name': 'VWAP', 'color': VWAP_COLOR, 'width': 2, 'pane': 0},
+    {'name': 'EMA', 'color': EMA_COLOR, 'width': 1, 'pane': 0},
+    {'name': 'SMA', 'color': SMA_COLOR, 'width': 2, 'pane': 0},
+    {'name': 'BB_UPPER1', 'color': BB_COLOR, 'width': 1, 'pane': 0},
+    {'name': 'BB_UPPER2', 'color': BB_COLOR, 'width': 1, 'pane': 0},
+    {'name': 'BB_LOWER1', 'color': BB_COLOR, 'width': 1, 'pane': 0},
+    {'name': 'BB_LOWER2', 'color': BB_COLOR, 'width': 1, 'pane': 0},
+    {'name': 'KC_UPPER', 'color': KC_COLOR, 'width': 1, 'pane': 0},
+    {'name': 'KC_LOWER', 'color': KC_COLOR, 'width': 1, 'pane': 0},
+    # TODO: Dot style not available
+    #{'name': 'PSAR', 'color': PSAR_COLOR, 'width': 1, 'pane': 0, 'style': 'dotted'},
+    {'name': 'ADX', 'color': ADX_COLOR, 'width': 1, 'pane': 1, 'hlines': [(12, '12'), (20, '20')]},
+    {'name': 'DMIM', 'color': DMIM_COLOR, 'width': 1, 'pane': 1},
+    {'name': 'DMIP', 'color': DMIP_COLOR, 'width': 1, 'pane': 1},
+    {'name': 'BB_PC', 'color': BBPC_COLOR, 'width': 1, 'pane': 2, 'hlines': [(3, '+3'), (2, '+2'), (0, '0'), (-2, '-2'), (-3, '-3')]},
+    {'name': 'RSI', 'color': RSI_COLOR, 'width': 1, 'pane': 3, 'hlines': [(50, '50'), (70, '70'), (30, '30')]}
+]
+
+INDICATOR_PANES = {
+    'ADX': 1,
+    'BB%': 2,
+    'RSI': 3
 }
 
 
+# Seconds between checks if the chart window is still open
+CHART_WATCH_INTERVAL = 0.25
+# Maximum number of queue objects handled at once
+QUEUE_BATCH_SIZE = 256
+# Bars sent to the chart at once, older bars are added while scrolling back
+PAGE_BARS = 1000
+# Load the next page if less bars than this are left before the visible range
+PAGE_THRESHOLD = 200
+# Decimals of prices and indicator values sent to the chart
+PAYLOAD_DECIMALS = 6
+
+
 class Window():
 
-    def __init__(self, client:GenericClient):
+    def __init__(self, client:GenericClient, indicatorCacheMB:int=256, prefetchDays:int=2, chart:Chart=None):
         self.logger = logging.getLogger(__name__)
         # Set correct log level
         self.logger.setLevel('INFO')
         self.client = client
         self.dataQueue:asyncio.Queue = client.dataQueue
         self.data:pd.DataFrame = None
+        self.bars:BarBuffer = None	# Raw bars of the current chart
+        self.stream:StreamingIndicatorFactory = None	# Incremental indicators for live updates
+        self.requestedEndDate:str = None	# IB end date of the shown chart
+        self.requestedDuration:str = None	# IB duration of the shown chart
+        self.shownFrom:int = 0	# Index of the first bar of self.data on the chart
+        self.extending:bool = False	# Longer history requested
+        self.historyComplete:bool = False	# No older bars available
+        self.loadStarted:float = None	# perf_counter of the last getBarData, for the load metric
         
-        self.setups:pd.DataFrame = pd.DataFrame()
-        if os.path.exists('setups.json'):
-            self.setups = pd.read_json('setups.json')
-
-        # Price Charts
-        self.chart = Chart(title='EdgeMiner', inner_height=1, inner_width=1, toolbox=True, maximize=True, debug=False)
+        # Setups are appended to a journal and compacted to setups.json/.csv in the background
+        self.setupJournal = SetupJournal('setups.json', 'setups.csv')
+        self.setups:pd.DataFrame = self.setupJournal.load()
+        # Indexed database for marker and analysis queries, setups without id get a stable id, importing again skips them
+        self.setupDb = SetupDatabase('setups.db')
+        if len(self.setups) > 0 and self.setupDb.count() < len(self.setups):
+            self.logger.info(f'Import {self.setupDb.insertFrame(self.setups)} setups into setups.db')
+
+        # Price Charts, a different chart can be passed in for benchmarks without webview
+        self.chart = Chart(title='EdgeMiner', inner_height=1, inner_width=1, toolbox=True, maximize=True, debug=False) if chart == None else chart
         self.chart.watermark('ctrl+f to load ticker', font_size=35, color=WATERMARK_COLOR)
         self.chart.volume_config(up_color=VOLUME_UP_COLOR, down_color=VOLUME_DOWN_COLOR)
         self.chart.topbar.textbox('textbox-ticker', '')
@@ -69,7 +122,7 @@ class Window():
         # Current watched date
         self.chart.topbar.textbox('sep3', '|')
         self.chart.topbar.button('button-prev-day', '⏮️', func=self.onPrevDay)
-        self.currentDate = date.today() - timedelta(days=1)
+        self.currentDate = NYSE.previousSession(date.today())
         self.chart.topbar.textbox('textbox-date', self.currentDate.isoformat())	# |<< 2025-08-02 >>|
         self.chart.topbar.button('button-next-day', '⏭️', func=self.onNextDay)
 
@@ -78,40 +131,27 @@ class Window():
 
         self.chart.topbar.button('button-info', 'ℹ️', align='right', func=self.onInfoClick)
 
-        self.vwapLine = self.chart.create_line('VWAP', color=VWAP_COLOR, width=2, price_line=False, price_label=False)
-        self.emaLine = self.chart.create_line('EMA', color=EMA_COLOR, width=1, price_line=False, price_label=False)
-        self.smaLine = self.chart.create_line('SMA', color=SMA_COLOR, width=2, price_line=False, price_label=False)
-        self.bb1uLine = self.chart.create_line('BB_UPPER1', color=BB_COLOR, width=1, price_line=False, price_label=False)
-        self.bb2uLine = self.chart.create_line('BB_UPPER2', color=BB_COLOR, width=1, price_line=False, price_label=False)
-        self.bb1lLine = self.chart.create_line('BB_LOWER1', color=BB_COLOR, width=1, price_line=False, price_label=False)
-        self.bb2lLine = self.chart.create_line('BB_LOWER2', color=BB_COLOR, width=1, price_line=False, price_label=False)
-        self.kcUpper = self.chart.create_line('KC_UPPER', color=KC_COLOR, width=1, price_line=False, price_label=False)
-        self.kcLower = self.chart.create_line('KC_LOWER', color=KC_COLOR, width=1, price_line=False, price_label=False)
-        # TODO: Dot style not available
-        #self.psarLine = self.chart.create_line('PSAR', color=PSAR_COLOR, width=1, price_line=False, price_label=False, style='dotted')
-
-        # Indicators
-        # ADX
-        self.adxLine = self.chart.create_line('ADX', color=ADX_COLOR, price_line=False, width=1, pane_index=1)
-        self.dmimLine = self.chart.create_line('DMIM', color=DMIM_COLOR, price_line=False, width=1, pane_index=1)
-        self.dmipLine = self.chart.create_line('DMIP', color=DMIP_COLOR, price_line=False, width=1, pane_index=1)
-        # Add horizontal lines to ADX indicator
-        self.adxLine.horizontal_line(12, text='12', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        self.adxLine.horizontal_line(20, text='20', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        # BB%
-        self.bbpcLine = self.chart.create_line('BB_PC', color=BBPC_COLOR, price_line=False, width=1, pane_index=2)
-        # Add horizontal lines to BB% indicator
-        self.bbpcLine.horizontal_line(3, text='+3', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        self.bbpcLine.horizontal_line(2, text='+2', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        self.bbpcLine.horizontal_line(0, text='0', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        self.bbpcLine.horizontal_line(-2, text='-2', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        self.bbpcLine.horizontal_line(-3, text='-3', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        # RSI
-        self.rsiLine = self.chart.create_line('RSI', color=RSI_COLOR, price_line=False, width=1, pane_index=3)
-        # Add horizontal lines to RSI indicator
-        self.rsiLine.horizontal_line(50, text='50', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        self.rsiLine.horizontal_line(70, text='70', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
-        self.rsiLine.horizontal_line(30, text='30', color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)		
+        # Indicator lines, only visible lines are computed
+        self.chart.topbar.menu('menu-panes', tuple(['All Panes'] + list(INDICATOR_PANES.keys()) + ['Price Only']), default='All Panes', func=self.onPaneSelection)
+        self.lines:Dict[str, Line] = {}
+        for l in CHART_LINES:
+            line = self.chart.create_line(l['name'], color=l['color'], width=l['width'], price_line=False, price_label=l['pane'] > 0, pane_index=l['pane'] if l['pane'] > 0 else None)
+            for value, text in l.get('hlines', []):
+                line.horizontal_line(value, text=text, color=HLINE_COLOR, width=1, style='solid', axis_label_visible=False)
+            self.lines[l['name']] = line
+        self.hiddenPanes:set = set()
+        # Computed indicators of recently shown charts
+        self.pipeline = IndicatorPipeline(cache=IndicatorCache(indicatorCacheMB*1024*1024))
+        self.dataVersion:tuple = None	# symbol,timeframe,date,fingerprint of the shown bars
+        self.frame:pd.DataFrame = None	# Raw bars of the current chart as DataFrame
+        self.features:pd.DataFrame = None	# Setup features of every bar
+        self.featuresVersion:tuple = None
+        # Bars of the neighbour days, ⏮️/⏭️ shows them without waiting for TWS
+        self.prefetchDays = prefetchDays
+        self.prefetched = BudgetCache(indicatorCacheMB*1024*1024 // 4, BarBuffer.nbytes)	# symbol,timeframe,endDate -> BarBuffer
+        # Indicators of prefetched days are computed off the UI thread, one at a time, into their own state
+        self.prefetchPipeline = IndicatorPipeline()
+        self.prefetchExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
 
         # Resize the main chart pane
         self.chart.resize_pane(0, 600)
@@ -127,6 +167,8 @@ class Window():
         self.chart.hotkey('ctrl', 's', self.onHotkeyScreenshot)
         self.chart.hotkey('ctrl', 'm', self.onHotkeyToggleMarker)
         self.chart.hotkey('ctrl', 'r', self.onHotkeyClearAll)
+        self.chart.hotkey('ctrl', 'l', self.onHotkeyMetrics)
+        self.chart.hotkey('ctrl', 'p', self.onHotkeyProfile)
 
 
     async def run(self):
@@ -140,46 +182,118 @@ class Window():
             self.logger.debug('run() END')
         except:
             self.logger.exception('run: EXCEPTION')
+        finally:
+            # Write the journaled setups to setups.json/.csv
+            self.setupJournal.close()
+            self.setupDb.close()
+            self.prefetchExecutor.shutdown(wait=False, cancel_futures=True)
 
 
     async def queueHandler(self):
         self.logger.debug('queueHandler started')
         self.client.start()
-        while self.chart.is_alive:
-            try:
-                while self.dataQueue.empty():
-                    # Exit if chart window is no longer shown
-                    if not self.chart.is_alive:
-                        return
-                    await asyncio.sleep(0.05)
-
-                qo:QueueObject = await self.dataQueue.get()
-
-                # Exit if chart window is no longer shown
-                if not self.chart.is_alive:
-                    return
-
-                self.logger.debug(f'Got queue object type: {qo.type} for {qo.symbol}')
-
-                if qo.type == ObjectType.Message:
-                    self.showMessage(qo.stringData)
-
-                elif qo.type == ObjectType.HistoricalData:
-                    sym = qo.symbol
-                    currentSym = self.chart.topbar['textbox-ticker'].value
-                    # Convert list data to Pandas DataFrame and save
-                    if sym == currentSym:
-                        df = pd.DataFrame(qo.listData)
-                        if qo.timeframe == self.chart.topbar['menu-timeframe'].value:
-                            self.updateChart(df, qo.symbol)
-                else:
-                    self.logger.warning('queueHandler: Unkown queue object type!')
-            except:
-                self.logger.exception('queueHandler: EXCEPTION')
+        consumer = asyncio.create_task(self.consumeQueue())
+        # Exit if chart window is no longer shown
+        while self.chart.is_alive and not consumer.done():
+            await asyncio.sleep(CHART_WATCH_INTERVAL)
+        consumer.cancel()
         self.logger.info('Chart closed, end application...')
         sys.exit()
 
 
+    async def consumeQueue(self):
+        while True:
+            # Wait for data, then take everything which is already queued
+            batch = [await self.dataQueue.get()]
+            while not self.dataQueue.empty() and len(batch) < QUEUE_BATCH_SIZE:
+                batch.append(self.dataQueue.get_nowait())
+            for qo in self.coalesce(batch):
+                try:
+                    self.handleQueueObject(qo)
+                except:
+                    self.logger.exception('queueHandler: EXCEPTION')
+
+
+    def isDisplayed(self, qo:QueueObject) -> bool:
+        """True if the queue object belongs to the chart which is shown."""
+        if not self.isDisplayedSeries(qo):
+            return False
+        return qo.endDate == None or self.requestedEndDate == None or qo.endDate == self.requestedEndDate
+
+
+    def isDisplayedSeries(self, qo:QueueObject) -> bool:
+        """True if the queue object has the symbol and timeframe of the shown chart, any date."""
+        return qo.symbol == self.chart.topbar['textbox-ticker'].value.upper() and qo.timeframe == self.chart.topbar['menu-timeframe'].value
+
+
+    def coalesce(self, batch:List[QueueObject]) -> List[QueueObject]:
+        """Drop queue objects which would be overwritten or are not displayed anymore.
+
+        Only the newest historical data per symbol,timeframe is kept, live bars
+        before it are part of it. Messages are always kept.
+        """
+        newest:Dict[Tuple[str, str], int] = {}
+        for i, qo in enumerate(batch):
+            if qo.type == ObjectType.HistoricalData:
+                newest[(qo.symbol, qo.timeframe)] = i
+        result = []
+        for i, qo in enumerate(batch):
+            if qo.type == ObjectType.Message:
+                result.append(qo)
+            elif qo.type == ObjectType.PrefetchData:
+                if self.isDisplayedSeries(qo):
+                    result.append(qo)
+            elif not self.isDisplayed(qo) or i < newest.get((qo.symbol, qo.timeframe), -1):
+                self.logger.debug(f'coalesce: Drop {qo.type} for {qo.symbol} {qo.timeframe}')
+            else:
+                result.append(qo)
+        return result
+
+
+    def handleQueueObject(self, qo:QueueObject) -> None:
+        self.logger.debug(f'Got queue object type: {qo.type} for {qo.symbol}')
+        METRICS.record('queue.wait', perf_counter() - qo.createdAt)
+
+        if qo.type == ObjectType.Message:
+            self.showMessage(qo.stringData)
+
+        elif qo.type == ObjectType.HistoricalData:
+            # Convert bar data to Pandas DataFrame and save
+            with METRICS.span('window.frame'):
+                if qo.columnData != None:
+                    # Views of the received columns, copied when a live bar arrives
+                    bars = BarBuffer.wrap(qo.columnData)
+                    df = columnsToFrame(qo.columnData)
+                else:
+                    bars = None
+                    df = pd.DataFrame(qo.listData)
+            self.bars = bars
+            self.stream = None
+            self.frame = df
+            self.dataVersion = self.viewVersion(df)
+            if self.extending:
+                self.extending = False
+                self.extendChart(df)
+            else:
+                self.updateChart(df, qo.symbol)
+            if self.loadStarted != None:
+                # Until the user sees the chart, TWS included
+                METRICS.record('window.load', perf_counter() - self.loadStarted)
+                self.loadStarted = None
+            if bars != None and qo.endDate != None and self.isClosedDay(qo.endDate):
+                # Going back to this day does not need TWS either
+                self.prefetched.put(self.prefetchKey(qo.symbol, qo.timeframe, qo.endDate), BarBuffer.wrap(qo.columnData))
+            self.prefetchNeighbours()
+
+        elif qo.type == ObjectType.PrefetchData:
+            self.storePrefetch(qo)
+
+        elif qo.type in [ObjectType.BarAppend, ObjectType.BarUpdate]:
+            self.updateLastBar(qo.barData, qo.type == ObjectType.BarAppend)
+        else:
+            self.logger.warning('queueHandler: Unkown queue object type!')
+
+
     def showMessage(self, msg:str) -> None:
         """Show a single line of alert message using JavaScript
 
@@ -224,7 +338,7 @@ class Window():
                 newDate = self.currentDate
                 if len(parts) > 1:
                     # ticker and date
-                    newTicker = parts[0]
+                    newTicker = parts[0].upper()
                     newDate = date.fromisoformat(parts[1])
                 else:
                     # only ticker
@@ -234,7 +348,7 @@ class Window():
                         newDate = temp
                     except:
                         # Otherwise use input as new ticker
-                        newTicker = parts[0]
+                        newTicker = parts[0].upper()
 
                 if newTicker != self.currentTicker or newDate != self.currentDate:
                     # Save new data and request
@@ -249,16 +363,31 @@ class Window():
     def getBarData(self):
         try:
             self.logger.debug(f'getBarData()')
+            self.loadStarted = perf_counter()
             self.chart.watermark('loading...', color=WATERMARK_COLOR)
-            self.onClearAll(self.chart)
+            # Weekends and holidays show the session before, TWS would return it anyway
+            self.currentDate = NYSE.sessionOnOrBefore(self.currentDate)
+            # Markers are replaced after loading, only changed markers are sent then
+            self.clearRiskLine()
             self.chart.topbar['textbox-ticker'].set(self.currentTicker)
             self.chart.topbar['textbox-date'].set(self.currentDate.isoformat())
             self.chart.spinner(True)
+            # The running session is requested until now, TWS keeps its last bar up to date
+            self.requestedEndDate = self.currentDate.strftime('%Y%m%d 23:59:59 US/Eastern') if NYSE.isClosed(self.currentDate) else ''
+            self.requestedDuration = NYSE.viewDuration(TF_DURATION_MAP[self.currentTimeframe])
+            self.extending = False
+            self.historyComplete = False
+            bars = self.prefetched.get(self.prefetchKey(self.currentTicker, self.currentTimeframe, self.requestedEndDate)) if self.isClosedDay(self.requestedEndDate) else None
+            if bars != None:
+                # Prefetched day, no need to ask TWS
+                self.handleQueueObject(QueueObject(ObjectType.HistoricalData, symbol=self.currentTicker.upper(), timeframe=self.currentTimeframe,
+                                                   columnData=bars.columns(), endDate=self.requestedEndDate))
+                return
             self.client.requestData(
                 self.currentTicker,
                 self.currentTimeframe,
-                TF_DURATION_MAP[self.currentTimeframe],
-                self.currentDate.strftime('%Y%m%d 23:59:59 US/Eastern')
+                self.requestedDuration,
+                self.requestedEndDate
             )
         except:
             self.logger.exception('getBarData: EXCEPTION')
@@ -267,10 +396,13 @@ class Window():
     # called when we want to update what is rendered on the chart
     def updateChart(self, df:pd.DataFrame, symbol:str):
         try:
-            # Calculate all data
-            chartData = indicatorFactory(df)
-            # Update chart candles
-            self.chart.set(chartData)
+            # Calculate the visible indicators
+            with METRICS.span('window.indicators'):
+                chartData = self.pipeline.compute(df, self.chartOutputs(), version=self.dataVersion)
+            self.logger.debug(f'updateChart: indicator cache {self.pipeline.cache.stats()}')
+            # Only the newest bars, older pages follow while scrolling back
+            self.shownFrom = max(0, len(chartData) - PAGE_BARS)
+            self.renderFrame(chartData.iloc[self.shownFrom:])
             self.chart.legend(visible=True, lines=False, color_based_on_candle=True)
             # Remove loading
             self.chart.watermark(f'{symbol} - {self.currentTimeframe} - {self.currentDate.isoformat()}', color=WATERMARK_COLOR)
@@ -283,6 +415,181 @@ class Window():
         self.updateMarkers()
 
 
+    def updateLastBar(self, bar:dict, append:bool) -> None:
+        """Apply a single live bar and only redraw the last candle and indicator values.
+
+        Indicators are updated incrementally, so the cost does not grow with the history.
+
+        Args:
+            bar (dict): Bar with **time** as wall clock seconds.
+            append (bool): True if a new bar started, False if the last bar changed.
+        """
+        start = perf_counter()
+        try:
+            if self.bars == None or len(self.bars) == 0 or self.data is None:
+                return
+            if self.stream == None:
+                # First live bar for this chart, replay the history once
+                self.stream = StreamingIndicatorFactory()
+                self.stream.warmup(self.bars.columns())
+            if append:
+                self.bars.appendValues(**bar)
+                row = self.stream.append(bar)
+            elif self.bars.lastTime() == bar['time']:
+                self.bars.replaceLastValues(**bar)
+                row = self.stream.revise(bar)
+            else:
+                self.logger.warning(f'updateLastBar: Bar does not match the last bar, time={bar["time"]}')
+                return
+            # History changed, cached indicators are outdated
+            self.pipeline.cache.invalidate(self.dataVersion)
+            self.dataVersion = None
+            self.frame = None
+            if not self.stream.isComplete(row):
+                # Indicators of the new bar not available yet
+                return
+            row['time'] = pd.Timestamp(bar['time'], unit='s')
+            last = pd.Series(row)
+            self.chart.update(last[BAR_COLUMNS])
+            for name in self.chartOutputs():
+                self.lines[name].update(last[['time', name]])
+
+            # Keep the chart data in sync for setups
+            row = {c: row[c] for c in self.data.columns}
+            if len(self.data) > 0 and self.data['time'].iloc[-1] == row['time']:
+                self.data.iloc[-1] = pd.Series(row)
+            else:
+                self.data.loc[len(self.data)] = row
+        except:
+            self.logger.exception('updateLastBar: EXCEPTION')
+        finally:
+            METRICS.record('window.liveUpdate', perf_counter() - start)
+
+
+    def chartOutputs(self) -> List[str]:
+        """Names of the indicator lines in visible panes."""
+        return [l['name'] for l in CHART_LINES if l['pane'] not in self.hiddenPanes]
+
+
+    def barFrame(self) -> pd.DataFrame:
+        """Raw bars of the current chart, the input of the indicator pipeline."""
+        if self.frame is None and self.bars != None:
+            self.frame = columnsToFrame(self.bars.columns())
+            self.dataVersion = self.viewVersion(self.frame)
+        return self.frame
+
+
+    def viewVersion(self, df:pd.DataFrame, symbol:str=None, timeframe:str=None, day:date=None) -> tuple:
+        """Cache key of the indicators for the given bars, defaults to the shown chart."""
+        # The client sends upper case symbols, the textbox shows what the user typed
+        symbol = (self.chart.topbar['textbox-ticker'].value if symbol == None else symbol).upper()
+        timeframe = self.chart.topbar['menu-timeframe'].value if timeframe == None else timeframe
+        day = self.currentDate if day == None else day
+        return (symbol, timeframe, day.isoformat(), dataFingerprint(df))
+
+
+    @staticmethod
+    def prefetchKey(symbol:str, timeframe:str, endDate:str) -> tuple:
+        return (symbol.upper(), timeframe.lower(), endDate)
+
+
+    def prefetchNeighbours(self) -> None:
+        """Request the previous and next sessions of the shown chart at low priority.
+
+        Sessions which are already prefetched or not closed yet are skipped, the
+        data of a running session would be outdated before the user gets there.
+        """
+        try:
+            if self.prefetchDays <= 0 or self.currentTicker == '':
+                return
+            for offset in range(1, self.prefetchDays+1):
+                # Closest days first, the scheduler keeps the order within a priority
+                for day in [NYSE.previousSession(self.currentDate, offset), NYSE.nextSession(self.currentDate, offset)]:
+                    if not NYSE.isClosed(day):
+                        continue
+                    endDate = day.strftime('%Y%m%d 23:59:59 US/Eastern')
+                    if self.prefetchKey(self.currentTicker, self.currentTimeframe, endDate) in self.prefetched:
+                        continue
+                    self.client.requestData(
+                        self.currentTicker,
+                        self.currentTimeframe,
+                        NYSE.viewDuration(TF_DURATION_MAP[self.currentTimeframe]),
+                        endDate,
+                        priority=RequestPriority.PREFETCH
+                    )
+        except:
+            self.logger.exception('prefetchNeighbours: EXCEPTION')
+
+
+    @staticmethod
+    def isClosedDay(endDate:str) -> bool:
+        """True if the session of the IB end date is closed, its bars do not change anymore."""
+        return endDate != '' and NYSE.isClosed(datetime.strptime(endDate[:8], '%Y%m%d').date())
+
+
+    def storePrefetch(self, qo:QueueObject) -> None:
+        """Keep the bars of a prefetched day and calculate its indicators in the background."""
+        if not self.isClosedDay(qo.endDate):
+            return
+        day = datetime.strptime(qo.endDate[:8], '%Y%m%d').date()
+        bars = BarBuffer.wrap(qo.columnData)
+        self.prefetched.put(self.prefetchKey(qo.symbol, qo.timeframe, qo.endDate), bars)
+        df = columnsToFrame(qo.columnData)
+        # Same key as updateChart uses once the day is shown
+        version = self.viewVersion(df, qo.symbol, qo.timeframe, day)
+        self.prefetchExecutor.submit(self.precompute, df, self.chartOutputs(), version)
+
+
+    def precompute(self, df:pd.DataFrame, outputs:List[str], version:tuple) -> None:
+        """Calculate the indicators of a prefetched day on the prefetch thread.
+
+        Every day gets a new state which is only handed to the shared cache when
+        it is complete, afterwards only the UI thread changes it.
+        """
+        try:
+            self.prefetchPipeline.compute(df, outputs)
+            with self.pipeline.cache.lock:
+                if version not in self.pipeline.cache:
+                    self.pipeline.cache.put(version, self.prefetchPipeline.state)
+            self.logger.debug(f'precompute: {version[:3]} ready')
+        except:
+            self.logger.exception('precompute: EXCEPTION')
+
+
+    def setupData(self) -> pd.DataFrame:
+        """Bars with all indicators needed for setups, hidden panes included."""
+        if self.barFrame() is None:
+            return self.data
+        return self.pipeline.compute(self.frame, SETUP_OUTPUTS, version=self.dataVersion)
+
+
+    def setupFeatureData(self) -> pd.DataFrame:
+        """Feature matrix of the current chart, calculated once per data version."""
+        data = self.setupData()
+        if self.features is None or self.featuresVersion == None or self.featuresVersion != self.dataVersion:
+            self.features = setupFeatures(data)
+            self.featuresVersion = self.dataVersion
+        return self.features
+
+
+    def onPaneSelection(self, chart:Chart):
+        selection = self.chart.topbar['menu-panes'].value
+        if selection == 'All Panes':
+            self.hiddenPanes = set()
+        elif selection == 'Price Only':
+            self.hiddenPanes = set(INDICATOR_PANES.values())
+        else:
+            self.hiddenPanes = set(INDICATOR_PANES.values()) - {INDICATOR_PANES[selection]}
+        for l in CHART_LINES:
+            if l['pane'] in self.hiddenPanes:
+                self.lines[l['name']].hide_data()
+            else:
+                self.lines[l['name']].show_data()
+        if self.barFrame() is not None:
+            # Newly visible indicators have to be calculated
+            self.updateChart(self.frame, self.chart.topbar['textbox-ticker'].value)
+
+
     # get new bar data when the user changes timeframes
     def onTimeframeSelection(self, chart:Chart):
         self.logger.debug('selected timeframe -> NOT IMPLEMENTED')
@@ -333,78 +640,18 @@ class Window():
                 d['direction'] = 'short'
                 self.chart.marker(dt.timestamp()*1000, 'above', 'arrow_down', SELL_MARKER_COLOR)
 
-            # Closest row
-            pos = self.data['time'].searchsorted(dt)
-            if pos == 0:
-                closest_idx = 0
-            elif pos == len(self.data):
-                closest_idx = len(self.data) - 1
-            else:
-                before, after = self.data.iloc[pos-1], self.data.iloc[pos]
-                closest_idx = pos-1 if abs(before['time'] - dt) <= abs(after['time'] - dt) else pos
+            # Setups need all indicators, also those of hidden panes
+            data = self.setupFeatureData()
 
-            closest_row = self.data.iloc[closest_idx].to_dict()
+            # Closest row
+            closest_idx = closestRows(data['time'].to_numpy(), [np.datetime64(dt)])[0]
 
-            # Row before closest (with prefix p)
-            before_row = (
-                self.data.iloc[closest_idx - 1].to_dict() if closest_idx > 0 else {}
-            )
-            before_row_prefixed = {f'p{k}': v for k, v in before_row.items()}
-
-            # Combine
-            d = {**d, **closest_row, **before_row_prefixed}
-
-            # Calculate additional states
-            # percent change
-            d['GAP_PC'] = (d['open']/d['pclose']-1.0)*100.0
-            d['CHANGE_PC'] = (d['close']/d['open']-1.0)*100.0
-            d['pCHANGE_PC'] = (d['pclose']/d['popen']-1.0)*100.0
-            # Volume SMA rising
-            d['VOL_SMA_RISING'] = d['VOL_SMA'] > d['pVOL_SMA']
-            # Volume Multiple vol/volSma
-            d['VOL_MULTIPLE'] = d['volume'] / d['VOL_SMA']
-            d['pVOL_MULTIPLE'] = d['pvolume'] / d['pVOL_SMA']
-            # SMA, EMA
-            d['EMA_RISING'] = d['EMA'] > d['pEMA']
-            d['SMA_RISING'] = d['SMA'] > d['pSMA']
-            d['OVER_EMA'] = d['close'] > d['EMA']
-            d['OVER_SMA'] = d['close'] > d['SMA']
-            d['pOVER_EMA'] = d['pclose'] > d['pEMA']
-            d['pOVER_SMA'] = d['pclose'] > d['pSMA']
-            d['EMA_OVER_SMA'] = d['EMA'] > d['SMA']
-            d['pEMA_OVER_SMA'] = d['pEMA'] > d['pSMA']
-            # BB, KC
-            d['BB_PC_RISING'] = d['BB_PC'] > d['pBB_PC']
-            d['KC_INSIDE_BB'] = d['BB_UPPER1'] > d['KC_UPPER']
-            d['pKC_INSIDE_BB'] = d['pBB_UPPER1'] > d['pKC_UPPER']
-            # ATR rising
-            d['ATR_RISING'] = d['ATR'] > d['pATR']
-            # ADX, DMIs rising
-            d['ADX_RISING'] = d['ADX'] > d['pADX']
-            d['DMIP_RISING'] = d['DMIP'] > d['pDMIP']
-            d['DMIM_RISING'] = d['DMIM'] > d['pDMIM']
-            d['DMI_DIFFERENCE'] = d['DMIP'] - d['DMIM']
-            d['pDMI_DIFFERENCE'] = d['pDMIP'] - d['pDMIM']
-            # RSI Rising
-            d['RSI_RISING'] = d['RSI'] > d['pRSI']
-            # PSAR Bull
-            d['PSAR_BULL'] = d['PSAR'] < d['low']
-            d['pPSAR_BULL'] = d['pPSAR'] < d['plow']
-            # Candle Type
-            d['CANDLE_TYPE'] = getCandleType(d['open'], d['high'], d['low'], d['close'])
-            d['pCANDLE_TYPE'] = getCandleType(d['popen'], d['phigh'], d['plow'], d['pclose'])
-            # insideCandle
-            d['INSIDE_CANDLE'] = d['high'] < d['phigh'] and d['low'] < d['plow']
-            d['OUTSIDE_CANDLE'] = d['high'] > d['phigh'] and d['low'] > d['plow']
-
-            # Add all the data to the dict
-            if len(self.setups) == 0:
-                self.setups = pd.DataFrame(d, index=[0])
-            else:
-                self.setups.loc[len(self.setups)] = d
+            # Bar values, values of the bar before (with prefix p) and derived features
+            d = {**d, **data.iloc[closest_idx].to_dict()}
 
-            self.setups.to_json('setups.json')
-            self.setups.to_csv('setups.csv')
+            # Journal the setup for setups.json/.csv and insert it into the database
+            record = self.setupJournal.append(d)
+            self.setupDb.insert(record)
         except Exception as e:
             self.showMessage(f'Unable to save setups.json, check logs!')
             self.logger.exception('addSetup: EXCEPTION')
@@ -412,6 +659,144 @@ class Window():
 
     def onRangeChange(self, chart:Chart, barsBefore, barsAfter):
         self.logger.debug(f'onRangeChange({barsBefore}, {barsAfter})')
+        try:
+            if self.data is None or len(self.data) == 0 or barsBefore > PAGE_THRESHOLD:
+                return
+            if self.shownFrom > 0:
+                self.prependPage()
+            elif not self.extending and not self.historyComplete:
+                self.extendHistory()
+        except:
+            self.logger.exception('onRangeChange: EXCEPTION')
+
+
+    def prependPage(self) -> None:
+        """Add the next older page of already calculated bars to the chart."""
+        start = max(0, self.shownFrom - PAGE_BARS)
+        page = self.data.iloc[start:self.shownFrom]
+        self.shownFrom = start
+        self.chart.run_script(self.frameScript(page, prepend=True))
+        self.logger.debug(f'prependPage: {len(page)} bars, {self.shownFrom} left')
+
+
+    def renderFrame(self, df:pd.DataFrame) -> None:
+        """Replace candles, volume and the visible indicator lines with a single script.
+
+        Replaces chart.set, which sends every series on its own as list of records.
+        The Python side state of the chart and lines is kept, so update() works as before.
+        """
+        if len(df) == 0:
+            self.chart.set(None)
+            return
+        self.chart._set_interval(df)
+        with METRICS.span('chart.serialize'):
+            script = self.frameScript(df)
+        with METRICS.span('chart.send'):
+            self.chart.run_script(script + f'''
+                if (!{self.chart.id}.chart.priceScale("right")?.options?.autoScale)
+                    {self.chart.id}.chart.priceScale("right").applyOptions({{autoScale: true}})
+                {self.chart.id}.toolBox?.clearDrawings()
+            ''')
+        last = df.iloc[-1]
+        t = int(last['time'].value // 10**9)
+        self.chart._last_bar = pd.Series({'time': t, **{c: last[c] for c in BAR_COLUMNS[1:]}})
+        self.chart.candle_data = self.chart._last_bar.to_frame().T
+        for name in self.frameLines(df):
+            line = self.lines[name]
+            line._last_bar = pd.Series({'time': t, 'value': last[name]})
+            line.data = line._last_bar.to_frame().T
+
+
+    def frameLines(self, df:pd.DataFrame) -> List[str]:
+        return [n for n in self.chartOutputs() if n in df.columns]
+
+
+    @staticmethod
+    def jsArray(values:np.ndarray) -> str:
+        """Compact JSON array of numbers, NaN becomes null."""
+        if values.dtype.kind == 'f':
+            values = np.round(values, PAYLOAD_DECIMALS)
+        return json.dumps(values.tolist()).replace('NaN', 'null')
+
+
+    def frameScript(self, df:pd.DataFrame, prepend:bool=False) -> str:
+        """JavaScript which sets the bars and indicator values of a frame in one call.
+
+        Columns are sent once as arrays with a shared time column, every line only
+        from its first to its last value. The records for the series are built on
+        the JavaScript side.
+
+        Args:
+            df (pd.DataFrame): Bars with indicator columns.
+            prepend (bool, optional): Put the frame in front of the shown data instead of replacing it. Defaults to False.
+
+        Returns:
+            str: Script for chart.run_script.
+        """
+        times = df['time'].to_numpy().astype('datetime64[s]').astype(np.int64)
+        lines = []
+        for name in self.frameLines(df):
+            values = df[name].to_numpy(dtype=np.float64)
+            valid = np.flatnonzero(~np.isnan(values))
+            if len(valid) == 0:
+                lines.append(f'[{self.lines[name].id}.series, 0, []]')
+                continue
+            lines.append(f'[{self.lines[name].id}.series, {valid[0]}, {self.jsArray(values[valid[0]:valid[-1]+1])}]')
+        return f'''(() => {{
+            const t = {self.jsArray(times)}, o = {self.jsArray(df['open'].to_numpy())}, h = {self.jsArray(df['high'].to_numpy())};
+            const l = {self.jsArray(df['low'].to_numpy())}, c = {self.jsArray(df['close'].to_numpy())}, v = {self.jsArray(df['volume'].to_numpy())};
+            const set = (series, items) => series.setData({'items.concat(series.data())' if prepend else 'items'});
+            const candles = new Array(t.length), volume = new Array(t.length);
+            for (let i = 0; i < t.length; i++) {{
+                candles[i] = {{time: t[i], open: o[i], high: h[i], low: l[i], close: c[i]}};
+                volume[i] = {{time: t[i], value: v[i], color: c[i] > o[i] ? '{self.chart._volume_up_color}' : '{self.chart._volume_down_color}'}};
+            }}
+            set({self.chart.id}.series, candles);
+            set({self.chart.id}.volumeSeries, volume);
+            for (const [series, start, values] of [{', '.join(lines)}]) {{
+                // Missing values inside a line are whitespace points like Line.set sends them
+                set(series, values.map((x, i) => x === null ? {{time: t[start+i]}} : {{time: t[start+i], value: x}}));
+            }}
+        }})();
+        '''
+
+
+    def extendHistory(self) -> None:
+        """Request twice the history of the shown chart, it is added in front once loaded."""
+        n, unit = self.requestedDuration.split(' ')
+        n = int(n) * 2
+        if unit == 'D' and n > 365:
+            # IB rejects longer day durations
+            n, unit = math.ceil(n / 250), 'Y'
+        self.requestedDuration = f'{n} {unit}'
+        self.extending = True
+        self.logger.debug(f'extendHistory: {self.requestedDuration}')
+        self.client.requestData(
+            self.currentTicker,
+            self.currentTimeframe,
+            self.requestedDuration,
+            self.requestedEndDate
+        )
+
+
+    def extendChart(self, df:pd.DataFrame) -> None:
+        """Add the older bars of a longer history without touching the shown bars."""
+        try:
+            first = self.data['time'].iloc[self.shownFrom] if self.data is not None and len(self.data) > 0 else None
+            chartData = self.pipeline.compute(df, self.chartOutputs(), version=self.dataVersion)
+            self.data = chartData
+            if first == None:
+                self.updateChart(df, self.currentTicker)
+                return
+            self.shownFrom = int(np.searchsorted(chartData['time'].to_numpy(), np.datetime64(first)))
+            if self.shownFrom == 0:
+                self.historyComplete = True
+                self.logger.debug('extendChart: No older bars')
+                return
+            self.prependPage()
+            self.updateMarkers()
+        except:
+            self.logger.exception('extendChart: EXCEPTION')
 
 
     def onHotkeyScreenshot(self, key:str):
@@ -449,40 +834,65 @@ class Window():
 
 
     def updateMarkers(self) -> None:
+        start = perf_counter()
         try:
-            # Clear all markers
-            self.onClearAll(self.chart)
-
-            if len(self.setups) == 0:
-                return
+            self.clearRiskLine()
 
             # Filter all signals and trades based on current settings
             signalType = self.chart.topbar['switcher-type'].value
-            filter = {
-                'ticker': self.chart.topbar['textbox-ticker'].value,
-                'strategy': self.chart.topbar['menu-strategy'].value,
-                'timeframe': self.chart.topbar['menu-timeframe'].value,
-                'signalType': signalType
-            }
-            currentSetups:pd.DataFrame = self.setups.loc[(self.setups[list(filter)] == pd.Series(filter)).all(axis=1)].copy()
-            # Exit if no setups with the current settings
-            if len(currentSetups) == 0:
-                return
-
-            currentSetups.sort_values('time', ascending=True, inplace=True)
+            currentSetups:pd.DataFrame = self.setupDb.query(
+                ticker=self.chart.topbar['textbox-ticker'].value,
+                strategy=self.chart.topbar['menu-strategy'].value,
+                timeframe=self.chart.topbar['menu-timeframe'].value,
+                signalType=signalType,
+                columns=['time', 'direction']
+            )
 
             if signalType == 'Signal':
-                for idx, s in currentSetups.iterrows():
-                    if s['direction'] == 'long':
-                        self.chart.marker(s['time'], 'below', 'arrow_up', BUY_MARKER_COLOR)               
-                    else:
-                        self.chart.marker(s['time'], 'above', 'arrow_down', SELL_MARKER_COLOR)
+                self.setMarkers(self.signalMarkers(currentSetups))
             else:
                 # TODO: Implement function
-                pass
+                self.setMarkers([])
 
         except:
             self.logger.exception('updateMarkers: EXCEPTION')
+        finally:
+            METRICS.record('chart.markers', perf_counter() - start)
+
+
+    def signalMarkers(self, setups:pd.DataFrame) -> List[dict]:
+        """Chart markers for signal setups, built column wise.
+
+        Args:
+            setups (pd.DataFrame): Setups with **time** as epoch milliseconds and **direction**.
+
+        Returns:
+            List[dict]: Markers in the format of the chart series, sorted by time.
+        """
+        if len(setups) == 0:
+            return []
+        # Same bar alignment as chart.marker()
+        interval = self.chart._interval
+        times = (interval * (setups['time'].to_numpy(dtype=np.float64) / 1000 // interval) + self.chart.offset).astype(np.int64)
+        long = (setups['direction'] == 'long').to_numpy()
+        return pd.DataFrame({
+            'time': times,
+            'position': np.where(long, 'belowBar', 'aboveBar'),
+            'color': np.where(long, BUY_MARKER_COLOR, SELL_MARKER_COLOR),
+            'shape': np.where(long, 'arrowUp', 'arrowDown'),
+            'text': ''
+        }).to_dict('records')
+
+
+    def setMarkers(self, markers:List[dict]) -> None:
+        """Show exactly these markers with a single script call, nothing is sent if they are already shown."""
+        key = lambda m: (m['time'], m['position'])
+        if sorted(markers, key=key) == sorted(self.chart.markers.values(), key=key):
+            return
+        # Marker ids are not needed, the window id generator would grow with every marker
+        self.chart.markers.clear()
+        self.chart.markers.update(enumerate(markers))
+        self.chart.run_script(f'{self.chart.id}.seriesMarkers.setMarkers({json.dumps(markers)})')
 
 
     # handler for the screenshot button
@@ -515,14 +925,18 @@ class Window():
         try:
             # TODO: Only clear current trade
             self.logger.debug(f'onClearAll()')
-            self.chart.clear_markers()
-            if self.riskLine != None:
-                self.deleteHorizontalLine(self.riskLine)
-                self.riskLine = None
+            self.setMarkers([])
+            self.clearRiskLine()
         except:
             self.logger.exception('onDeleteWatchlistClick: EXCEPTION')
 
 
+    def clearRiskLine(self) -> None:
+        if self.riskLine != None:
+            self.deleteHorizontalLine(self.riskLine)
+            self.riskLine = None
+
+
     def deleteHorizontalLine(self, hline:HorizontalLine) -> None:
         try:
             self.logger.debug(f'deleteHorizontalLine() id={hline.id}')
@@ -536,12 +950,38 @@ class Window():
             self.logger.exception(f'deleteHorizontalLine: EXCEPTION!')
 
 
+    def onHotkeyMetrics(self, key:str):
+        """Write the latency metrics to the metrics file and log them."""
+        try:
+            if not METRICS.enabled:
+                self.showMessage('Metrics disabled, set METRICS=true in .env')
+                return
+            snapshot = METRICS.snapshot()
+            for name, s in snapshot['stages'].items():
+                self.logger.info(f'metrics: {name:<24} n={s["count"]:<6} p50={s["p50"]:.2f}ms p95={s["p95"]:.2f}ms p99={s["p99"]:.2f}ms max={s["max"]:.2f}ms')
+            path = METRICS.dump()
+            self.showMessage(f'Saved metrics to {path}' if path != None else 'Metrics written to the log')
+        except:
+            self.logger.exception('onHotkeyMetrics: EXCEPTION')
+
+
+    def onHotkeyProfile(self, key:str):
+        """Start a profiling session or stop it and write the flamegraph file."""
+        try:
+            if PROFILER.loop == None:
+                PROFILER.attach(asyncio.get_running_loop(), self.client)
+            path = PROFILER.toggle()
+            self.showMessage(f'Saved profile {path}' if path != None else 'Profiling, ctrl+p to stop')
+        except:
+            self.logger.exception('onHotkeyProfile: EXCEPTION')
+
+
     def onHotkeyPrevDay(self, key:str):
         self.onPrevDay(self.chart)
 
 
     def onPrevDay(self, chart:Chart):
-        self.currentDate = self.currentDate - timedelta(days=1)
+        self.currentDate = NYSE.previousSession(self.currentDate)
         self.getBarData()
 
 
@@ -550,7 +990,7 @@ class Window():
 
 
     def onNextDay(self, chart:Chart):
-        self.currentDate = self.currentDate + timedelta(days=1)
+        self.currentDate = NYSE.nextSession(self.currentDate)
         self.getBarData()
 
 